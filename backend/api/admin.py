@@ -1,6 +1,19 @@
 from django.contrib import admin, messages
+from django.db import transaction
+from django.http import FileResponse, Http404
+from django.template.response import TemplateResponse
 
-from api.models import QueryExample, SavedQuery, SparqlEndpointConfiguration
+from api.bench import estimate_cost
+from api.capabilities import start_detection
+from api.lint import lint_templates
+from api.models import (
+    TEMPLATE_FIELDS,
+    QueryExample,
+    SavedQuery,
+    SparqlEndpointConfiguration,
+)
+from api.profiling import list_profiles, profile_path
+from api.warmup import start_warmup
 
 
 @admin.action(description="Copy selected configurations")
@@ -29,11 +42,35 @@ def copy_configurations(modeladmin, request, queryset):
     )
 
 
+def show_warnings(modeladmin, request, warnings: list[dict]):
+    for warning in warnings:
+        line = f", line {warning['line']}" if warning["line"] else ""
+        modeladmin.message_user(
+            request,
+            f"{warning['template']}{line}: {warning['message']}",
+            messages.WARNING if warning["severity"] == "warning" else messages.INFO,
+        )
+
+
+# NOTE: not run on save, since each template may take up to
+# TEMPLATE_LINT_TIMEOUT seconds; see bench.estimate_cost
+@admin.action(description="Estimate the cost of the completion templates")
+def estimate_template_cost(modeladmin, request, queryset):
+    for backend in queryset:
+        estimates = estimate_cost(backend, list(TEMPLATE_FIELDS))
+        show_warnings(modeladmin, request, estimates)
+        if not estimates:
+            modeladmin.message_user(
+                request, f"{backend.name}: no templates to estimate (QLever only)."
+            )
+
+
 @admin.register(SparqlEndpointConfiguration)
 class SparqlEndpointConfigurationAdmin(admin.ModelAdmin):
     list_display = ["name", "url", "engine", "is_default", "is_hidden"]
     search_fields = ("name", "slug")
-    actions = [copy_configurations]
+    actions = [copy_configurations, estimate_template_cost]
+    readonly_fields = ["capabilities"]
     fieldsets = (
         (
             "General",
@@ -50,6 +87,24 @@ class SparqlEndpointConfigurationAdmin(admin.ModelAdmin):
                 )
             },
         ),
+        (
+            "SPARQL Proxy",
+            {
+                "fields": (
+                    "proxy_enabled",
+                    "result_cache_ttl",
+                    "max_concurrent_queries",
+                ),
+                "classes": ["collapse"],
+            },
+        ),
+        (
+            "Capabilities",
+            {
+                "fields": ("capabilities",),
+                "classes": ["collapse"],
+            },
+        ),
         (
             "Prefix Map",
             {
@@ -75,6 +130,26 @@ class SparqlEndpointConfigurationAdmin(admin.ModelAdmin):
         ),
     )
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change or {"url", "engine"} & set(form.changed_data):
+            transaction.on_commit(lambda: start_detection(obj))
+        # NOTE: the prefixes are included in the templates
+        changed = set(form.changed_data) & {*TEMPLATE_FIELDS, "prefixes"}
+        templates = [name for name in TEMPLATE_FIELDS if name in changed]
+        show_warnings(
+            self,
+            request,
+            lint_templates(
+                obj.engine, {name: getattr(obj, name) for name in templates}
+            ),
+        )
+        if changed and obj.proxy_enabled:
+            transaction.on_commit(lambda: start_warmup(obj))
+            self.message_user(
+                request, "Warming up the completions of this backend in the background."
+            )
+
 
 @admin.register(QueryExample)
 class QueryExampleAdmin(admin.ModelAdmin):
@@ -85,3 +160,22 @@ class QueryExampleAdmin(admin.ModelAdmin):
 @admin.register(SavedQuery)
 class SavedQueryAdmin(admin.ModelAdmin):
     list_display = ["id", "content"]
+
+
+def profile_list_view(request):
+    """
+    Admin page that lists the captured request profiles; see `profiling.py`.
+    """
+    context = {
+        **admin.site.each_context(request),
+        "title": "Request profiles",
+        "profiles": list_profiles(),
+    }
+    return TemplateResponse(request, "admin/api/profiles.html", context)
+
+
+def profile_download_view(request, name: str):
+    path = profile_path(name)
+    if path is None:
+        raise Http404("Profile not found")
+    return FileResponse(path.open("rb"), as_attachment=True, filename=name)
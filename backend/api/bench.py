@@ -0,0 +1,359 @@
+"""
+Benchmarks of the query templates of a backend.
+
+`sample_cases` draws realistic inputs for each template from the vocabulary
+of the backend (the labels and IRIs of its completion index, or of its top
+subjects and predicates if there is none): search terms are prefixes of
+labels as they are typed, prefixed names where a prefix of the backend
+matches, and contexts are triple patterns with the most frequent
+predicates. The same seed draws the same inputs, so reports of runs with
+different templates can be compared with `compare`.
+
+`benchmark` renders and runs all cases against the endpoint, bypassing the
+proxy and its cache, and reports latency percentiles, result counts,
+timeouts and errors per template. `dry_run` runs a single query the same
+way and returns its result size, time and, for QLever, the runtime
+information of the engine. Both wait for a slot of the backend like proxied
+queries, so they do not crowd out users. `estimate_cost` uses it to report the cost of templates on
+request, see `POST /api/backends/<slug>/templates/estimate`.
+"""
+
+import hashlib
+import http.client
+import json
+import math
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import mean, median
+
+from django.conf import settings
+from django.template import TemplateSyntaxError
+
+from api.completion import _connect, harvest
+from api.models import SparqlEndpointConfiguration
+from api.pool import pools, post_form
+from api.results import SparqlJsonScanner
+from api.scheduler import QueueRejected, scheduler
+from api.sparql import parse_prefixes
+from api.templating import render_query
+from api.warmup import WARMUP_TEMPLATES
+
+SUBJECT = "?qlue_ls_subject"
+VALUE = "?qlue_ls_value"
+ENTITY = "?qlue_ls_entity"
+VOCABULARY_SIZE = 200
+
+
+def vocabulary(backend: SparqlEndpointConfiguration) -> dict[str, list[tuple]]:
+    """The most frequent (iri, label) pairs of subjects and predicates."""
+    connection = _connect(backend.slug)
+    words = {}
+    for kind in ("subject", "predicate"):
+        if connection is not None:
+            words[kind] = connection.execute(
+                "SELECT iri, label FROM entries WHERE kind = ? "
+                "ORDER BY count DESC LIMIT ?",
+                (kind, VOCABULARY_SIZE),
+            ).fetchall()
+        else:
+            words[kind] = [
+                (
+                    row["qlue_ls_entity"]["value"],
+                    row.get("qlue_ls_label", {}).get("value"),
+                )
+                for rows in harvest(backend, kind, VOCABULARY_SIZE)
+                for row in rows
+                if "qlue_ls_entity" in row
+            ]
+    return words
+
+
+def _search_term(rng: random.Random, entries: list[tuple], prefixes: dict) -> dict:
+    """A search term as typed: empty, a prefixed name or a prefix of a label."""
+    iri, label = rng.choice(entries) if entries else (None, None)
+    choice = rng.random()
+    if iri is None or choice < 0.2:
+        return {}
+    if choice < 0.35:
+        for name, namespace in prefixes.items():
+            if iri.startswith(namespace) and len(iri) > len(namespace):
+                local = iri[len(namespace) :]
+                local = local[: rng.randint(1, len(local))]
+                return {
+                    "search_term": f"{name}:{local}",
+                    "search_term_uncompressed": namespace + local,
+                }
+    if not label:
+        return {}
+    return {"search_term": label[: rng.randint(1, min(len(label), 6))].lower()}
+
+
+def _context(name: str, rng: random.Random, predicates: list[str]) -> dict:
+    """The context and local context of a context-sensitive template."""
+    predicate = f"<{rng.choice(predicates)}>" if predicates else "?qlue_ls_predicate"
+    other = f"<{rng.choice(predicates)}>" if predicates else "?qlue_ls_other"
+    if name.startswith("predicate_"):
+        return {
+            "context": f"{SUBJECT} {other} [] ." if rng.random() < 0.5 else "",
+            "local_context": f"{SUBJECT} {ENTITY} [] .",
+        }
+    if name.startswith("object_"):
+        return {
+            "context": f"{SUBJECT} {other} [] ." if rng.random() < 0.5 else "",
+            "local_context": f"{SUBJECT} {predicate} {ENTITY} .",
+        }
+    if name.startswith("values_"):
+        return {
+            "context": f"{SUBJECT} {predicate} {VALUE} .",
+            "local_context": f"BIND({VALUE} AS {ENTITY})",
+        }
+    return {}
+
+
+def sample_cases(
+    backend: SparqlEndpointConfiguration,
+    names: list[str],
+    samples: int,
+    seed: int,
+    limit: int,
+) -> dict[str, list[dict]]:
+    """`samples` template contexts per template in `names`."""
+    words = vocabulary(backend)
+    prefixes = parse_prefixes(backend.prefixes)
+    predicates = [iri for iri, _ in words["predicate"]]
+    cases = {}
+    for name in names:
+        # NOTE: one generator per template, so that the inputs of a template
+        # do not depend on which other templates are benchmarked
+        rng = random.Random(f"{seed}:{name}")
+        entries = words["predicate" if name.startswith("predicate_") else "subject"]
+        cases[name] = []
+        for _ in range(samples):
+            if name == "hover":
+                iri = rng.choice(entries)[0] if entries else "urn:qlue-ls:none"
+                cases[name].append({"entity": f"<{iri}>"})
+                continue
+            context = {"limit": limit, "offset": 0}
+            context.update(_search_term(rng, entries, prefixes))
+            if not name.endswith("_context_insensitive") or name.startswith("values_"):
+                context.update(_context(name, rng, predicates))
+            cases[name].append(context)
+    return cases
+
+
+def run_query(
+    backend: SparqlEndpointConfiguration, query: str, timeout: float
+) -> tuple[float, int | None, str]:
+    """
+    Run `query` upstream once a slot of the backend is free; returns the
+    seconds, not counting the wait, rows and outcome.
+    """
+    try:
+        ticket = scheduler.acquire(backend, "benchmark", "benchmark")
+    except QueueRejected as error:
+        return 0.0, None, f"busy {error}"
+    start = time.perf_counter()
+    scanner = SparqlJsonScanner()
+    try:
+        with post_form(
+            pools.get(backend),
+            {"query": query},
+            "application/sparql-results+json",
+            timeout,
+        ) as response:
+            if response.status != 200:
+                response.read()
+                return time.perf_counter() - start, None, f"status {response.status}"
+            while chunk := response.read1(64 * 1024):
+                scanner.feed(chunk)
+    except TimeoutError:
+        return time.perf_counter() - start, None, "timeout"
+    except (OSError, http.client.HTTPException) as error:
+        return time.perf_counter() - start, None, f"error {error}"
+    finally:
+        scheduler.release(backend, ticket)
+    return time.perf_counter() - start, scanner.bindings, "ok"
+
+
+def dry_run(
+    backend: SparqlEndpointConfiguration, query: str, timeout: float | None = None
+) -> dict:
+    """Run `query` upstream and describe how it went."""
+    Engine = SparqlEndpointConfiguration.Engine
+    qlever = backend.engine == Engine.QLEVER
+    accept = (
+        "application/qlever-results+json"
+        if qlever
+        else "application/sparql-results+json"
+    )
+
+    start = time.perf_counter()
+    outcome = {"status": None, "rows": None, "seconds": None, "runtime": None}
+    try:
+        ticket = scheduler.acquire(backend, "benchmark", "templates")
+    except QueueRejected as error:
+        outcome["error"] = f"The backend is busy: {error}"
+        return outcome
+    try:
+        with post_form(
+            pools.get(backend), {"query": query}, accept, timeout
+        ) as response:
+            outcome["status"] = response.status
+            body = response.read()
+    except TimeoutError:
+        outcome["error"] = "The query timed out"
+        return {**outcome, "seconds": time.perf_counter() - start}
+    except (OSError, http.client.HTTPException) as error:
+        outcome["error"] = f"The SPARQL endpoint is unreachable: {error}"
+        return {**outcome, "seconds": time.perf_counter() - start}
+    finally:
+        scheduler.release(backend, ticket)
+    outcome["seconds"] = time.perf_counter() - start
+    try:
+        result = json.loads(body)
+    except ValueError:
+        result = None
+    if outcome["status"] != 200 or not isinstance(result, dict):
+        outcome["error"] = body[:2000].decode(errors="replace")
+        return outcome
+    if qlever and "resultsize" in result:
+        outcome["rows"] = result["resultsize"]
+        outcome["runtime"] = {
+            "time": result.get("time"),
+            "runtimeInformation": result.get("runtimeInformation"),
+        }
+    else:
+        outcome["rows"] = len(result.get("results", {}).get("bindings", []))
+    return outcome
+
+
+def estimate_cost(backend: SparqlEndpointConfiguration, names: list[str]) -> list[dict]:
+    """
+    Dry-run the context-insensitive completions among `names` for the empty
+    search term, which the editor sends first, and describe their cost; only
+    for QLever, whose runtime information includes the cost estimate of its
+    query planner. Runs slower than TEMPLATE_LINT_SLOW_SECONDS are warnings.
+    """
+    timeout = settings.TEMPLATE_LINT_TIMEOUT
+    if backend.engine != SparqlEndpointConfiguration.Engine.QLEVER or not timeout:
+        return []
+    context = {"limit": settings.COMPLETION_WARMUP_LIMIT, "offset": 0}
+    estimates = []
+    for name in names:
+        if name not in WARMUP_TEMPLATES:
+            continue
+        try:
+            outcome = dry_run(backend, render_query(backend, name, context), timeout)
+        except TemplateSyntaxError:
+            continue
+        if "error" in outcome:
+            severity = "warning"
+            message = f"The query for the empty search term failed: {outcome['error']}"
+        else:
+            tree = (outcome["runtime"] or {}).get("runtimeInformation") or {}
+            cost = tree.get("query_execution_tree", {}).get("estimated_total_cost")
+            slow = outcome["seconds"] > settings.TEMPLATE_LINT_SLOW_SECONDS
+            severity = "warning" if slow else "info"
+            message = (
+                f"The query for the empty search term took "
+                f"{outcome['seconds'] * 1000:.0f} ms for {outcome['rows']} rows"
+                + (f" (estimated cost {cost})" if cost is not None else "")
+                + "."
+            )
+        estimates.append(
+            {
+                "template": name,
+                "rule": "cost",
+                "severity": severity,
+                "line": None,
+                "message": message,
+            }
+        )
+    return estimates
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    """The nearest-rank percentile `p` of `values`."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def _digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def summarize(source: str, cases: list[dict], runs: list[tuple]) -> dict:
+    seconds = [run[0] for run in runs if run[2] == "ok"]
+    rows = [run[1] for run in runs if run[2] == "ok"]
+    return {
+        "template": _digest(source),
+        "inputs": _digest(cases),
+        "queries": len(runs),
+        "ok": len(seconds),
+        "timeouts": sum(run[2] == "timeout" for run in runs),
+        "errors": sorted({run[2] for run in runs} - {"ok", "timeout"}),
+        "p50": percentile(seconds, 50),
+        "p95": percentile(seconds, 95),
+        "p99": percentile(seconds, 99),
+        "mean": mean(seconds) if seconds else None,
+        "rows": {
+            "min": min(rows) if rows else None,
+            "median": median(rows) if rows else None,
+            "max": max(rows) if rows else None,
+        },
+    }
+
+
+def benchmark(
+    backend: SparqlEndpointConfiguration,
+    cases: dict[str, list[dict]],
+    concurrency: int,
+    timeout: float,
+) -> dict:
+    """Render and run all `cases`, `concurrency` at a time; returns the report."""
+    queries = [
+        (name, render_query(backend, name, context))
+        for name, contexts in cases.items()
+        for context in contexts
+    ]
+    started, start = time.time(), time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        runs = list(
+            executor.map(lambda case: run_query(backend, case[1], timeout), queries)
+        )
+    results = {name: [] for name in cases}
+    for (name, _), run in zip(queries, runs):
+        results[name].append(run)
+    return {
+        "backend": backend.slug,
+        "started": started,
+        "seconds": round(time.perf_counter() - start, 3),
+        "concurrency": concurrency,
+        "timeout": timeout,
+        "templates": {
+            name: summarize(getattr(backend, name), cases[name], results[name])
+            for name in cases
+        },
+    }
+
+
+def compare(report: dict, baseline: dict) -> dict[str, dict]:
+    """
+    The relative change of the latency percentiles per template against a
+    `baseline` report, for templates that ran with the same inputs.
+    """
+    changes = {}
+    for name, current in report["templates"].items():
+        before = baseline.get("templates", {}).get(name)
+        if before is None or before["inputs"] != current["inputs"]:
+            continue
+        changes[name] = {
+            key: (current[key] - before[key]) / before[key]
+            if current[key] is not None and before[key]
+            else None
+            for key in ("p50", "p95", "p99")
+        }
+    return changes
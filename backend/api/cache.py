@@ -0,0 +1,183 @@
+"""
+Size-bounded LRU cache for results of the SPARQL proxy.
+
+Small result bodies are kept in memory, bodies larger than
+SPARQL_CACHE_SPILL_BYTES are spilled to a per-process directory below
+SPARQL_CACHE_DIR. Memory and disk usage are bounded separately by
+SPARQL_CACHE_MEMORY_BYTES and SPARQL_CACHE_DISK_BYTES; the least recently
+used entries are evicted first.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
+from dataclasses import dataclass
+from pathlib import Path
+
+from django.conf import settings
+
+from api.metrics import record_cache
+
+
+def cache_key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+@dataclass
+class CacheEntry:
+    status: int
+    content_type: str
+    size: int
+    expires: float
+    body: bytes | None = None
+    path: Path | None = None
+
+    def read(self) -> bytes:
+        if self.body is not None:
+            return self.body
+        return self.path.read_bytes()
+
+
+class ResultCache:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._pid = None
+
+    def _directory(self) -> Path:
+        return Path(settings.SPARQL_CACHE_DIR) / self.name / str(os.getpid())
+
+    def _check_fork(self):
+        # NOTE: entries (and spill files) of a parent process are not shared
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._entries = OrderedDict()
+            self._memory_bytes = 0
+            self._disk_bytes = 0
+            _remove_stale_directories(self._directory().parent)
+
+    def get(self, key: str) -> CacheEntry | None:
+        with self._lock:
+            self._check_fork()
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        record_cache(self.name, entry is not None)
+        return entry
+
+    def put(self, key: str, status: int, content_type: str, body: bytes, ttl: float):
+        self.put_chunks(key, status, content_type, [body], len(body), ttl)
+
+    def put_chunks(
+        self,
+        key: str,
+        status: int,
+        content_type: str,
+        chunks: Iterable[bytes],
+        size: int,
+        ttl: float,
+    ):
+        """
+        Store a body of `size` bytes given as chunks; large bodies are
+        written to disk chunk by chunk without being joined in memory.
+        """
+        if size > settings.SPARQL_CACHE_SPILL_BYTES:
+            if size > settings.SPARQL_CACHE_DISK_BYTES:
+                return
+            directory = self._directory()
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / key
+            with path.open("wb") as file:
+                for chunk in chunks:
+                    file.write(chunk)
+            entry = CacheEntry(
+                status, content_type, size, time.monotonic() + ttl, path=path
+            )
+        else:
+            if size > settings.SPARQL_CACHE_MEMORY_BYTES:
+                return
+            entry = CacheEntry(
+                status,
+                content_type,
+                size,
+                time.monotonic() + ttl,
+                body=b"".join(chunks),
+            )
+
+        with self._lock:
+            self._check_fork()
+            if key in self._entries:
+                self._remove(key, delete_file=entry.path is None)
+            self._entries[key] = entry
+            if entry.path is None:
+                self._memory_bytes += size
+            else:
+                self._disk_bytes += size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def _remove(self, key: str, delete_file: bool = True):
+        entry = self._entries.pop(key)
+        if entry.path is None:
+            self._memory_bytes -= entry.size
+        else:
+            self._disk_bytes -= entry.size
+            if delete_file:
+                entry.path.unlink(missing_ok=True)
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [
+            key for key, entry in self._entries.items() if entry.expires <= now
+        ]:
+            self._remove(key)
+        for key in list(self._entries):
+            if (
+                self._memory_bytes <= settings.SPARQL_CACHE_MEMORY_BYTES
+                and self._disk_bytes <= settings.SPARQL_CACHE_DISK_BYTES
+            ):
+                break
+            entry = self._entries[key]
+            if (
+                entry.path is None
+                and self._memory_bytes > settings.SPARQL_CACHE_MEMORY_BYTES
+            ):
+                self._remove(key)
+            elif (
+                entry.path is not None
+                and self._disk_bytes > settings.SPARQL_CACHE_DISK_BYTES
+            ):
+                self._remove(key)
+
+
+def _remove_stale_directories(directory: Path):
+    """Remove spill directories of worker processes that no longer exist."""
+    if not directory.exists():
+        return
+    for path in directory.iterdir():
+        if not path.name.isdigit() or int(path.name) == os.getpid():
+            continue
+        try:
+            os.kill(int(path.name), 0)
+        except ProcessLookupError:
+            shutil.rmtree(path, ignore_errors=True)
+        except PermissionError:
+            continue
+
+
+result_cache = ResultCache("sparql")
@@ -0,0 +1,147 @@
+"""
+Engine-specific cancellation of queries sent by the SPARQL proxy.
+
+Every proxied query gets an id. When all clients waiting for a query have
+disconnected, the query is cancelled on the engine if it supports that:
+
+- QLever: the query id is sent as `Query-Id` header, `cancel` is sent over
+  the websocket at `<url>/watch/<id>`.
+- Blazegraph: the query id is sent as `queryId` parameter, and cancelled
+  with the `cancelQuery` request.
+
+In any case the upstream connection is closed afterwards; GraphDB, Jena,
+Virtuoso and MillenniumDB stop evaluating a query when its connection goes
+away.
+"""
+
+import base64
+import http.client
+import logging
+import os
+import socket
+import ssl
+import urllib.parse
+import uuid
+
+from django.conf import settings
+
+from api.metrics import registry
+from api.models import SparqlEndpointConfiguration
+from api.pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+Engine = SparqlEndpointConfiguration.Engine
+
+
+class QueryCancelled(Exception):
+    pass
+
+
+def new_query_id() -> str:
+    return str(uuid.uuid4())
+
+
+def identify_query(
+    backend: SparqlEndpointConfiguration, query_id: str
+) -> tuple[list[tuple[str, str]], dict[str, str]]:
+    """Parameters and headers that assign `query_id` to a query."""
+    if backend.engine == Engine.QLEVER:
+        return [], {"Query-Id": query_id}
+    if backend.engine == Engine.BLAZEGRAPH:
+        return [("queryId", query_id)], {}
+    return [], {}
+
+
+def open_websocket(url: str, query_id: str) -> socket.socket:
+    """
+    Open the QLever websocket of a query at `<url>/watch/<query_id>`; raises
+    OSError if the endpoint does not upgrade the connection.
+    """
+    parsed = urllib.parse.urlsplit(url)
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    sock = socket.create_connection(
+        (parsed.hostname, port), timeout=settings.SPARQL_CONNECT_TIMEOUT
+    )
+    try:
+        if parsed.scheme == "https":
+            sock = ssl.create_default_context().wrap_socket(
+                sock, server_hostname=parsed.hostname
+            )
+        path = f"{parsed.path.rstrip('/')}/watch/{query_id}"
+        key = base64.b64encode(os.urandom(16)).decode()
+        sock.sendall(
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {parsed.netloc}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n\r\n".encode()
+        )
+        response = b""
+        while b"\r\n\r\n" not in response:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            response += chunk
+        if not response.startswith((b"HTTP/1.1 101", b"HTTP/1.0 101")):
+            raise OSError(f"websocket upgrade failed: {response[:40]!r}")
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def close_websocket(sock: socket.socket):
+    """Send a close frame and close the connection."""
+    with sock:
+        sock.sendall(bytes([0x88, 0x80]) + os.urandom(4))
+
+
+def _qlever_cancel(url: str, query_id: str):
+    """Send `cancel` over the QLever websocket of the query."""
+    sock = open_websocket(url, query_id)
+    with sock:
+        # NOTE: client frames must be masked; send a text frame, then close
+        mask = os.urandom(4)
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(b"cancel"))
+        sock.sendall(bytes([0x81, 0x80 | len(payload)]) + mask + payload)
+        close_websocket(sock)
+
+
+def _blazegraph_cancel(pool: ConnectionPool, query_id: str):
+    body = urllib.parse.urlencode([("cancelQuery", ""), ("queryId", query_id)])
+    with pool.request(
+        "POST",
+        body.encode(),
+        {"Content-Type": "application/x-www-form-urlencoded"},
+    ) as response:
+        response.read()
+        if response.status >= 400:
+            raise OSError(f"cancelQuery failed with status {response.status}")
+
+
+def cancel_query(
+    backend: SparqlEndpointConfiguration,
+    pool: ConnectionPool,
+    query_id: str,
+    connection: http.client.HTTPConnection,
+):
+    """Cancel a running query on the engine and close its connection."""
+    try:
+        if backend.engine == Engine.QLEVER:
+            _qlever_cancel(pool.url, query_id)
+        elif backend.engine == Engine.BLAZEGRAPH:
+            _blazegraph_cancel(pool, query_id)
+    except OSError as error:
+        logger.warning(
+            "Cancelling query %s on %s failed: %s", query_id, backend.slug, error
+        )
+    finally:
+        # NOTE: unblocks the fetching thread, the connection is not reused
+        if connection.sock is not None:
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        registry.inc("qlue_sparql_cancelled_total", backend=backend.slug)
@@ -0,0 +1,231 @@
+"""
+Detection of the features that the SPARQL endpoint of a backend supports.
+
+Instead of deciding by the engine alone, the endpoint is probed once per
+configuration version (its URL and engine) for:
+
+- `formats`: the result formats of SELECT queries it answers in.
+- `stats`: whether it answers QLever's `cmd=stats`; `server` is then the
+  git hash of the QLever server, and the `Server` header otherwise.
+- `websocket`: whether it opens QLever's websocket at `<url>/watch/<id>`,
+  used for the live execution tree and for cancellation.
+- `cancellation`: how running queries are cancelled, see `cancel.py`:
+  "websocket", "cancelQuery" (Blazegraph) or "disconnect".
+- `update`: whether the endpoint supports SPARQL 1.1 Update, as listed in
+  its service description (the answer to a GET without a query); null if it
+  has none. Updates are never sent to find out.
+- `clear_cache`: whether `cmd=clear-cache` is available. It is not probed,
+  since that would clear the cache, but follows from `stats` on QLever.
+
+The results are stored with the backend and sent in the backend list and
+configuration. Probes run in the background when the URL or engine of a
+backend is changed in the admin, when a backend without current
+capabilities is first served (e.g. one imported by `import_from_dist` or
+from the dist database), and with the `detect_capabilities` command.
+
+If no probe reached the endpoint, e.g. while it restarts, the result is
+stored with `reachable: false` but not served, and the endpoint is probed
+again when it is served at least CAPABILITY_RETRY_SECONDS later.
+"""
+
+import hashlib
+import http.client
+import json
+import logging
+import threading
+import time
+from email.message import Message
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from api.cancel import close_websocket, new_query_id, open_websocket
+from api.models import SparqlEndpointConfiguration
+from api.pool import ConnectionPool, post_form
+
+logger = logging.getLogger(__name__)
+
+Engine = SparqlEndpointConfiguration.Engine
+
+PROBE_QUERY = "SELECT * WHERE { ?s ?p ?o } LIMIT 1"
+FORMATS = {
+    "json": "application/sparql-results+json",
+    "xml": "application/sparql-results+xml",
+    "csv": "text/csv",
+    "tsv": "text/tab-separated-values",
+    "qlever-json": "application/qlever-results+json",
+}
+DESCRIPTION_FORMATS = "text/turtle, application/rdf+xml;q=0.9, */*;q=0.1"
+
+
+def config_version(backend: SparqlEndpointConfiguration) -> str:
+    """The version of the configuration that the capabilities depend on."""
+    key = f"{backend.engine}\n{backend.url}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def current_capabilities(backend: SparqlEndpointConfiguration) -> dict | None:
+    """
+    The stored capabilities of `backend`; None if they are outdated or the
+    endpoint could not be reached.
+    """
+    capabilities = backend.capabilities or {}
+    if capabilities.get("version") != config_version(backend):
+        return None
+    if not capabilities.get("reachable", True):
+        return None
+    return capabilities
+
+
+def served_capabilities(backend: SparqlEndpointConfiguration) -> dict | None:
+    """
+    The current capabilities of `backend`; if they are outdated, the
+    endpoint is probed in the background once the transaction is committed,
+    and at most every CAPABILITY_RETRY_SECONDS while it is unreachable.
+    """
+    capabilities = current_capabilities(backend)
+    if capabilities is None:
+        stored = backend.capabilities or {}
+        retry = stored.get("detected", 0) + settings.CAPABILITY_RETRY_SECONDS
+        if stored.get("version") != config_version(backend) or retry < time.time():
+            transaction.on_commit(lambda: start_detection(backend))
+    return capabilities
+
+
+def _request(
+    pool: ConnectionPool, params: dict, accept: str
+) -> tuple[int, Message, bytes]:
+    """POST `params` to the endpoint; returns the status, headers and body."""
+    with post_form(pool, params, accept, settings.CAPABILITY_PROBE_TIMEOUT) as response:
+        return response.status, response.headers, response.read()
+
+
+def _probe(pool: ConnectionPool, params: dict, accept: str):
+    try:
+        return _request(pool, params, accept)
+    except (OSError, http.client.HTTPException) as error:
+        logger.info("Capability probe of %s failed: %s", pool.slug, error)
+        return None, {}, b""
+
+
+def _describe(pool: ConnectionPool) -> bytes | None:
+    """The service description of the endpoint; None if it has none."""
+    try:
+        with pool.request(
+            "GET",
+            None,
+            {"Accept": DESCRIPTION_FORMATS},
+            timeout=settings.CAPABILITY_PROBE_TIMEOUT,
+        ) as response:
+            body = response.read()
+    except (OSError, http.client.HTTPException) as error:
+        logger.info("Service description of %s failed: %s", pool.slug, error)
+        return None
+    # NOTE: endpoints without a description answer with an error or a form
+    if response.status != 200 or b"supportedLanguage" not in body:
+        return None
+    return body
+
+
+def detect(backend: SparqlEndpointConfiguration) -> dict:
+    """Probe the endpoint of `backend` for its capabilities."""
+    pool = ConnectionPool(backend.slug, backend.url)
+    server = None
+    try:
+        formats = []
+        statuses = []
+        for name, mime in FORMATS.items():
+            status, headers, _ = _probe(pool, {"query": PROBE_QUERY}, mime)
+            statuses.append(status)
+            # NOTE: some engines answer unsupported formats in their default
+            if status == 200 and headers.get("Content-Type", "").startswith(mime):
+                formats.append(name)
+            server = server or headers.get("Server")
+
+        status, _, body = _probe(pool, {"cmd": "stats"}, "application/json")
+        statuses.append(status)
+        try:
+            stats = json.loads(body) if status == 200 else None
+        except ValueError:
+            stats = None
+        if isinstance(stats, dict):
+            server = stats.get("git-hash-server") or server
+
+        description = _describe(pool)
+        # NOTE: sd:SPARQL11Update, by any prefix or as a full IRI
+        update = b"SPARQL11Update" in description if description else None
+
+        cancel_query = False
+        if backend.engine == Engine.BLAZEGRAPH:
+            status, _, _ = _probe(
+                pool, {"cancelQuery": "", "queryId": new_query_id()}, "*/*"
+            )
+            cancel_query = status is not None and status < 400
+    finally:
+        pool.close()
+
+    try:
+        close_websocket(open_websocket(backend.url, new_query_id()))
+        websocket = True
+    except OSError:
+        websocket = False
+    cancellation = "disconnect"
+    if websocket and backend.engine == Engine.QLEVER:
+        cancellation = "websocket"
+    elif cancel_query:
+        cancellation = "cancelQuery"
+
+    return {
+        "version": config_version(backend),
+        "detected": time.time(),
+        "reachable": websocket or any(status is not None for status in statuses),
+        "formats": formats,
+        "stats": isinstance(stats, dict),
+        "websocket": websocket,
+        "cancellation": cancellation,
+        "update": update,
+        "clear_cache": isinstance(stats, dict) and backend.engine == Engine.QLEVER,
+        "server": server,
+    }
+
+
+def refresh_capabilities(backend: SparqlEndpointConfiguration, force=False) -> dict:
+    """
+    The capabilities of `backend`, probed and stored unless they are current
+    for its configuration version.
+    """
+    capabilities = current_capabilities(backend)
+    if capabilities is not None and not force:
+        return capabilities
+    capabilities = detect(backend)
+    # NOTE: update() does not overwrite fields changed in the meantime
+    SparqlEndpointConfiguration.objects.filter(pk=backend.pk).update(
+        capabilities=capabilities
+    )
+    backend.capabilities = capabilities
+    return capabilities
+
+
+_detecting: set[str] = set()
+_detecting_lock = threading.Lock()
+
+
+def start_detection(backend: SparqlEndpointConfiguration):
+    """Probe `backend` in the background, unless a probe is running."""
+    with _detecting_lock:
+        if backend.slug in _detecting:
+            return
+        _detecting.add(backend.slug)
+
+    def run():
+        try:
+            refresh_capabilities(backend, force=True)
+        except Exception:
+            logger.exception("Capability detection of %s failed", backend.slug)
+        finally:
+            with _detecting_lock:
+                _detecting.discard(backend.slug)
+            # NOTE: storing the capabilities opened a connection in this thread
+            connection.close()
+
+    threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,242 @@
+"""
+Request coalescing ("singleflight") for identical in-flight upstream requests.
+
+The first request for a key starts the upstream request in a background
+thread that writes the response body to an anonymous temporary file as it
+arrives. Every request for the same key, including the first one, streams
+the body from that file while it grows, so a single upstream response is
+fanned out to all waiters. When every waiter has left before the response
+is complete, the flight is abandoned and its `on_abandon` callbacks run,
+e.g. to cancel the query on the endpoint, unless it is pinned.
+"""
+
+import os
+import tempfile
+import threading
+from collections.abc import Callable, Iterator
+
+CHUNK_SIZE = 64 * 1024
+
+
+class FlightError(Exception):
+    """The upstream request of a flight failed after its response started."""
+
+
+class Flight:
+    """
+    A single upstream response shared by all requests waiting for it.
+    The fetching thread calls `start`, `write` and `finish`; waiting
+    requests read with `wait_started` and `chunks`.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._file = tempfile.TemporaryFile(buffering=0)
+        self.size = 0
+        self.status: int | None = None
+        self.content_type: str | None = None
+        self.headers: dict[str, str] = {}
+        self.done = False
+        self.error: Exception | None = None
+        # head and number of bindings of SPARQL JSON results
+        self.result_head: dict | None = None
+        self.result_rows: int | None = None
+        self.waiters = 0
+        self.fetching = False
+        self.pinned = False
+        self.abandoned = threading.Event()
+        self._on_abandon: list[Callable[[], None]] = []
+
+    def start(self, status: int, content_type: str, headers: dict | None = None):
+        with self._cond:
+            self.status = status
+            self.content_type = content_type
+            self.headers = headers or {}
+            self._cond.notify_all()
+
+    def write(self, chunk: bytes):
+        self._file.write(chunk)
+        with self._cond:
+            self.size += len(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error: Exception | None = None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+            self._close_if_unused()
+
+    def join(self):
+        with self._cond:
+            self.waiters += 1
+
+    def leave(self):
+        with self._cond:
+            self.waiters -= 1
+        self._abandon_if_unused()
+
+    def pin(self, timeout: float | None = None):
+        """
+        Keep the flight running until it is done, even without waiters;
+        with `timeout`, for at most that many seconds.
+        """
+        with self._cond:
+            self.pinned = True
+        if timeout:
+            timer = threading.Timer(timeout, self.unpin)
+            timer.daemon = True
+            timer.start()
+
+    def unpin(self):
+        with self._cond:
+            self.pinned = False
+        self._abandon_if_unused()
+
+    def _abandon_if_unused(self):
+        callbacks = []
+        with self._cond:
+            if (
+                self.waiters <= 0
+                and not self.pinned
+                and not self.done
+                and not self.abandoned.is_set()
+            ):
+                self.abandoned.set()
+                callbacks = self._on_abandon
+            self._close_if_unused()
+        for callback in callbacks:
+            threading.Thread(target=callback, daemon=True).start()
+
+    def on_abandon(self, callback: Callable[[], None]):
+        """Run `callback` in a new thread once all waiters left early."""
+        with self._cond:
+            if not self.abandoned.is_set():
+                self._on_abandon.append(callback)
+                return
+        threading.Thread(target=callback, daemon=True).start()
+
+    def fetched(self):
+        """Called by the fetching thread once it no longer uses the flight."""
+        with self._cond:
+            self.fetching = False
+            self._close_if_unused()
+
+    def _close_if_unused(self):
+        if (
+            self.done
+            and self.waiters <= 0
+            and not self.fetching
+            and not self._file.closed
+        ):
+            self._file.close()
+
+    def wait_started(self, timeout: float | None = None) -> bool:
+        """
+        Wait until the upstream response started. Returns False if the
+        request failed before, or the timeout expired.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.status is not None or self.done, timeout=timeout
+            )
+            return self.status is not None
+
+    def chunks(self, offset: int = 0, follow: bool = True) -> Iterator[bytes]:
+        """
+        Yield the response body from `offset` on. With `follow`, wait for
+        data that has not arrived yet until the flight is done, and raise
+        `FlightError` if it failed, so that a cut off body is not passed
+        on as complete.
+        """
+        while True:
+            with self._cond:
+                if follow:
+                    self._cond.wait_for(lambda: self.size > offset or self.done)
+                size, done = self.size, self.done or not follow
+                error = self.error if follow else None
+            while offset < size:
+                chunk = os.pread(
+                    self._file.fileno(), min(CHUNK_SIZE, size - offset), offset
+                )
+                offset += len(chunk)
+                yield chunk
+            if done and offset >= self.size:
+                if error is not None:
+                    raise FlightError(str(error)) from error
+                return
+
+
+class PinLimit:
+    """Limits the number of flights that each client keeps pinned."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: dict[str, list[Flight]] = {}
+
+    def admit(self, client: str, flight: Flight, limit: int) -> bool:
+        """Whether `client` may pin `flight`; records it if so."""
+        with self._lock:
+            pinned = [
+                other
+                for other in self._flights.get(client, [])
+                if other.pinned and not other.done
+            ]
+            if len(pinned) >= limit:
+                self._flights[client] = pinned
+                return False
+            self._flights[client] = [*pinned, flight]
+            return True
+
+
+class Coalescer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: dict[str, Flight] = {}
+
+    def join(
+        self,
+        key: str,
+        fetch: Callable[[Flight], None],
+        on_done: Callable[[Flight], None] | None = None,
+    ) -> tuple[Flight, bool]:
+        """
+        Join the in-flight request for `key`, or start it with `fetch`.
+        Returns the flight and whether this call started it. Callers must
+        `leave()` the flight once they stopped reading.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            started = flight is None or flight.abandoned.is_set()
+            if started:
+                flight = Flight()
+                # NOTE: keeps the body file open for `on_done`
+                flight.fetching = True
+                self._flights[key] = flight
+            flight.join()
+        if started:
+            threading.Thread(
+                target=self._run, args=(key, flight, fetch, on_done), daemon=True
+            ).start()
+        return flight, started
+
+    def _run(self, key, flight, fetch, on_done):
+        try:
+            fetch(flight)
+            # NOTE: runs before `finish`, so that waiters only see the end
+            # of the body once e.g. the result is cached
+            if on_done is not None:
+                on_done(flight)
+        except Exception as error:
+            flight.finish(error)
+        else:
+            flight.finish()
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.fetched()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
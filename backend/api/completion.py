@@ -0,0 +1,421 @@
+"""
+Precomputed completion index per backend.
+
+`build_index` runs the context-insensitive completion templates of a backend
+without a search term, i.e. for its top entities, predicates and objects by
+count, and stores the results with labels and counts in a SQLite database
+`COMPLETION_INDEX_DIR/<slug>.sqlite3` with a full-text index on the labels.
+`/api/backends/<slug>/complete` answers completions from that index, ranked
+by count, in the format of the completion queries (SPARQL JSON with the
+variables `qlue_ls_entity`, `qlue_ls_label`, `qlue_ls_alias` and
+`qlue_ls_count`). The index is rebuilt with the `build_completion_index`
+management command and replaced atomically.
+
+All other completions are run on the server by `run_template`: the template
+is rendered with the context of the request and executed through the SPARQL
+proxy, so that identical completions of all users share one upstream request.
+Results are cached by the rendered query in the completion cache of the
+backend, a SQLite database `COMPLETION_CACHE_DIR/<slug>.sqlite3` shared by
+all workers; entries expire after COMPLETION_CACHE_TTL seconds and the least
+recently used ones are evicted beyond COMPLETION_CACHE_MAX_ENTRIES.
+`warmup.py` refreshes that cache after templates are changed.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.template import TemplateSyntaxError
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from api.metrics import LATENCY_BUCKETS, registry
+from api.models import TEMPLATE_FIELDS, SparqlEndpointConfiguration
+from api.pool import pools
+from api.proxy import execute, proxied_backend, result_key
+from api.results import SparqlJsonScanner
+from api.sparql import parse_prefixes
+from api.templating import render_query
+
+# kind of completion -> template used to harvest it
+KINDS = {
+    "subject": "subject_completion",
+    "predicate": "predicate_completion_context_insensitive",
+    "object": "object_completion_context_insensitive",
+}
+VARIABLES = ["qlue_ls_entity", "qlue_ls_label", "qlue_ls_alias", "qlue_ls_count"]
+XSD_INTEGER = "http://www.w3.org/2001/XMLSchema#integer"
+MAX_RESULTS = 1000
+_PREFIXED_NAME = re.compile(r"([\w.-]*):(\S*)")
+
+SCHEMA = """
+CREATE TABLE entries (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    iri TEXT NOT NULL,
+    label TEXT,
+    alias TEXT,
+    count INTEGER NOT NULL,
+    UNIQUE (kind, iri)
+);
+CREATE INDEX entries_rank ON entries (kind, count DESC);
+CREATE VIRTUAL TABLE entries_text USING fts5(
+    label, alias, content='entries', content_rowid='id', prefix='1 2 3'
+);
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    content_type TEXT NOT NULL,
+    body BLOB NOT NULL,
+    fetched REAL NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_used ON results (used);
+"""
+SPARQL_JSON = "application/sparql-results+json"
+
+
+def index_path(slug: str) -> Path:
+    return Path(settings.COMPLETION_INDEX_DIR) / f"{slug}.sqlite3"
+
+
+def cache_path(slug: str) -> Path:
+    return Path(settings.COMPLETION_CACHE_DIR) / f"{slug}.sqlite3"
+
+
+_cache_connections = threading.local()
+
+
+def _connect_cache(slug: str) -> sqlite3.Connection:
+    """The connection to the completion cache of `slug`, per thread."""
+    path = cache_path(slug)
+    cached = getattr(_cache_connections, "by_path", None)
+    if cached is None:
+        cached = _cache_connections.by_path = {}
+    connection = cached.get(path)
+    if connection is None or not path.exists():
+        if connection is not None:
+            connection.close()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(path, timeout=10, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(CACHE_SCHEMA)
+        cached[path] = connection
+    return connection
+
+
+def cached_completion(slug: str, key: str) -> tuple[str, bytes] | None:
+    """The unexpired cached content type and body of `key`; marks it as used."""
+    connection = _connect_cache(slug)
+    now = time.time()
+    row = connection.execute(
+        "SELECT content_type, body FROM results WHERE key = ? AND fetched > ?",
+        (key, now - settings.COMPLETION_CACHE_TTL),
+    ).fetchone()
+    if row is not None:
+        connection.execute("UPDATE results SET used = ? WHERE key = ?", (now, key))
+    return row
+
+
+def cache_completion(slug: str, key: str, content_type: str, body: bytes):
+    """Cache a result and evict the least recently used ones beyond the limit."""
+    now = time.time()
+    connection = _connect_cache(slug)
+    with connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+            (key, content_type, body, now, now),
+        )
+        (count,) = connection.execute("SELECT COUNT(*) FROM results").fetchone()
+        excess = count - settings.COMPLETION_CACHE_MAX_ENTRIES
+        if excess > 0:
+            connection.execute(
+                "DELETE FROM results WHERE key IN "
+                "(SELECT key FROM results ORDER BY used LIMIT ?)",
+                (excess,),
+            )
+
+
+def _value(binding: dict, name: str) -> str | None:
+    return binding[name]["value"] if name in binding else None
+
+
+def harvest(backend: SparqlEndpointConfiguration, kind: str, limit: int):
+    """Yield the bindings of the completion template of `kind` in batches."""
+    query = render_query(backend, KINDS[kind], {"limit": limit, "offset": 0})
+    body = urllib.parse.urlencode({"query": query}).encode()
+    scanner = SparqlJsonScanner(capture_bindings=True)
+    with pools.get(backend).request(
+        "POST",
+        body,
+        {
+            "Accept": "application/sparql-results+json",
+            "Content-Type": "application/x-www-form-urlencoded;charset=UTF-8",
+        },
+    ) as response:
+        if response.status != 200:
+            raise OSError(
+                f"{kind} query failed with status {response.status}: "
+                f"{response.read(500).decode(errors='replace')}"
+            )
+        while chunk := response.read1(64 * 1024):
+            yield scanner.feed(chunk)
+
+
+def build_index(
+    backend: SparqlEndpointConfiguration, limit: int, kinds=tuple(KINDS)
+) -> dict[str, int]:
+    """Harvest the completions of `backend` into a new index; returns counts."""
+    path = index_path(backend.slug)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=path.parent, suffix=".sqlite3")
+    os.close(handle)
+    counts = {}
+    try:
+        with sqlite3.connect(temporary) as connection:
+            connection.executescript(SCHEMA)
+            for kind in kinds:
+                counts[kind] = 0
+                for rows in harvest(backend, kind, limit):
+                    # NOTE: entities with several labels keep the first one
+                    cursor = connection.executemany(
+                        "INSERT OR IGNORE INTO entries (kind, iri, label, alias, count) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        [
+                            (
+                                kind,
+                                row["qlue_ls_entity"]["value"],
+                                _value(row, "qlue_ls_label"),
+                                _value(row, "qlue_ls_alias"),
+                                int(_value(row, "qlue_ls_count") or 0),
+                            )
+                            for row in rows
+                            if "qlue_ls_entity" in row
+                        ],
+                    )
+                    counts[kind] += cursor.rowcount
+            connection.execute(
+                "INSERT INTO entries_text(entries_text) VALUES('rebuild')"
+            )
+            connection.executemany(
+                "INSERT INTO meta VALUES (?, ?)",
+                [("built", str(time.time())), ("limit", str(limit))],
+            )
+        connection.close()
+        os.replace(temporary, path)
+    except BaseException:
+        Path(temporary).unlink(missing_ok=True)
+        raise
+    return counts
+
+
+_connections = threading.local()
+
+
+def _connect(slug: str) -> sqlite3.Connection | None:
+    """A read-only connection to the index of `slug`, per thread and build."""
+    path = index_path(slug)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    build = (path, stat.st_ino, stat.st_mtime_ns)
+    cached = getattr(_connections, "by_slug", None)
+    if cached is None:
+        cached = _connections.by_slug = {}
+    if slug in cached and cached[slug][0] == build:
+        return cached[slug][1]
+    if slug in cached:
+        cached[slug][1].close()
+    # NOTE: an index is never written once it is in place, only replaced
+    connection = sqlite3.connect(f"{path.as_uri()}?mode=ro&immutable=1", uri=True)
+    cached[slug] = (build, connection)
+    return connection
+
+
+def _match_expression(term: str) -> str:
+    """An FTS5 query matching labels with words starting with those of `term`."""
+    words = re.findall(r"\w+", term)
+    return " ".join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+
+def search(
+    backend: SparqlEndpointConfiguration, kind: str, term: str, limit: int
+) -> list[tuple] | None:
+    """
+    Completions of `kind` for `term`, ranked by count. A prefixed name is
+    expanded with the prefixes of the backend and matches IRIs starting
+    with it; other terms match words of labels and aliases.
+    """
+    connection = _connect(backend.slug)
+    if connection is None:
+        return None
+    select = "SELECT e.iri, e.label, e.alias, e.count FROM entries e"
+    prefixed = _PREFIXED_NAME.fullmatch(term)
+    namespace = parse_prefixes(backend.prefixes).get(prefixed[1]) if prefixed else None
+    if namespace is not None:
+        start = namespace + prefixed[2]
+        return connection.execute(
+            f"{select} WHERE e.kind = ? AND e.iri >= ? AND e.iri < ? "
+            "ORDER BY e.count DESC LIMIT ?",
+            (kind, start, start + "\U0010ffff", limit),
+        ).fetchall()
+    expression = _match_expression(term)
+    if not expression:
+        return connection.execute(
+            f"{select} WHERE e.kind = ? ORDER BY e.count DESC LIMIT ?", (kind, limit)
+        ).fetchall()
+    return connection.execute(
+        f"{select} JOIN entries_text ON entries_text.rowid = e.id "
+        "WHERE entries_text MATCH ? AND e.kind = ? ORDER BY e.count DESC LIMIT ?",
+        (expression, kind, limit),
+    ).fetchall()
+
+
+def _result(rows: list[tuple]) -> dict:
+    bindings = []
+    for iri, label, alias, count in rows:
+        binding = {
+            "qlue_ls_entity": {"type": "uri", "value": iri},
+            "qlue_ls_count": {
+                "type": "literal",
+                "value": str(count),
+                "datatype": XSD_INTEGER,
+            },
+        }
+        if label is not None:
+            binding["qlue_ls_label"] = {"type": "literal", "value": label}
+        if alias is not None:
+            binding["qlue_ls_alias"] = {"type": "literal", "value": alias}
+        bindings.append(binding)
+    return {"head": {"vars": VARIABLES}, "results": {"bindings": bindings}}
+
+
+@require_GET
+def complete(request, slug: str):
+    """
+    Context-insensitive completions of `kind` (subject, predicate or object)
+    for the search term `q`, from the completion index of the backend.
+    """
+    backend = get_object_or_404(SparqlEndpointConfiguration, slug=slug)
+    kind = request.GET.get("kind", "subject")
+    if kind not in KINDS:
+        return JsonResponse(
+            {"error": f"Unknown kind, expected one of {', '.join(KINDS)}"}, status=400
+        )
+    try:
+        # NOTE: SQLite reads a negative LIMIT as no limit
+        limit = max(1, min(int(request.GET.get("limit", "50")), MAX_RESULTS))
+    except ValueError:
+        return JsonResponse({"error": "limit must be a number"}, status=400)
+    try:
+        rows = search(backend, kind, request.GET.get("q", "").strip(), limit)
+    except sqlite3.Error as error:
+        return JsonResponse({"error": f"Invalid search term: {error}"}, status=400)
+    if rows is None:
+        return JsonResponse(
+            {"error": "There is no completion index for this backend"}, status=404
+        )
+    return HttpResponse(
+        json.dumps(_result(rows)), content_type="application/sparql-results+json"
+    )
+
+
+def run_completion(
+    request,
+    backend: SparqlEndpointConfiguration,
+    name: str,
+    context: dict,
+    priority: str = "completion",
+    refresh: bool = False,
+) -> HttpResponse:
+    """
+    Render the template `name` of `backend` with `context` and answer it from
+    the completion cache or execute it through the SPARQL proxy; the result
+    is read completely. With `refresh`, the cache is not read, only updated.
+    """
+    query = render_query(backend, name, context)
+    key = result_key(backend, query, SPARQL_JSON, [])
+    if settings.COMPLETION_CACHE_TTL > 0 and not refresh:
+        hit = cached_completion(backend.slug, key)
+        if hit is not None:
+            response = HttpResponse(hit[1], content_type=hit[0])
+            response["X-Cache"] = "HIT"
+            return response
+    # NOTE: cached in the completion cache only, which all workers share
+    result = execute(request, backend, query, SPARQL_JSON, [], ttl=0, priority=priority)
+    if isinstance(result, HttpResponse):
+        return result
+    body = result.body
+    if not isinstance(body, bytes):
+        # NOTE: completions are small; reading them here includes the
+        # upstream time in the measured latency
+        try:
+            body = b"".join(body)
+        finally:
+            result.body.close()
+    if result.status == 200 and settings.COMPLETION_CACHE_TTL > 0:
+        cache_completion(backend.slug, key, result.content_type, body)
+    response = HttpResponse(
+        body, status=result.status, content_type=result.content_type
+    )
+    for header, value in result.headers.items():
+        response[header] = value
+    return response
+
+
+@csrf_exempt
+@require_POST
+def run_template(request, slug: str, name: str):
+    """
+    Render the template `name` of a backend with the JSON object in the
+    request body as context and execute it through the SPARQL proxy.
+    """
+    start = time.perf_counter()
+    backend = proxied_backend(slug)
+    if name not in TEMPLATE_FIELDS:
+        return JsonResponse(
+            {
+                "error": f"Unknown template, expected one of {', '.join(TEMPLATE_FIELDS)}"
+            },
+            status=404,
+        )
+    try:
+        context = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({"error": "The context must be JSON"}, status=400)
+    if not isinstance(context, dict) or not all(
+        isinstance(value, (str, int, float, bool)) for value in context.values()
+    ):
+        return JsonResponse(
+            {"error": "The context must be an object of strings and numbers"},
+            status=400,
+        )
+
+    try:
+        response = run_completion(request, backend, name, context)
+    except TemplateSyntaxError as error:
+        return JsonResponse({"error": f"Invalid template: {error}"}, status=500)
+    registry.observe(
+        "qlue_completion_duration_seconds",
+        time.perf_counter() - start,
+        LATENCY_BUCKETS,
+        backend=backend.slug,
+        template=name,
+        cache=response.get("X-Cache", "NONE"),
+    )
+    return response
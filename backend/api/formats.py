@@ -0,0 +1,172 @@
+"""
+Streaming conversion of SPARQL results into download formats.
+
+`Converter` reads a SPARQL JSON (or XML) result chunk by chunk and yields
+the converted rows as the chunks arrive, so memory stays constant in the
+size of the result. Terms are written as in the SPARQL 1.1 CSV and TSV
+result formats; N-Triples requires a result with exactly three variables
+(subject, predicate, object), JSON-Lines writes every binding as the JSON
+object of the SPARQL JSON result.
+"""
+
+import json
+import time
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+
+from api.metrics import RATE_BUCKETS, registry
+from api.results import SparqlJsonScanner, SparqlXmlScanner
+
+XSD_STRING = "http://www.w3.org/2001/XMLSchema#string"
+
+_LITERAL_ESCAPES = str.maketrans(
+    {"\\": "\\\\", '"': '\\"', "\n": "\\n", "\r": "\\r", "\t": "\\t"}
+)
+# NOTE: characters that are not allowed in N-Triples IRIs
+_IRI_ESCAPES = str.maketrans(
+    {char: f"\\u{ord(char):04X}" for char in '<>"{}|^`\\ \t\n\r'}
+)
+
+
+def term(value: dict) -> str:
+    """A term in N-Triples (and SPARQL TSV) syntax."""
+    kind = value["type"]
+    if kind == "uri":
+        return f"<{value['value'].translate(_IRI_ESCAPES)}>"
+    if kind == "bnode":
+        return f"_:{value['value']}"
+    if kind == "triple":
+        parts = value["value"]
+        return "<< {} {} {} >>".format(
+            term(parts["subject"]), term(parts["predicate"]), term(parts["object"])
+        )
+    literal = f'"{value["value"].translate(_LITERAL_ESCAPES)}"'
+    if "xml:lang" in value:
+        return f"{literal}@{value['xml:lang']}"
+    if value.get("datatype", XSD_STRING) != XSD_STRING:
+        return f"{literal}^^<{value['datatype']}>"
+    return literal
+
+
+def _csv_field(value: dict | None) -> str:
+    if value is None:
+        return ""
+    kind = value["type"]
+    if kind == "bnode":
+        text = f"_:{value['value']}"
+    elif kind == "triple":
+        text = term(value)
+    else:
+        text = value["value"]
+    if any(char in text for char in ',"\r\n'):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def _csv_header(variables: list[str]) -> str:
+    return ",".join(variables) + "\r\n"
+
+
+def _csv_row(variables: list[str], binding: dict) -> str:
+    return ",".join(_csv_field(binding.get(name)) for name in variables) + "\r\n"
+
+
+def _tsv_header(variables: list[str]) -> str:
+    return "\t".join(f"?{name}" for name in variables) + "\n"
+
+
+def _tsv_row(variables: list[str], binding: dict) -> str:
+    return (
+        "\t".join(term(binding[name]) if name in binding else "" for name in variables)
+        + "\n"
+    )
+
+
+def _ntriples_row(variables: list[str], binding: dict) -> str:
+    if not all(name in binding for name in variables):
+        return ""
+    return " ".join(term(binding[name]) for name in variables) + " .\n"
+
+
+def _jsonl_row(variables: list[str], binding: dict) -> str:
+    return json.dumps(binding, ensure_ascii=False) + "\n"
+
+
+def _no_header(variables: list[str]) -> str:
+    return ""
+
+
+@dataclass(frozen=True)
+class Format:
+    content_type: str
+    extension: str
+    header: Callable[[list[str]], str]
+    row: Callable[[list[str], dict], str]
+    triples: bool = False
+
+
+FORMATS = {
+    "csv": Format("text/csv; charset=utf-8", "csv", _csv_header, _csv_row),
+    "tsv": Format(
+        "text/tab-separated-values; charset=utf-8", "tsv", _tsv_header, _tsv_row
+    ),
+    "nt": Format(
+        "application/n-triples", "nt", _no_header, _ntriples_row, triples=True
+    ),
+    "jsonl": Format("application/jsonl", "jsonl", _no_header, _jsonl_row),
+}
+
+
+class Converter:
+    """
+    Iterates over a result body converted to `format`. Closing the converter
+    closes the body.
+    """
+
+    def __init__(
+        self, body: Iterable[bytes], content_type: str, format: Format, backend: str
+    ):
+        self.body = body
+        self.format = format
+        self.backend = backend
+        self.rows = 0
+        self._chunks = iter(body)
+        self._pending: list[dict] = []
+        scanner_class = SparqlXmlScanner if "xml" in content_type else SparqlJsonScanner
+        self.scanner = scanner_class(capture_bindings=True)
+
+    def variables(self) -> list[str]:
+        """The variables of the result, reading the body up to its head."""
+        while self.scanner.head is None:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                raise ValueError("The result has no head")
+            self._pending += self.scanner.feed(chunk)
+        return self.scanner.variables
+
+    def __iter__(self):
+        variables = self.variables()
+        start = time.perf_counter()
+        row = self.format.row
+        yield self.format.header(variables).encode()
+        rows, self._pending = self._pending, []
+        while True:
+            if rows:
+                self.rows += len(rows)
+                yield "".join(row(variables, binding) for binding in rows).encode()
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            rows = self.scanner.feed(chunk)
+        labels = {"backend": self.backend, "format": self.format.extension}
+        registry.inc("qlue_sparql_download_rows_total", self.rows, **labels)
+        registry.observe(
+            "qlue_sparql_download_rows_per_second",
+            self.rows / max(time.perf_counter() - start, 1e-6),
+            RATE_BUCKETS,
+            **labels,
+        )
+
+    def close(self):
+        if hasattr(self.body, "close"):
+            self.body.close()
@@ -0,0 +1,89 @@
+"""
+Measure the import cost of the backend with `python -X importtime`.
+
+Every measurement runs in a fresh interpreter, so modules already imported
+by the calling process (e.g. a management command) do not hide any cost.
+"""
+
+import json
+import os
+import subprocess
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+from django.conf import settings
+
+# What a gunicorn worker imports before it can serve requests, and what the
+# first request additionally pays for when the URLconf is loaded.
+BOOT_SCRIPTS = {
+    "worker": "from configuration.wsgi import application",
+    "request": "from configuration.wsgi import application\nimport configuration.urls",
+}
+
+# Modules that must not be imported while a worker boots.
+LAZY_MODULES = ["api.admin", "configuration.admin_urls", "markdown", "questionary"]
+
+BUDGET_FILE = Path(__file__).resolve().parent / "importtime_budget.json"
+
+# How far a measurement may exceed the recorded budget in the regression
+# test, since import times depend on the machine the tests run on.
+BUDGET_TOLERANCE = float(os.environ.get("IMPORT_BUDGET_TOLERANCE", "1.5"))
+
+
+@dataclass
+class ImportRecord:
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def profile_imports(phase: str = "worker") -> tuple[list[ImportRecord], set[str]]:
+    """
+    Import the backend in a subprocess and return the parsed `-X importtime`
+    records together with the names of all modules loaded at the end;
+    modules registered with `lazy_import` count once their code has run.
+    """
+    script = BOOT_SCRIPTS[phase] + (
+        "\nimport sys\nfrom configuration.lazy_imports import is_loaded"
+        "\nprint('\\n'.join(n for n in list(sys.modules) if is_loaded(n)))"
+    )
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": "configuration.settings"}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        cwd=settings.BASE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    records = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        records.append(
+            ImportRecord(
+                module=name.strip(),
+                self_us=int(self_us),
+                cumulative_us=int(cumulative_us),
+                depth=(len(name) - len(name.lstrip()) - 1) // 2,
+            )
+        )
+    return records, set(result.stdout.split())
+
+
+def total_ms(records: list[ImportRecord]) -> float:
+    """Total import time: the sum of all top-level imports."""
+    return sum(r.cumulative_us for r in records if r.depth == 0) / 1000
+
+
+def read_budget() -> dict:
+    if not BUDGET_FILE.exists():
+        return {}
+    return json.loads(BUDGET_FILE.read_text())
+
+
+def write_budget(budget: dict):
+    BUDGET_FILE.write_text(json.dumps(budget, indent=2) + "\n")
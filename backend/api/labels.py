@@ -0,0 +1,248 @@
+"""
+Batch resolution of labels of IRIs with a persistent label cache.
+
+`/api/backends/<slug>/labels` resolves the labels of many IRIs at once, e.g.
+for all IRIs of a result table. Known IRIs are answered from the label cache
+of the backend, a SQLite database `LABEL_CACHE_DIR/<slug>.sqlite3` shared by
+all workers; entries expire after LABEL_CACHE_TTL seconds and the least
+recently used ones are evicted beyond LABEL_CACHE_MAX_ENTRIES. All misses
+are resolved with a single query through the SPARQL proxy: the `hover`
+template of the backend, rendered for the variable `?qlue_ls_entity` and
+bound to the missing IRIs with a VALUES block.
+
+IRIs without a label are cached as well, so that they are not queried again
+until they expire. The cache is cleared when the hover template or the
+prefixes of the backend change.
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.template import TemplateSyntaxError
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from api.metrics import registry
+from api.models import SparqlEndpointConfiguration
+from api.proxy import execute, proxied_backend
+from api.sparql import with_values
+from api.templating import render_query
+
+VARIABLE = "?qlue_ls_entity"
+MAX_IRIS = 1000
+# NOTE: the characters allowed in IRIREF, which keeps IRIs from breaking out
+# of the VALUES block
+_IRI = re.compile(r'[^<>"{}|^`\\\x00-\x20]+')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS labels (
+    iri TEXT PRIMARY KEY,
+    label TEXT,
+    alias TEXT,
+    fetched REAL NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS labels_used ON labels (used);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def cache_path(slug: str) -> Path:
+    return Path(settings.LABEL_CACHE_DIR) / f"{slug}.sqlite3"
+
+
+def cache_version(backend: SparqlEndpointConfiguration) -> str:
+    return hashlib.sha256(f"{backend.hover}\n{backend.prefixes}".encode()).hexdigest()
+
+
+_connections = threading.local()
+
+
+def _connect(backend: SparqlEndpointConfiguration) -> sqlite3.Connection:
+    """The connection to the label cache of `backend`, per thread."""
+    path = cache_path(backend.slug)
+    cached = getattr(_connections, "by_path", None)
+    if cached is None:
+        cached = _connections.by_path = {}
+    connection = cached.get(path)
+    if connection is None or not path.exists():
+        if connection is not None:
+            connection.close()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(path, timeout=10, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+        cached[path] = connection
+    version = cache_version(backend)
+    row = connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    if row is None or row[0] != version:
+        with connection:
+            connection.execute("DELETE FROM labels")
+            connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,)
+            )
+    return connection
+
+
+def lookup(
+    connection: sqlite3.Connection, iris: list[str]
+) -> dict[str, tuple[str | None, str | None]]:
+    """The unexpired cached labels and aliases of `iris`; marks them as used."""
+    now = time.time()
+    found = {}
+    # NOTE: stays below the default limit of 999 host parameters of SQLite
+    for start in range(0, len(iris), 500):
+        batch = iris[start : start + 500]
+        marks = ",".join("?" * len(batch))
+        rows = connection.execute(
+            f"SELECT iri, label, alias FROM labels WHERE iri IN ({marks}) "
+            "AND fetched > ?",
+            [*batch, now - settings.LABEL_CACHE_TTL],
+        ).fetchall()
+        for iri, label, alias in rows:
+            found[iri] = (label, alias)
+    if found:
+        with connection:
+            connection.executemany(
+                "UPDATE labels SET used = ? WHERE iri = ?",
+                [(now, iri) for iri in found],
+            )
+    return found
+
+
+def store(
+    connection: sqlite3.Connection,
+    labels: dict[str, tuple[str | None, str | None]],
+):
+    """Cache `labels` and evict the least recently used entries beyond the limit."""
+    now = time.time()
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO labels VALUES (?, ?, ?, ?, ?)",
+            [(iri, label, alias, now, now) for iri, (label, alias) in labels.items()],
+        )
+        (count,) = connection.execute("SELECT COUNT(*) FROM labels").fetchone()
+        excess = count - settings.LABEL_CACHE_MAX_ENTRIES
+        if excess > 0:
+            connection.execute(
+                "DELETE FROM labels WHERE iri IN "
+                "(SELECT iri FROM labels ORDER BY used LIMIT ?)",
+                (excess,),
+            )
+
+
+def label_query(backend: SparqlEndpointConfiguration, iris: list[str]) -> str:
+    """The hover template of `backend` for all of `iris` at once."""
+    query = render_query(backend, "hover", {"entity": VARIABLE})
+    return with_values(query, VARIABLE, [f"<{iri}>" for iri in iris])
+
+
+def _text(binding: dict, name: str) -> str | None:
+    return binding[name]["value"] if name in binding else None
+
+
+def read_labels(body: bytes) -> dict[str, tuple[str | None, str | None]]:
+    """The first label and alias per entity of the result of `label_query`."""
+    labels = {}
+    for binding in json.loads(body)["results"]["bindings"]:
+        if "qlue_ls_entity" not in binding:
+            continue
+        iri = binding["qlue_ls_entity"]["value"]
+        label, alias = labels.get(iri, (None, None))
+        labels[iri] = (
+            label if label is not None else _text(binding, "qlue_ls_label"),
+            alias if alias is not None else _text(binding, "qlue_ls_alias"),
+        )
+    return labels
+
+
+@csrf_exempt
+@require_POST
+def resolve_labels(request, slug: str):
+    """
+    The labels and aliases of the IRIs in the JSON list of the request body,
+    as an object of IRI -> {"label": ..., "alias": ...}, where either may be
+    null. At most one query is sent to the backend.
+    """
+    backend = proxied_backend(slug)
+    try:
+        iris = json.loads(request.body or b"[]")
+    except ValueError:
+        return JsonResponse(
+            {"error": "The body must be a JSON list of IRIs"}, status=400
+        )
+    if not isinstance(iris, list) or not all(
+        isinstance(iri, str) and _IRI.fullmatch(iri) for iri in iris
+    ):
+        return JsonResponse(
+            {"error": "The body must be a JSON list of IRIs"}, status=400
+        )
+    iris = list(dict.fromkeys(iris))
+    if len(iris) > MAX_IRIS:
+        return JsonResponse(
+            {"error": f"At most {MAX_IRIS} IRIs can be resolved at once"}, status=400
+        )
+
+    connection = _connect(backend)
+    labels = lookup(connection, iris)
+    misses = [iri for iri in iris if iri not in labels]
+    for result, count in (("hit", len(labels)), ("miss", len(misses))):
+        if count:
+            registry.inc(
+                "qlue_cache_requests_total", count, cache="labels", result=result
+            )
+    if misses:
+        try:
+            query = label_query(backend, misses)
+        except TemplateSyntaxError as error:
+            return JsonResponse({"error": f"Invalid template: {error}"}, status=500)
+        except ValueError as error:
+            return JsonResponse(
+                {"error": f"The hover template can not be batched: {error}"},
+                status=500,
+            )
+        result = execute(
+            request,
+            backend,
+            query,
+            "application/sparql-results+json",
+            [],
+            ttl=0,
+            priority="completion",
+        )
+        if isinstance(result, HttpResponse):
+            return result
+        body = result.body
+        if not isinstance(body, bytes):
+            try:
+                body = b"".join(body)
+            finally:
+                result.body.close()
+        if result.status != 200:
+            return HttpResponse(
+                body, status=result.status, content_type=result.content_type
+            )
+        try:
+            fetched = read_labels(body)
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse(
+                {"error": "The SPARQL endpoint sent an invalid result"}, status=502
+            )
+        fetched = {iri: fetched.get(iri, (None, None)) for iri in misses}
+        store(connection, fetched)
+        labels.update(fetched)
+
+    response = JsonResponse(
+        {iri: {"label": labels[iri][0], "alias": labels[iri][1]} for iri in iris}
+    )
+    response["X-Cache-Hits"] = str(len(iris) - len(misses))
+    response["X-Cache-Misses"] = str(len(misses))
+    return response
@@ -0,0 +1,290 @@
+"""
+Static checks of the query templates of a backend for known slow patterns.
+
+`lint_template` reads a template (with its tags) and reports:
+
+- `regex-prefix`: `REGEX(STR(?label), "^term", "i")` where the pattern is a
+  plain prefix; `STRSTARTS` gives the same result without a regular
+  expression.
+- `regex-unanchored`: a REGEX pattern without `^`, which has to be matched
+  against every position of every value.
+- `strstarts-caret`: `STRSTARTS(..., "^term")`, which looks for a literal
+  `^` and matches nothing.
+- `filter-after-group`: a string filter in the query around a subquery with
+  GROUP BY, e.g. the label search of the default object templates; the
+  subquery groups and counts all entities before the search term removes
+  most of them.
+- `full-scan`: a triple pattern of three variables in a query with GROUP BY
+  or ORDER BY, whose LIMIT cannot end the scan early. QLever groups such
+  scans on its sorted permutations and is not warned.
+
+The warnings are shown when templates are saved through the API or the
+admin; the cost estimate of `bench.estimate_cost` is run on request.
+"""
+
+import re
+
+from api import sparql
+from api.models import SparqlEndpointConfiguration
+
+Engine = SparqlEndpointConfiguration.Engine
+
+STRING_FUNCTIONS = {"REGEX", "STRSTARTS", "STRENDS", "CONTAINS"}
+# NOTE: characters that make a pattern more than a literal prefix
+_REGEX_SYNTAX = re.compile(r"[.\[\]()*+?{}|\\$^]")
+_TAG = re.compile(r"\{\{[^{}]*\}\}")
+_PUNCTUATION = re.compile(r"[,;]|[^,;]+")
+# engines with a full-text index that serves substring and word searches
+TEXT_INDEX_HINTS = {
+    Engine.QLEVER: "QLever's text index (ql:contains-word) is much faster for word search",
+    Engine.VIRTUOSO: "bif:contains uses the full-text index of Virtuoso",
+    Engine.GRAPH_DB: "the Lucene connector of GraphDB indexes labels for word search",
+    Engine.BLAZEGRAPH: "bds:search uses the full-text index of Blazegraph",
+}
+
+
+def _tokens(source: str) -> list[tuple[str, int, int, int]]:
+    """
+    The words of a template as in `sparql.words`, with commas, semicolons
+    and the dots that end triples as words of their own.
+    """
+    tokens = []
+    for text, start, _, depth in sparql.words(source, template=True):
+        if text[:1] in "\"'<{":
+            tokens.append((text, start, start + len(text), depth))
+            continue
+        for match in _PUNCTUATION.finditer(text):
+            word, at = match.group(), start + match.start()
+            if len(word) > 1 and word.endswith("."):
+                tokens.append((word[:-1], at, at + len(word) - 1, depth))
+                word, at = ".", at + len(word) - 1
+            tokens.append((word, at, at + len(word), depth))
+    return tokens
+
+
+def _warning(words: list, index: int, source: str, rule: str, message: str) -> dict:
+    return {
+        "rule": rule,
+        "severity": "warning",
+        "line": source.count("\n", 0, words[index][1]) + 1,
+        "message": message,
+    }
+
+
+def _closing(words: list, index: int) -> int:
+    """The index of the bracket that closes the bracket at `index`."""
+    depth = words[index][3]
+    for i in range(index + 1, len(words)):
+        if words[i][0] in ")}" and words[i][3] == depth:
+            return i
+    return len(words) - 1
+
+
+def _opening(words: list, index: int) -> int | None:
+    """The index of the brace of the group that contains the word at `index`."""
+    depth = words[index][3] - 1
+    for i in range(index - 1, -1, -1):
+        if words[i][0] == "{" and words[i][3] == depth:
+            return i
+    return None
+
+
+def _arguments(words: list, index: int) -> list[list[str]]:
+    """The arguments of the call whose opening parenthesis is at `index`."""
+    depth = words[index][3] + 1
+    arguments = [[]]
+    for word in words[index + 1 : _closing(words, index)]:
+        if word[0] == "," and word[3] == depth:
+            arguments.append([])
+        else:
+            arguments[-1].append(word[0])
+    return arguments
+
+
+def _literal(text: str) -> str | None:
+    if text[:3] in ('"""', "'''"):
+        return text[3:-3]
+    if text[:1] in ('"', "'"):
+        return text[1:-1]
+    return None
+
+
+def _variable(word: str) -> bool:
+    return word[:1] in "?$" and len(word) > 1
+
+
+def _check_regex(words, i, source, engine) -> dict | None:
+    if i + 1 >= len(words) or words[i + 1][0] != "(":
+        return None
+    arguments = _arguments(words, i + 1)
+    if len(arguments) < 2 or len(arguments[1]) != 1:
+        return None
+    pattern = _literal(arguments[1][0])
+    if pattern is None:
+        return None
+    flags = _literal(arguments[2][0]) if len(arguments) > 2 and arguments[2] else ""
+    target = "".join(arguments[0])
+    if pattern.startswith("^"):
+        if _REGEX_SYNTAX.search(_TAG.sub("", pattern[1:])):
+            return None
+        prefix = f'"{pattern[1:]}"'
+        if "i" in (flags or ""):
+            suggestion = f"STRSTARTS(LCASE({target}), LCASE({prefix}))"
+        else:
+            suggestion = f"STRSTARTS({target}, {prefix})"
+        return _warning(
+            words,
+            i,
+            source,
+            "regex-prefix",
+            f"REGEX only matches a prefix of {target}; {suggestion} does the "
+            "same without a regular expression.",
+        )
+    message = (
+        f"REGEX without ^ matches anywhere in {target}, so every value is "
+        "scanned; anchor it with ^ or use STRSTARTS."
+    )
+    if engine in TEXT_INDEX_HINTS:
+        message += f" For word search, {TEXT_INDEX_HINTS[engine]}."
+    return _warning(words, i, source, "regex-unanchored", message)
+
+
+def _check_strstarts(words, i, source) -> dict | None:
+    if i + 1 >= len(words) or words[i + 1][0] != "(":
+        return None
+    arguments = _arguments(words, i + 1)
+    if len(arguments) < 2 or len(arguments[1]) != 1:
+        return None
+    prefix = _literal(arguments[1][0])
+    if prefix is None or not prefix.startswith("^"):
+        return None
+    return _warning(
+        words,
+        i,
+        source,
+        "strstarts-caret",
+        "STRSTARTS compares a plain string, not a regular expression: the "
+        "^ is matched literally and nothing is found.",
+    )
+
+
+def _check_filters_after_group(words, i, source) -> list[dict]:
+    """String filters after the subquery with GROUP BY at `i`."""
+    start = _opening(words, i)
+    if start is None:
+        return []
+    end = _closing(words, start)
+    depth = words[i][3]
+    keywords = [words[j][0].upper() for j in range(i, end) if words[j][3] == depth]
+    if "GROUP" not in keywords:
+        return []
+    # NOTE: filters on the projected variables, e.g. on the IRIs of the
+    # entities, could be moved by the engine; labels are bound outside
+    where = next((j for j in range(i, end) if words[j][0] == "{"), end)
+    projected = {word[0] for word in words[i:where] if _variable(word[0])}
+    warnings = []
+    j = end + 1
+    while j < len(words) and words[j][3] >= words[start][3]:
+        if words[j][0].upper() == "FILTER" and words[j][3] == words[start][3]:
+            close = _closing(words, j + 1) if j + 1 < len(words) else j
+            arguments = {word[0] for word in words[j + 1 : close]}
+            variables = {word for word in arguments if _variable(word)}
+            if {word.upper() for word in arguments} & STRING_FUNCTIONS and (
+                variables - projected
+            ):
+                line = source.count("\n", 0, words[i][1]) + 1
+                warnings.append(
+                    _warning(
+                        words,
+                        j,
+                        source,
+                        "filter-after-group",
+                        "This FILTER is applied after the GROUP BY of the "
+                        f"subquery on line {line}: all entities are grouped and "
+                        "counted before the search term is matched. Match it "
+                        "inside the subquery, so that it restricts the rows to group.",
+                    )
+                )
+            j = close
+        j += 1
+    return warnings
+
+
+def _query_group(words, index) -> int | None:
+    """The WHERE clause of the (sub)query that contains the word at `index`."""
+    group = _opening(words, index)
+    while group is not None:
+        before = words[group - 1][0] if group > 0 else ""
+        graph = group > 1 and words[group - 2][0].upper() == "GRAPH"
+        if before.upper() == "WHERE" or (
+            (before in ("*", ")") or _variable(before)) and not graph
+        ):
+            return group
+        group = _opening(words, group)
+    return None
+
+
+def _check_full_scan(words, i, source) -> dict | None:
+    triple = [word[0] for word in words[i : i + 3]]
+    if len(triple) < 3 or not all(map(_variable, triple)):
+        return None
+    if len({word[3] for word in words[i : i + 3]}) != 1:
+        return None
+    before = words[i - 1][0] if i > 0 else "{"
+    after = words[i + 3][0] if i + 3 < len(words) else "}"
+    if before not in "{.}" and not before.startswith("{"):
+        return None
+    if after not in ".}" and not after.startswith("{"):
+        return None
+    group = _query_group(words, i)
+    if group is None:
+        return None
+    modifiers = []
+    for word in words[_closing(words, group) + 1 :]:
+        if word[3] < words[group][3] or word[0] == "{":
+            break
+        modifiers.append(word[0].upper())
+    if "LIMIT" in modifiers and not {"GROUP", "ORDER"} & set(modifiers):
+        return None
+    reason = (
+        "the GROUP BY or ORDER BY of its query keeps the LIMIT from ending the scan early"
+        if "LIMIT" in modifiers
+        else "its query has no LIMIT"
+    )
+    return _warning(
+        words,
+        i,
+        source,
+        "full-scan",
+        f"{' '.join(triple)} matches every triple, and {reason}: the engine "
+        "reads the whole dataset for each completion.",
+    )
+
+
+def lint_template(source: str, engine: int | None) -> list[dict]:
+    """The warnings about slow patterns in a query template for `engine`."""
+    words = _tokens(source)
+    warnings = []
+    for i, (text, _, _, depth) in enumerate(words):
+        keyword = text.upper()
+        if keyword == "REGEX":
+            warning = _check_regex(words, i, source, engine)
+            warnings += [warning] if warning else []
+        elif keyword == "STRSTARTS":
+            warning = _check_strstarts(words, i, source)
+            warnings += [warning] if warning else []
+        elif keyword == "SELECT" and depth > 0:
+            warnings += _check_filters_after_group(words, i, source)
+        elif _variable(text) and engine != Engine.QLEVER:
+            warning = _check_full_scan(words, i, source)
+            warnings += [warning] if warning else []
+    return sorted(warnings, key=lambda warning: warning["line"])
+
+
+def lint_templates(engine: int | None, sources: dict[str, str]) -> list[dict]:
+    """The warnings of all templates in `sources`, by template name."""
+    return [
+        {"template": name, **warning}
+        for name, source in sources.items()
+        for warning in lint_template(source, engine)
+    ]
@@ -0,0 +1,159 @@
+"""
+Benchmark the query templates of a backend.
+
+This command renders each template of a backend with a sample of realistic
+search terms and contexts, drawn from the vocabulary of the backend, and
+runs the queries directly against its SPARQL endpoint. It reports the
+p50/p95/p99 latency, result counts, timeouts and errors per template.
+
+USAGE:
+    python manage.py bench_templates <slug> [options]
+
+OPTIONS:
+    --templates     Templates to benchmark (default: all)
+    --samples       Number of sampled inputs per template (default: 20)
+    --seed          Seed of the sampled inputs (default: 0)
+    --concurrency   Number of queries running at the same time (default: 4)
+    --timeout       Seconds after which a query counts as timed out
+                    (default: 30)
+    --limit         Result size limit of completion queries (default: 101)
+    --source        Benchmark a template from a file instead of the saved one,
+                    as <template>=<path>; can be repeated
+    --output        Write the report as JSON to this file
+    --compare       Compare with the JSON report of a previous run
+
+EXAMPLES:
+    # Benchmark all templates and keep the report
+    python manage.py bench_templates wikidata --output before.json
+
+    # Try a changed template before saving it, with the same inputs
+    python manage.py bench_templates wikidata \\
+        --templates predicate_completion_context_sensitive \\
+        --source predicate_completion_context_sensitive=predicate.rq \\
+        --compare before.json
+
+NOTES:
+    - The same seed and samples draw the same inputs; reports are only
+      compared for templates whose inputs are identical.
+    - The vocabulary comes from the completion index of the backend, see
+      build_completion_index. Without an index, the top subjects and
+      predicates are queried first.
+    - Endpoints cache results themselves; compare runs with warm caches,
+      e.g. by running each benchmark twice.
+"""
+
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.bench import benchmark, compare, sample_cases
+from api.models import TEMPLATE_FIELDS, SparqlEndpointConfiguration
+
+
+def _ms(seconds: float | None) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.0f}"
+
+
+class Command(BaseCommand):
+    help = "Measure the latency of the query templates of a backend"
+
+    def add_arguments(self, parser):
+        parser.add_argument("slug", help="Slug of the backend")
+        parser.add_argument(
+            "--templates",
+            nargs="+",
+            choices=TEMPLATE_FIELDS,
+            default=list(TEMPLATE_FIELDS),
+            help="Templates to benchmark",
+        )
+        parser.add_argument(
+            "--samples", type=int, default=20, help="Sampled inputs per template"
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Seed of the sampled inputs"
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=4, help="Queries at the same time"
+        )
+        parser.add_argument(
+            "--timeout", type=float, default=30, help="Timeout per query in seconds"
+        )
+        parser.add_argument(
+            "--limit", type=int, default=101, help="Result size limit of completions"
+        )
+        parser.add_argument(
+            "--source",
+            action="append",
+            default=[],
+            metavar="TEMPLATE=PATH",
+            help="Benchmark a template from a file instead of the saved one",
+        )
+        parser.add_argument("--output", help="Write the report as JSON to this file")
+        parser.add_argument("--compare", help="JSON report of a previous run")
+
+    def handle(self, *args, **options):
+        try:
+            backend = SparqlEndpointConfiguration.objects.get(slug=options["slug"])
+        except SparqlEndpointConfiguration.DoesNotExist:
+            raise CommandError(f"Unknown backend: {options['slug']}")
+        # NOTE: the backend is only changed in memory, never saved
+        for source in options["source"]:
+            name, _, path = source.partition("=")
+            if name not in TEMPLATE_FIELDS or not path:
+                raise CommandError(f"Expected <template>=<path>, got {source}")
+            try:
+                setattr(backend, name, Path(path).read_text())
+            except OSError as error:
+                raise CommandError(f"Cannot read {path}: {error}")
+        baseline = None
+        if options["compare"]:
+            try:
+                baseline = json.loads(Path(options["compare"]).read_text())
+            except (OSError, ValueError) as error:
+                raise CommandError(f"Cannot read {options['compare']}: {error}")
+
+        try:
+            cases = sample_cases(
+                backend,
+                options["templates"],
+                options["samples"],
+                options["seed"],
+                options["limit"],
+            )
+        except OSError as error:
+            raise CommandError(f"Cannot sample inputs: {error}")
+        report = benchmark(backend, cases, options["concurrency"], options["timeout"])
+        report.update(seed=options["seed"], samples=options["samples"])
+
+        changes = compare(report, baseline) if baseline is not None else {}
+        self.stdout.write(
+            f"{'template':<42} {'p50':>7} {'p95':>7} {'p99':>7} "
+            f"{'rows':>7} {'timeouts':>8} {'errors':>6}"
+        )
+        for name, result in report["templates"].items():
+            self.stdout.write(
+                f"{name:<42} {_ms(result['p50']):>7} {_ms(result['p95']):>7} "
+                f"{_ms(result['p99']):>7} {result['rows']['median'] or '-':>7} "
+                f"{result['timeouts']:>8} {result['queries'] - result['ok'] - result['timeouts']:>6}"
+            )
+            for error in result["errors"]:
+                self.stdout.write(self.style.WARNING(f"    {error}"))
+            if name in changes:
+                change = ", ".join(
+                    f"{key} {value:+.0%}"
+                    for key, value in changes[name].items()
+                    if value is not None
+                )
+                style = (
+                    self.style.ERROR
+                    if (changes[name]["p50"] or 0) > 0
+                    else self.style.SUCCESS
+                )
+                self.stdout.write(style(f"    vs. baseline: {change}"))
+        self.stdout.write(
+            f"{sum(len(c) for c in cases.values())} queries in {report['seconds']:.1f}s "
+            "(latencies in ms)"
+        )
+        if options["output"]:
+            Path(options["output"]).write_text(json.dumps(report, indent=2))
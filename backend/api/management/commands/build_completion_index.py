@@ -0,0 +1,91 @@
+"""
+Build the completion index of backends.
+
+This command harvests the top entities, predicates and objects of a backend,
+with their labels and counts, by running its context-insensitive completion
+templates without a search term, and stores them in a local SQLite full-text
+index. `/api/backends/<slug>/complete` answers completions from it.
+
+USAGE:
+    python manage.py build_completion_index [slug ...] [options]
+
+OPTIONS:
+    --all           Build the index of every backend
+    --limit         Number of results harvested per kind (default: 100000)
+    --kinds         Kinds to harvest: subject, predicate and/or object
+                    (default: all)
+
+EXAMPLES:
+    # Rebuild the index of one backend
+    python manage.py build_completion_index wikidata
+
+    # Index only the 20000 most frequent predicates of every backend
+    python manage.py build_completion_index --all --kinds predicate --limit 20000
+
+NOTES:
+    - The harvest queries run directly against the SPARQL endpoint and can
+      take a long time on large datasets.
+    - The index is built next to the current one and replaces it only once
+      it is complete.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.completion import KINDS, build_index, index_path
+from api.models import SparqlEndpointConfiguration
+
+
+class Command(BaseCommand):
+    help = "Harvest completions of backends into their local completion index"
+
+    def add_arguments(self, parser):
+        parser.add_argument("slugs", nargs="*", help="Slugs of the backends")
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Build the index of every backend",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=100_000,
+            help="Number of results harvested per kind",
+        )
+        parser.add_argument(
+            "--kinds",
+            nargs="+",
+            choices=list(KINDS),
+            default=list(KINDS),
+            help="Kinds of completions to harvest",
+        )
+
+    def handle(self, *args, **options):
+        backends = SparqlEndpointConfiguration.objects.all()
+        if not options["all"]:
+            if not options["slugs"]:
+                raise CommandError("Name the backends to index, or use --all")
+            backends = backends.filter(slug__in=options["slugs"])
+            missing = set(options["slugs"]) - {backend.slug for backend in backends}
+            if missing:
+                raise CommandError(f"Unknown backends: {', '.join(sorted(missing))}")
+
+        failed = []
+        for backend in backends:
+            start = time.perf_counter()
+            try:
+                counts = build_index(backend, options["limit"], options["kinds"])
+            except OSError as error:
+                failed.append(backend.slug)
+                self.stderr.write(self.style.ERROR(f"{backend.slug}: {error}"))
+                continue
+            summary = ", ".join(f"{count} {kind}s" for kind, count in counts.items())
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{backend.slug}: {summary} in {time.perf_counter() - start:.1f}s "
+                    f"-> {index_path(backend.slug)}"
+                )
+            )
+        if failed:
+            raise CommandError(f"Indexing failed for: {', '.join(failed)}")
@@ -0,0 +1,80 @@
+"""
+Detect the features of the SPARQL endpoints of backends.
+
+This command probes the SPARQL endpoint of each backend for its result
+formats, QLever's stats command and websocket, query cancellation, SPARQL
+update support (from its service description) and server version, and stores them with the backend; see
+api/capabilities.py. The backend list and configuration send them to the
+clients.
+
+USAGE:
+    python manage.py detect_capabilities [slug ...] [options]
+
+OPTIONS:
+    --force         Probe again even if the stored capabilities are current
+
+EXAMPLES:
+    # Probe all backends whose URL or engine changed since their last probe
+    python manage.py detect_capabilities
+
+    # Probe one backend again, e.g. after its engine was upgraded
+    python manage.py detect_capabilities wikidata --force
+
+NOTES:
+    - Capabilities are stored per configuration version, i.e. the URL and
+      engine of a backend; backends are only probed again when these change,
+      or with --force.
+    - Unreachable endpoints are stored as such, without capabilities, and
+      probed again by the next run of the command.
+    - Backends without current capabilities are also probed in the
+      background when they are first served by the API.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.capabilities import current_capabilities, refresh_capabilities
+from api.models import SparqlEndpointConfiguration
+
+
+class Command(BaseCommand):
+    help = "Probe the SPARQL endpoints of backends for their features"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "slugs", nargs="*", help="Slugs of the backends (default: all)"
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Probe again even if the stored capabilities are current",
+        )
+
+    def handle(self, *args, **options):
+        backends = SparqlEndpointConfiguration.objects.order_by("slug")
+        if options["slugs"]:
+            backends = backends.filter(slug__in=options["slugs"])
+            missing = set(options["slugs"]) - {backend.slug for backend in backends}
+            if missing:
+                raise CommandError(f"Unknown backends: {', '.join(sorted(missing))}")
+        for backend in backends:
+            if current_capabilities(backend) is not None and not options["force"]:
+                self.stdout.write(f"{backend.slug}: up to date")
+                continue
+            capabilities = refresh_capabilities(backend, force=True)
+            if not capabilities["reachable"]:
+                self.stdout.write(self.style.WARNING(f"{backend.slug}: unreachable"))
+                continue
+            features = [
+                feature
+                for feature in ("stats", "websocket", "clear_cache")
+                if capabilities[feature]
+            ]
+            update = {True: "yes", False: "no", None: "unknown"}[capabilities["update"]]
+            self.stdout.write(
+                self.style.SUCCESS(f"{backend.slug}: ")
+                + f"formats {', '.join(capabilities['formats']) or '-'}; "
+                + f"{', '.join(features) or 'no QLever features'}; "
+                + f"cancellation {capabilities['cancellation']}; "
+                + f"update {update}; "
+                + f"server {capabilities['server'] or '-'}"
+            )
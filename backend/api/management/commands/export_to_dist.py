@@ -51,6 +51,8 @@ WARNINGS:
     - SavedQuery contains user-generated content - think twice before exporting
     - QueryExample has a foreign key to SparqlEndpointConfiguration - if you
       export examples, the referenced backends must exist in the dist db
+    - Backends are exported with their minified query templates, which the
+      API serves by digest (api_querytemplate, once the dist db is migrated)
     - Always use --dry-run first to preview changes
 
 DATA FLOW:
@@ -60,11 +62,17 @@ DATA FLOW:
 import sqlite3
 from pathlib import Path
 
-import questionary
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 
-from api.models import SparqlEndpointConfiguration, QueryExample, SavedQuery
+from api.models import (
+    TEMPLATE_FIELDS,
+    QueryExample,
+    QueryTemplate,
+    SavedQuery,
+    SparqlEndpointConfiguration,
+)
+from api.sparql import minify_template
 
 
 class Command(BaseCommand):
@@ -401,6 +409,9 @@ class Command(BaseCommand):
 
     def _interactive_backend_select(self, update_mode=False, dist_db_path=None):
         """Show interactive multi-select for backend configurations."""
+        # NOTE: imported lazily, only the interactive selection needs it
+        import questionary
+
         all_backends = list(
             SparqlEndpointConfiguration.objects.all().order_by("sort_key", "name")
         )
@@ -447,6 +458,9 @@ class Command(BaseCommand):
 
     def _interactive_example_select(self, update_mode=False, dist_db_path=None):
         """Show interactive multi-select for query examples."""
+        # NOTE: imported lazily, only the interactive selection needs it
+        import questionary
+
         all_examples = list(
             QueryExample.objects.all()
             .select_related("backend")
@@ -514,8 +528,8 @@ class Command(BaseCommand):
                     predicate_completion_context_insensitive, object_completion_context_sensitive,
                     object_completion_context_insensitive,
                     values_completion_context_sensitive,
-                    values_completion_context_insensitive, hover
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    values_completion_context_insensitive, hover, map_view_url
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
                 (
                     backend.id,
@@ -535,8 +549,10 @@ class Command(BaseCommand):
                     backend.values_completion_context_sensitive,
                     backend.values_completion_context_insensitive,
                     backend.hover,
+                    backend.map_view_url,
                 ),
             )
+        self._store_templates(cursor, records)
         self.stdout.write(self.style.SUCCESS(f"  Exported {len(records)} backends"))
 
     def _upsert_backends(self, cursor, records, delete_mode):
@@ -563,7 +579,7 @@ class Command(BaseCommand):
                         object_completion_context_insensitive = ?,
                         values_completion_context_sensitive = ?,
                         values_completion_context_insensitive = ?,
-                        hover = ?
+                        hover = ?, map_view_url = ?
                     WHERE name = ?
                     """,
                     (
@@ -582,6 +598,7 @@ class Command(BaseCommand):
                         backend.values_completion_context_sensitive,
                         backend.values_completion_context_insensitive,
                         backend.hover,
+                        backend.map_view_url,
                         backend.name,
                     ),
                 )
@@ -596,8 +613,8 @@ class Command(BaseCommand):
                         predicate_completion_context_insensitive, object_completion_context_sensitive,
                         object_completion_context_insensitive,
                         values_completion_context_sensitive,
-                        values_completion_context_insensitive, hover
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        values_completion_context_insensitive, hover, map_view_url
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                     """,
                     (
                         backend.id,
@@ -617,10 +634,13 @@ class Command(BaseCommand):
                         backend.values_completion_context_sensitive,
                         backend.values_completion_context_insensitive,
                         backend.hover,
+                        backend.map_view_url,
                     ),
                 )
                 added += 1
 
+        self._store_templates(cursor, records)
+
         deleted = 0
         if delete_mode:
             # Delete records not in source
@@ -640,6 +660,28 @@ class Command(BaseCommand):
             )
         )
 
+    def _store_templates(self, cursor, records):
+        """
+        Store the minified templates of the exported backends, which are
+        served by their digest; the rows are written by save() otherwise.
+        """
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'api_querytemplate'"
+        )
+        # NOTE: migration 0014 stores them when the dist db is migrated
+        if cursor.fetchone() is None:
+            return
+        sources = {
+            getattr(backend, field) for backend in records for field in TEMPLATE_FIELDS
+        }
+        cursor.executemany(
+            "INSERT OR IGNORE INTO api_querytemplate (digest, text) VALUES (?, ?)",
+            [
+                (QueryTemplate.digest_of(source), minify_template(source))
+                for source in sources
+            ],
+        )
+
     def _export_examples(self, cursor, records):
         """Export QueryExample records (reset mode)."""
         cursor.execute("DELETE FROM api_queryexample")
@@ -60,7 +60,6 @@ DATA FLOW:
 import sqlite3
 from pathlib import Path
 
-import questionary
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from django.db import transaction
@@ -454,6 +453,9 @@ class Command(BaseCommand):
 
     def _interactive_backend_select(self, all_backends, update_mode=False):
         """Show interactive multi-select for backend configurations from dist db."""
+        # NOTE: imported lazily, only the interactive selection needs it
+        import questionary
+
         if not all_backends:
             self.stdout.write(
                 self.style.WARNING("No backends found in distribution database.")
@@ -491,6 +493,9 @@ class Command(BaseCommand):
 
     def _interactive_example_select(self, all_examples, update_mode=False):
         """Show interactive multi-select for query examples from dist db."""
+        # NOTE: imported lazily, only the interactive selection needs it
+        import questionary
+
         if not all_examples:
             self.stdout.write(
                 self.style.WARNING("No examples found in distribution database.")
@@ -0,0 +1,121 @@
+"""
+Report the import time of the backend at startup.
+
+This command boots the backend in a fresh interpreter with
+`python -X importtime` and lists the imports with the highest cumulative
+cost. It also checks that modules which are meant to load lazily were not
+imported while booting.
+
+USAGE:
+    python manage.py importtime [options]
+
+OPTIONS:
+    --phase         "worker" (gunicorn worker boot, default) or "request"
+                    (worker boot plus loading the URLconf on the first request)
+    --top           Number of imports to list (default: 25)
+    --runs          Take the median total of this many runs (default: 3)
+    --record        Record the measured total (plus headroom) as the budget
+                    used by the import time regression test
+
+EXAMPLES:
+    # Show the 25 most expensive imports of a worker boot
+    python manage.py importtime
+
+    # Include what the first request pays for
+    python manage.py importtime --phase request --top 40
+
+    # Update the recorded budget after an intended change
+    python manage.py importtime --record
+
+NOTES:
+    - Since import times depend on the machine, the budget test allows
+      IMPORT_BUDGET_TOLERANCE (default 1.5) times the recorded budget.
+"""
+
+import statistics
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importtime import (
+    BOOT_SCRIPTS,
+    LAZY_MODULES,
+    profile_imports,
+    read_budget,
+    total_ms,
+    write_budget,
+)
+
+# Headroom applied to the measured total when recording a budget
+BUDGET_HEADROOM = 2.0
+
+
+class Command(BaseCommand):
+    help = "Report the top cumulative imports at backend startup"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--phase",
+            choices=list(BOOT_SCRIPTS),
+            default="worker",
+            help="Which startup phase to measure",
+        )
+        parser.add_argument(
+            "--top",
+            type=int,
+            default=25,
+            help="Number of imports to list",
+        )
+        parser.add_argument(
+            "--runs",
+            type=int,
+            default=3,
+            help="Take the median total of this many runs",
+        )
+        parser.add_argument(
+            "--record",
+            action="store_true",
+            help="Record the measured total (plus headroom) as budget",
+        )
+
+    def handle(self, *args, **options):
+        phase = options["phase"]
+        if options["runs"] < 1:
+            raise CommandError("--runs must be at least 1")
+
+        runs = [profile_imports(phase) for _ in range(options["runs"])]
+        totals = [total_ms(records) for records, _ in runs]
+        records, modules = runs[totals.index(statistics.median_low(totals))]
+
+        self.stdout.write("\n" + "=" * 60)
+        self.stdout.write(self.style.WARNING(f"IMPORT TIME ({phase.upper()})"))
+        self.stdout.write("=" * 60)
+        self.stdout.write(f"\n{'cumulative':>12} {'self':>10}  module")
+        top = sorted(records, key=lambda r: r.cumulative_us, reverse=True)
+        for record in top[: options["top"]]:
+            self.stdout.write(
+                f"{record.cumulative_us / 1000:>10.1f}ms "
+                f"{record.self_us / 1000:>8.1f}ms  {record.module}"
+            )
+
+        total = statistics.median_low(totals)
+        self.stdout.write(
+            f"\nTotal: {total:.1f}ms (median of {len(totals)} runs, "
+            f"{len(records)} modules)"
+        )
+
+        eager = [module for module in LAZY_MODULES if module in modules]
+        if eager:
+            self.stdout.write(self.style.ERROR(f"Loaded eagerly: {', '.join(eager)}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("No lazy module was loaded eagerly."))
+
+        budget = read_budget()
+        if options["record"]:
+            budget[phase] = round(total * BUDGET_HEADROOM)
+            write_budget(budget)
+            self.stdout.write(
+                self.style.SUCCESS(f"Recorded budget for {phase}: {budget[phase]}ms")
+            )
+        elif phase in budget:
+            style = self.style.SUCCESS if total <= budget[phase] else self.style.ERROR
+            self.stdout.write(style(f"Budget: {budget[phase]}ms"))
@@ -0,0 +1,306 @@
+"""
+Prometheus-format metrics shared across gunicorn workers.
+
+Each worker process records into an in-memory dict and periodically writes
+a snapshot to its own file in `settings.METRICS_DIR`. The metrics endpoint
+sums the snapshots of all workers, so the hot path only updates a dict.
+
+When a worker exits, gunicorn's `child_exit` hook (configuration/gunicorn.py)
+calls `retire_worker`, which adds the counters and histograms of its snapshot
+to `archive.json` and removes the snapshot, so that totals never decrease.
+Gauges describe live state and are dropped with their worker.
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+ROW_BUCKETS = (0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+RATE_BUCKETS = (100, 1_000, 10_000, 50_000, 100_000, 500_000, 1_000_000)
+
+# name -> (type, help)
+METRICS = {
+    "qlue_requests_total": (
+        "counter",
+        "Handled requests by view, method and status",
+    ),
+    "qlue_request_duration_seconds": (
+        "histogram",
+        "Request latency by view",
+    ),
+    "qlue_response_size_bytes": (
+        "histogram",
+        "Response body size by view (streaming responses excluded)",
+    ),
+    "qlue_db_queries": (
+        "histogram",
+        "Number of SQL queries per request by view",
+    ),
+    "qlue_db_duration_seconds": (
+        "histogram",
+        "Time spent in SQL queries per request by view",
+    ),
+    "qlue_share_links_created_total": (
+        "counter",
+        "Newly created share links",
+    ),
+    "qlue_cache_requests_total": (
+        "counter",
+        "Cache lookups by cache and result (hit or miss)",
+    ),
+    "qlue_sparql_upstream_requests_total": (
+        "counter",
+        "Requests sent to SPARQL endpoints by backend and status",
+    ),
+    "qlue_sparql_coalesced_total": (
+        "counter",
+        "Proxy requests served by joining an identical in-flight request",
+    ),
+    "qlue_sparql_upstream_ttfb_seconds": (
+        "histogram",
+        "Time until SPARQL endpoints sent the response headers by backend",
+    ),
+    "qlue_sparql_result_rows": (
+        "histogram",
+        "Number of bindings of SPARQL JSON results by backend",
+    ),
+    "qlue_sparql_download_rows_total": (
+        "counter",
+        "Rows of converted result downloads by backend and format",
+    ),
+    "qlue_sparql_download_rows_per_second": (
+        "histogram",
+        "Conversion throughput of result downloads by backend and format",
+    ),
+    "qlue_completion_duration_seconds": (
+        "histogram",
+        "Latency of server-side completions by backend, template and cache result",
+    ),
+    "qlue_sparql_continuations_total": (
+        "counter",
+        "Continued previews by backend and source (store, offset or rerun)",
+    ),
+    "qlue_sparql_connections_total": (
+        "counter",
+        "Requests sent to SPARQL endpoints by backend and connection reuse",
+    ),
+    "qlue_sparql_tls_handshake_seconds": (
+        "histogram",
+        "TLS handshake duration of new connections to SPARQL endpoints by backend",
+    ),
+    "qlue_sparql_cancelled_total": (
+        "counter",
+        "Proxied queries cancelled because all their clients disconnected",
+    ),
+    "qlue_sparql_queue_length": (
+        "gauge",
+        "Queries waiting for a slot of a backend by backend and priority",
+    ),
+    "qlue_sparql_queue_wait_seconds": (
+        "histogram",
+        "Time queries waited for a slot of a backend by backend and priority",
+    ),
+}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _is_gauge(name: str) -> bool:
+    return METRICS.get(name, ("",))[0] == "gauge"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_snapshot(path: Path) -> list:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return []
+
+
+def _write_snapshot(path: Path, snapshot: list):
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(snapshot))
+    os.replace(tmp_path, path)
+
+
+def retire_worker(pid: int):
+    """
+    Move the counters and histograms of the snapshot of the worker `pid`
+    into the archive and remove its snapshot.
+    """
+    directory = Path(settings.METRICS_DIR)
+    path = directory / f"{pid}.json"
+    if not path.exists():
+        return
+    directory.mkdir(parents=True, exist_ok=True)
+    # NOTE: the gunicorn master and workers that reuse a pid may retire at once
+    with open(directory / "archive.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive_path = directory / "archive.json"
+        totals = {
+            (name, tuple(tuple(label) for label in labels)): value
+            for name, labels, value in _read_snapshot(archive_path)
+        }
+        for name, labels, value in _read_snapshot(path):
+            if _is_gauge(name):
+                continue
+            key = (name, tuple(tuple(label) for label in labels))
+            totals[key] = totals.get(key, 0) + value
+        _write_snapshot(
+            archive_path,
+            [[name, labels, value] for (name, labels), value in totals.items()],
+        )
+        path.unlink(missing_ok=True)
+
+
+def _sort_key(sample: tuple):
+    # NOTE: order histogram buckets numerically instead of lexicographically
+    name, labels = sample
+    return name, [
+        (key, float(value) if key == "le" else value) for key, value in labels
+    ]
+
+
+class Registry:
+    """
+    A per-process metrics store that is flushed to
+    `METRICS_DIR/<pid>.json` at most every `METRICS_FLUSH_INTERVAL` seconds.
+    A snapshot left by an earlier process with the same pid is retired
+    before the first flush.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # NOTE: threads of a worker share the snapshot file
+        self._flush_lock = threading.Lock()
+        self._values: dict[tuple, float] = {}
+        self._pid = os.getpid()
+        self._last_flush = 0.0
+        self._flushed_pid = None
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self._check_fork()
+            self._values[key] = self._values.get(key, 0) + value
+        self._maybe_flush()
+
+    def observe(self, name: str, value: float, buckets: tuple, **labels):
+        base = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self._check_fork()
+            values = self._values
+            for bucket in buckets[bisect_left(buckets, value) :]:
+                key = (f"{name}_bucket", base + (("le", str(bucket)),))
+                values[key] = values.get(key, 0) + 1
+            for key, amount in (
+                ((f"{name}_bucket", base + (("le", "+Inf"),)), 1),
+                ((f"{name}_sum", base), value),
+                ((f"{name}_count", base), 1),
+            ):
+                values[key] = values.get(key, 0) + amount
+        self._maybe_flush()
+
+    def _check_fork(self):
+        # NOTE: a forked worker must not report the values of its parent
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._values = {}
+            self._last_flush = 0.0
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._last_flush >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        directory = Path(settings.METRICS_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        with self._flush_lock:
+            with self._lock:
+                self._last_flush = time.monotonic()
+                snapshot = [
+                    [name, labels, value]
+                    for (name, labels), value in self._values.items()
+                ]
+                pid = self._pid
+            if self._flushed_pid != pid:
+                retire_worker(pid)
+                self._flushed_pid = pid
+            _write_snapshot(directory / f"{pid}.json", snapshot)
+
+    def collect(self) -> dict[tuple, float]:
+        """
+        Sum the archive and the flushed snapshots of all worker processes,
+        without the gauges of workers that are no longer running.
+        """
+        self.flush()
+        directory = Path(settings.METRICS_DIR)
+        totals: dict[tuple, float] = {}
+        for path in [directory / "archive.json", *directory.glob("[0-9]*.json")]:
+            live = path.stem.isdigit() and _alive(int(path.stem))
+            for name, labels, value in _read_snapshot(path):
+                if _is_gauge(name) and not live:
+                    continue
+                key = (name, tuple(tuple(label) for label in labels))
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        samples = self.collect()
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            names = (
+                {f"{name}_bucket", f"{name}_sum", f"{name}_count"}
+                if kind == "histogram"
+                else {name}
+            )
+            for sample in sorted(
+                (sample for sample in samples if sample[0] in names), key=_sort_key
+            ):
+                sample_name, labels = sample
+                lines.append(
+                    f"{sample_name}{_format_labels(labels)} {_format_value(samples[sample])}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def record_cache(cache: str, hit: bool):
+    registry.inc(
+        "qlue_cache_requests_total", cache=cache, result="hit" if hit else "miss"
+    )
@@ -0,0 +1,124 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from api.metrics import COUNT_BUCKETS, LATENCY_BUCKETS, SIZE_BUCKETS, registry
+
+logger = logging.getLogger(__name__)
+
+# Upper bound of SQL statements kept per request for the slow request log
+MAX_LOGGED_QUERIES = 50
+
+
+class RequestTimings:
+    """
+    Phase timings of a single request. Also used as database execute
+    wrapper that counts the SQL queries and the time spent executing them.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.query_count = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.total = 0.0
+        self.queries: list[tuple[str, float]] = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.db += duration
+            self.query_count += 1
+            if len(self.queries) < MAX_LOGGED_QUERIES:
+                self.queries.append((sql, duration))
+
+    def server_timing(self) -> str:
+        return (
+            f'db;dur={self.db * 1000:.1f};desc="{self.query_count} queries", '
+            f"serialize;dur={self.serialize * 1000:.1f}, "
+            f"total;dur={self.total * 1000:.1f}"
+        )
+
+
+class RequestTimingMiddleware:
+    """
+    Times every request: SQL queries, serialization (rendering of DRF and
+    template responses) and the total time.
+
+    The timings are recorded in the metrics registry (see `metrics.py`),
+    sent as `Server-Timing` header and logged together with the executed
+    SQL when a request takes longer than `SLOW_REQUEST_THRESHOLD_MS`.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = request.timings = RequestTimings()
+        with connection.execute_wrapper(timings):
+            response = self.get_response(request)
+        timings.total = time.perf_counter() - timings.start
+
+        match = request.resolver_match
+        view = match.view_name if match else "unresolved"
+        self.record_metrics(request, response, view, timings)
+
+        if settings.SERVER_TIMING:
+            response["Server-Timing"] = timings.server_timing()
+            response["Timing-Allow-Origin"] = settings.UI_ORIGIN
+
+        if timings.total * 1000 >= settings.SLOW_REQUEST_THRESHOLD_MS:
+            self.log_slow_request(request, view, timings)
+        return response
+
+    def process_template_response(self, request, response):
+        # NOTE: rendering here instead of in the handler attributes the time
+        # spent encoding the response body to the serialize phase.
+        start = time.perf_counter()
+        response.render()
+        request.timings.serialize += time.perf_counter() - start
+        return response
+
+    def record_metrics(self, request, response, view, timings):
+        registry.inc(
+            "qlue_requests_total",
+            view=view,
+            method=request.method,
+            status=response.status_code,
+        )
+        registry.observe(
+            "qlue_request_duration_seconds", timings.total, LATENCY_BUCKETS, view=view
+        )
+        if not response.streaming:
+            registry.observe(
+                "qlue_response_size_bytes",
+                len(response.content),
+                SIZE_BUCKETS,
+                view=view,
+            )
+        registry.observe(
+            "qlue_db_queries", timings.query_count, COUNT_BUCKETS, view=view
+        )
+        registry.observe(
+            "qlue_db_duration_seconds", timings.db, LATENCY_BUCKETS, view=view
+        )
+
+    def log_slow_request(self, request, view, timings):
+        lines = [
+            f"Slow request: {request.method} {request.path} ({view}) "
+            f"took {timings.total * 1000:.0f}ms; "
+            f"db: {timings.query_count} queries in {timings.db * 1000:.0f}ms, "
+            f"serialize: {timings.serialize * 1000:.0f}ms"
+        ]
+        for sql, duration in timings.queries:
+            lines.append(f"  [{duration * 1000:.1f}ms] {sql}")
+        if timings.query_count > len(timings.queries):
+            lines.append(
+                f"  ... and {timings.query_count - len(timings.queries)} more queries"
+            )
+        logger.warning("\n".join(lines))
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0011_alter_sparqlendpointconfiguration_hover_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sparqlendpointconfiguration",
+            name="proxy_enabled",
+            field=models.BooleanField(
+                db_default=False,
+                default=False,
+                help_text="Whether queries can be sent to this backend through the SPARQL proxy of this API (/api/backends/&lt;slug&gt;/sparql)",
+                verbose_name="Enable SPARQL proxy",
+            ),
+        ),
+        migrations.AddField(
+            model_name="sparqlendpointconfiguration",
+            name="result_cache_ttl",
+            field=models.PositiveIntegerField(
+                db_default=300,
+                default=300,
+                help_text="Number of seconds successful results of the SPARQL proxy are cached; 0 disables the cache",
+                verbose_name="Result cache TTL",
+            ),
+        ),
+    ]
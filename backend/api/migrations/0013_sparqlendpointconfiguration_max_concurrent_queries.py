@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0012_sparqlendpointconfiguration_proxy"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sparqlendpointconfiguration",
+            name="max_concurrent_queries",
+            field=models.PositiveIntegerField(
+                db_default=0,
+                default=0,
+                help_text="Maximum number of queries the SPARQL proxy runs on this backend at the same time, further queries wait in line; 0 disables the limit",
+                verbose_name="Max. concurrent queries",
+            ),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 5.2.7 on 2026-10-19 05:03
+
+import hashlib
+import re
+
+from django.db import migrations, models
+
+# NOTE: the template fields and the minifier of api/sparql.py as of this
+# migration, so that later changes do not change the rows it stores
+_TOKEN = re.compile(
+    r"""
+    (?P<tag>\{\{[^{}]*\}\}|\{%[^{}]*%\}|\{\#[^{}]*\#\})
+  | (?P<string>
+        \"\"\"(?:[^"\\]|\\.|"(?!""))*\"\"\"
+      | '''(?:[^'\\]|\\.|'(?!''))*'''
+      | "(?:[^"\\\n]|\\.)*"
+      | '(?:[^'\\\n]|\\.)*'
+    )
+  | (?P<iri><[^<>"{}|^`\\\x00-\x20]*>)
+  | (?P<comment>\#[^\n]*)
+  | (?P<space>\s+)
+  | (?P<other>[^"'<\#\s]+|.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def minify_template(source):
+    parts = []
+    for match in _TOKEN.finditer(source):
+        if match.lastgroup in ("comment", "space"):
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        else:
+            parts.append(match.group())
+    return "".join(parts).strip()
+
+
+TEMPLATE_FIELDS = (
+    "subject_completion",
+    "predicate_completion_context_sensitive",
+    "predicate_completion_context_insensitive",
+    "object_completion_context_sensitive",
+    "object_completion_context_insensitive",
+    "values_completion_context_sensitive",
+    "values_completion_context_insensitive",
+    "hover",
+)
+
+
+def store_templates(apps, schema_editor):
+    SparqlEndpointConfiguration = apps.get_model("api", "SparqlEndpointConfiguration")
+    QueryTemplate = apps.get_model("api", "QueryTemplate")
+    texts = {
+        minify_template(getattr(backend, field))
+        for backend in SparqlEndpointConfiguration.objects.all()
+        for field in TEMPLATE_FIELDS
+    }
+    QueryTemplate.objects.bulk_create(
+        [
+            QueryTemplate(digest=hashlib.sha256(text.encode()).hexdigest(), text=text)
+            for text in texts
+        ],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0013_sparqlendpointconfiguration_max_concurrent_queries"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="QueryTemplate",
+            fields=[
+                (
+                    "digest",
+                    models.CharField(
+                        editable=False, max_length=64, primary_key=True, serialize=False
+                    ),
+                ),
+                ("text", models.TextField(editable=False)),
+            ],
+        ),
+        migrations.RunPython(store_templates, migrations.RunPython.noop),
+    ]
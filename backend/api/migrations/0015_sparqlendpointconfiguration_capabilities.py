@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-19 05:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0014_querytemplate"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sparqlendpointconfiguration",
+            name="capabilities",
+            field=models.JSONField(
+                blank=True,
+                db_default={},
+                default=dict,
+                editable=False,
+                help_text="The features detected on the SPARQL endpoint, see api/capabilities.py",
+                verbose_name="Capabilities",
+            ),
+        ),
+    ]
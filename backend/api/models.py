@@ -1,7 +1,22 @@
+import hashlib
 import secrets
 import string
 from django.db import models, transaction
 
+from api.sparql import minify_template
+
+# NOTE: the fields of SparqlEndpointConfiguration that hold query templates
+TEMPLATE_FIELDS = (
+    "subject_completion",
+    "predicate_completion_context_sensitive",
+    "predicate_completion_context_insensitive",
+    "object_completion_context_sensitive",
+    "object_completion_context_insensitive",
+    "values_completion_context_sensitive",
+    "values_completion_context_insensitive",
+    "hover",
+)
+
 
 class SparqlEndpointConfiguration(models.Model):
     class Engine(models.IntegerChoices):
@@ -55,6 +70,24 @@ class SparqlEndpointConfiguration(models.Model):
         verbose_name="Map-view URL",
         default="https://qlever.dev/petrimaps/",
     )
+    proxy_enabled = models.BooleanField(
+        default=False,
+        db_default=False,
+        help_text="Whether queries can be sent to this backend through the SPARQL proxy of this API (/api/backends/&lt;slug&gt;/sparql)",
+        verbose_name="Enable SPARQL proxy",
+    )
+    result_cache_ttl = models.PositiveIntegerField(
+        default=300,
+        db_default=300,
+        help_text="Number of seconds successful results of the SPARQL proxy are cached; 0 disables the cache",
+        verbose_name="Result cache TTL",
+    )
+    max_concurrent_queries = models.PositiveIntegerField(
+        default=0,
+        db_default=0,
+        help_text="Maximum number of queries the SPARQL proxy runs on this backend at the same time, further queries wait in line; 0 disables the limit",
+        verbose_name="Max. concurrent queries",
+    )
     prefixes = models.TextField(
         default=(
             "PREFIX owl: <http://www.w3.org/2002/07/owl#>\n"
@@ -394,6 +427,15 @@ class SparqlEndpointConfiguration(models.Model):
         verbose_name="Hover",
     )
 
+    capabilities = models.JSONField(
+        default=dict,
+        db_default={},
+        blank=True,
+        editable=False,
+        help_text="The features detected on the SPARQL endpoint, see api/capabilities.py",
+        verbose_name="Capabilities",
+    )
+
     @property
     def is_hidden(self) -> bool:
         return self.sort_key == "0"
@@ -408,6 +450,35 @@ class SparqlEndpointConfiguration(models.Model):
                     pk=self.pk
                 ).update(is_default=False)
         super().save(*args, **kwargs)
+        QueryTemplate.store(getattr(self, field) for field in TEMPLATE_FIELDS)
+
+
+class QueryTemplate(models.Model):
+    """
+    A minified query template, stored once for all backends that use it and
+    addressed by the SHA-256 digest of its text. Rows are never changed or
+    deleted, so that clients can cache them forever.
+    """
+
+    digest = models.CharField(primary_key=True, max_length=64, editable=False)
+    text = models.TextField(editable=False)
+
+    @staticmethod
+    def digest_of(source: str) -> str:
+        """The digest of the minified template `source`."""
+        return hashlib.sha256(minify_template(source).encode()).hexdigest()
+
+    @classmethod
+    def store(cls, sources) -> list[str]:
+        """Store the minified templates `sources`; returns their digests."""
+        templates = {
+            cls.digest_of(source): minify_template(source) for source in sources
+        }
+        cls.objects.bulk_create(
+            [cls(digest=digest, text=text) for digest, text in templates.items()],
+            ignore_conflicts=True,
+        )
+        return list(templates)
 
 
 class QueryExample(models.Model):
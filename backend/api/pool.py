@@ -0,0 +1,252 @@
+"""
+Keep-alive connection pools for SPARQL endpoints.
+
+Each worker process keeps one pool per backend, shared by all request
+threads. A pool holds up to SPARQL_POOL_SIZE idle connections to
+`SparqlEndpointConfiguration.url` and is replaced as soon as a request sees
+a different URL for the backend, e.g. after it was changed in the admin.
+Connections are opened with SPARQL_CONNECT_TIMEOUT and then wait up to
+SPARQL_PROXY_TIMEOUT for the endpoint.
+"""
+
+import http.client
+import os
+import threading
+import time
+import urllib.parse
+from collections import deque
+from collections.abc import Callable
+
+from django.conf import settings
+
+from api.metrics import LATENCY_BUCKETS, registry
+
+
+class _TimedConnection:
+    """
+    Records the duration of the TCP connect and, for HTTPS, of the TLS
+    handshake, and switches to the read timeout once connected.
+    """
+
+    def __init__(self, *args, read_timeout: float, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read_timeout = read_timeout
+        self.tcp_seconds = 0.0
+        self.tls_seconds = 0.0
+        create_connection = self._create_connection
+
+        def timed_create_connection(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return create_connection(*args, **kwargs)
+            finally:
+                self.tcp_seconds = time.perf_counter() - start
+
+        self._create_connection = timed_create_connection
+
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        if isinstance(self, http.client.HTTPSConnection):
+            self.tls_seconds = time.perf_counter() - start - self.tcp_seconds
+        self.sock.settimeout(self.read_timeout)
+
+    def set_read_timeout(self, timeout: float):
+        self.read_timeout = timeout
+        if self.sock is not None:
+            self.sock.settimeout(timeout)
+
+
+class HTTPConnection(_TimedConnection, http.client.HTTPConnection):
+    pass
+
+
+class HTTPSConnection(_TimedConnection, http.client.HTTPSConnection):
+    pass
+
+
+class PooledResponse:
+    """
+    An upstream response. Closing it returns the connection to its pool if
+    the body was read completely and the server allows keep-alive.
+    """
+
+    def __init__(self, pool: "ConnectionPool", connection, response):
+        self.pool = pool
+        self.connection = connection
+        self.response = response
+        self.status = response.status
+        self.headers = response.headers
+
+    def read(self, amount: int | None = None) -> bytes:
+        return self.response.read(amount)
+
+    def read1(self, amount: int = -1) -> bytes:
+        """Read up to `amount` bytes, without waiting for more than are available."""
+        chunk = self.response.read1(amount)
+        # NOTE: unlike read(), read1() ends a body cut off before its
+        # Content-Length silently
+        if not chunk and amount and self.response.length:
+            raise http.client.IncompleteRead(b"", self.response.length)
+        return chunk
+
+    def close(self):
+        if self.connection is None:
+            return
+        reusable = self.response.isclosed() and not self.response.will_close
+        self.response.close()
+        if reusable:
+            # NOTE: a timeout of a single request must not stay with the connection
+            self.connection.set_read_timeout(settings.SPARQL_PROXY_TIMEOUT)
+            self.pool.release(self.connection)
+        else:
+            self.connection.close()
+        self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ConnectionPool:
+    def __init__(self, slug: str, url: str):
+        self.slug = slug
+        self.url = url
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL scheme: {url}")
+        self.connection_class = (
+            HTTPSConnection if parsed.scheme == "https" else HTTPConnection
+        )
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = urllib.parse.urlunsplit(
+            ("", "", parsed.path or "/", parsed.query, "")
+        )
+        self._lock = threading.Lock()
+        self._idle: deque = deque()
+        self.closed = False
+
+    def _connect(self):
+        connection = self.connection_class(
+            self.host,
+            self.port,
+            timeout=settings.SPARQL_CONNECT_TIMEOUT,
+            read_timeout=settings.SPARQL_PROXY_TIMEOUT,
+        )
+        connection.connect()
+        if connection.tls_seconds:
+            registry.observe(
+                "qlue_sparql_tls_handshake_seconds",
+                connection.tls_seconds,
+                LATENCY_BUCKETS,
+                backend=self.slug,
+            )
+        return connection
+
+    def acquire(self) -> tuple[http.client.HTTPConnection, bool]:
+        """An idle connection (newest first) or a new one, and whether it is reused."""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connect(), False
+
+    def release(self, connection):
+        with self._lock:
+            if not self.closed and len(self._idle) < settings.SPARQL_POOL_SIZE:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            idle, self._idle = self._idle, deque()
+        for connection in idle:
+            connection.close()
+
+    def request(
+        self,
+        method: str,
+        body: bytes | None,
+        headers: dict,
+        on_connection: Callable[[http.client.HTTPConnection], None] | None = None,
+        timeout: float | None = None,
+    ) -> PooledResponse:
+        """
+        Send a request to the endpoint URL. A request on a reused connection
+        that the server closed in the meantime is retried on another one.
+        `on_connection` is called with the connection before it is used;
+        `timeout` replaces SPARQL_PROXY_TIMEOUT for this request.
+        """
+        while True:
+            connection, reused = self.acquire()
+            try:
+                if timeout is not None:
+                    connection.set_read_timeout(timeout)
+                if on_connection is not None:
+                    on_connection(connection)
+                connection.request(method, self.path, body=body, headers=headers)
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError):
+                connection.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            registry.inc(
+                "qlue_sparql_connections_total",
+                backend=self.slug,
+                reused=str(reused).lower(),
+            )
+            return PooledResponse(self, connection, response)
+
+
+def post_form(
+    pool: ConnectionPool, params: dict, accept: str, timeout: float | None = None
+) -> PooledResponse:
+    """POST `params` form-encoded to the endpoint of `pool`."""
+    return pool.request(
+        "POST",
+        urllib.parse.urlencode(params).encode(),
+        {
+            "Accept": accept,
+            "Content-Type": "application/x-www-form-urlencoded;charset=UTF-8",
+        },
+        timeout=timeout,
+    )
+
+
+class PoolManager:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools: dict[str, ConnectionPool] = {}
+        self._pid = os.getpid()
+
+    def get(self, backend) -> ConnectionPool:
+        """The pool of a backend, rebuilt if its URL changed."""
+        with self._lock:
+            # NOTE: sockets must not be shared with a forked parent process
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pools = {}
+            current = self._pools.get(backend.slug)
+            if current is not None and current.url == backend.url:
+                return current
+            pool = self._pools[backend.slug] = ConnectionPool(backend.slug, backend.url)
+        if current is not None:
+            current.close()
+        return pool
+
+    def clear(self):
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            pool.close()
+
+
+pools = PoolManager()
@@ -0,0 +1,103 @@
+"""
+Preview execution of queries with continuation tokens.
+
+A preview runs a query for its first rows only and returns a continuation
+token for the rest, so that showing the full result does not compute the
+first rows again. How the rest is fetched depends on the engine:
+
+- Engines in `OFFSET_ENGINES` answer OFFSET queries cheaply (QLever keeps
+  the full result in its cache), so the preview runs the query with an
+  injected LIMIT and the continuation with the matching OFFSET.
+- For all other engines the preview runs the full query and answers as
+  soon as the first rows arrived; the upstream request keeps running and
+  writes the full result to the row store (see `rowstore.py`), from which
+  the continuation is served. Like every proxied query it waits for a slot
+  of the backend. It is pinned for SPARQL_PIN_SECONDS, and for at most
+  SPARQL_PINS_PER_CLIENT queries of a client at a time; afterwards it is
+  cancelled unless a continuation is reading it, and other previews run
+  unpinned, so that their continuation runs the query again.
+
+Tokens are signed and carry the backend, the original query, its
+parameters and the number of rows already sent.
+"""
+
+import json
+from collections.abc import Iterable
+
+from django.conf import settings
+from django.core import signing
+
+from api.models import SparqlEndpointConfiguration
+from api.results import RewrittenResult, SparqlJsonScanner
+
+Engine = SparqlEndpointConfiguration.Engine
+
+OFFSET_ENGINES = {Engine.QLEVER}
+MAX_PREVIEW_ROWS = 10_000
+_SALT = "api.preview"
+
+
+def make_token(
+    backend: SparqlEndpointConfiguration,
+    query: str,
+    params: list[tuple[str, str]],
+    rows: int,
+) -> str:
+    return signing.dumps(
+        {"backend": backend.slug, "query": query, "params": params, "rows": rows},
+        salt=_SALT,
+        compress=True,
+    )
+
+
+def read_token(token: str) -> dict:
+    """The contents of a token; raises `signing.BadSignature` if invalid."""
+    data = signing.loads(token, salt=_SALT, max_age=settings.SPARQL_ROWS_MAX_AGE)
+    data["params"] = [tuple(param) for param in data["params"]]
+    return data
+
+
+def spills(backend: SparqlEndpointConfiguration) -> bool:
+    """Whether previews on `backend` run the full query into the row store."""
+    return backend.engine not in OFFSET_ENGINES and settings.SPARQL_ROWS_DISK_BYTES > 0
+
+
+def _close(body: Iterable[bytes]):
+    if hasattr(body, "close"):
+        body.close()
+
+
+def first_rows(body: Iterable[bytes], count: int) -> tuple[dict, list[dict], bool]:
+    """
+    Read the head and the first `count` bindings of a SPARQL JSON result,
+    and whether there are more. Closes the body.
+    """
+    scanner = SparqlJsonScanner(capture_bindings=True)
+    rows = []
+    try:
+        for chunk in body:
+            rows += scanner.feed(chunk)
+            if len(rows) > count:
+                break
+    finally:
+        _close(body)
+    if scanner.head is None:
+        raise ValueError("The result has no head")
+    return scanner.head, rows[:count], len(rows) > count
+
+
+def sparql_json(head: dict, rows: list[dict]) -> bytes:
+    return json.dumps({"head": head, "results": {"bindings": rows}}).encode()
+
+
+def skip_rows(body: Iterable[bytes], count: int) -> RewrittenResult:
+    """A SPARQL JSON result without its first `count` bindings."""
+    seen = 0
+
+    def skip(rows: list[dict]) -> list[dict]:
+        nonlocal seen
+        rest = rows[max(0, count - seen) :]
+        seen += len(rows)
+        return rest
+
+    return RewrittenResult(body, skip)
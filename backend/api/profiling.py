@@ -0,0 +1,111 @@
+"""
+On-demand profiling of live requests.
+
+A request is run under cProfile when it carries the `X-Profile` header with
+the configured PROFILING_TOKEN, or when it is picked by the sampling rate
+PROFILING_SAMPLE_RATE. The pstats output is written to PROFILING_DIR,
+together with a small JSON file describing the request. Only the newest
+PROFILING_MAX_FILES profiles are kept. Captured profiles are listed in the
+admin under /admin/profiles/.
+"""
+
+import cProfile
+import json
+import random
+import re
+import secrets
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+# NOTE: only one profiler can be active per process
+_profiler_lock = threading.Lock()
+
+
+def profile_dir() -> Path:
+    return Path(settings.PROFILING_DIR)
+
+
+def list_profiles() -> list[dict]:
+    """Metadata of all captured profiles, newest first."""
+    profiles = []
+    for path in sorted(profile_dir().glob("*.json"), reverse=True):
+        try:
+            profiles.append(json.loads(path.read_text()))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def profile_path(name: str) -> Path | None:
+    """Path of the pstats file of a captured profile, if it exists."""
+    if not re.fullmatch(r"[\w.-]+\.prof", name):
+        return None
+    path = profile_dir() / name
+    return path if path.exists() else None
+
+
+def _rotate():
+    profiles = sorted(profile_dir().glob("*.prof"), reverse=True)
+    for path in profiles[settings.PROFILING_MAX_FILES :]:
+        path.unlink(missing_ok=True)
+        path.with_suffix(".json").unlink(missing_ok=True)
+
+
+def _should_profile(request) -> bool:
+    token = request.headers.get("X-Profile")
+    if token is not None:
+        return bool(settings.PROFILING_TOKEN) and secrets.compare_digest(
+            token, settings.PROFILING_TOKEN
+        )
+    return random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not _should_profile(request) or not _profiler_lock.acquire(blocking=False):
+            return self.get_response(request)
+
+        try:
+            profiler = cProfile.Profile()
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            latency_ms = (time.perf_counter() - start) * 1000
+            self.save(request, response, profiler, latency_ms)
+        finally:
+            _profiler_lock.release()
+        return response
+
+    def save(self, request, response, profiler, latency_ms):
+        match = request.resolver_match
+        view = match.view_name if match else "unresolved"
+        name = "{}-{}-{:.0f}ms-{}".format(
+            time.strftime("%Y%m%d-%H%M%S"),
+            re.sub(r"[^\w.-]", "_", view),
+            latency_ms,
+            secrets.token_hex(2),
+        )
+        directory = profile_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(directory / f"{name}.prof")
+        metadata = {
+            "file": f"{name}.prof",
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "view": view,
+            "method": request.method,
+            # NOTE: without the query string, which may hold tokens
+            "path": request.path,
+            "status": response.status_code,
+            "latency_ms": round(latency_ms, 1),
+        }
+        (directory / f"{name}.json").write_text(json.dumps(metadata))
+        _rotate()
@@ -0,0 +1,606 @@
+"""
+Server-side proxy for SPARQL queries against configured backends.
+
+Queries are accepted like a SPARQL endpoint (GET or POST with a `query`
+parameter, or POST with an `application/sparql-query` body) and forwarded to
+`SparqlEndpointConfiguration.url`. Successful results are cached per backend,
+normalized query, Accept header and remaining parameters for
+`SparqlEndpointConfiguration.result_cache_ttl` seconds; see `cache.py`.
+Identical queries that are running at the same time share a single upstream
+request; see `coalesce.py`. Upstream requests wait for one of the
+`SparqlEndpointConfiguration.max_concurrent_queries` slots of the backend,
+ordered by the `X-Query-Priority` header; see `scheduler.py`. Queries whose
+clients all disconnected are cancelled on the engine; see `cancel.py`.
+Complete SPARQL JSON results are kept as rows on disk and served in pages by
+their `X-Result-Id`; see `rowstore.py`. With `X-Preview-Rows`, only the
+first rows are returned, with a token to continue; see `preview.py`.
+"""
+
+import re
+import select
+import socket
+import time
+import urllib.parse
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core import signing
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from api.cache import cache_key, result_cache
+from api.cancel import QueryCancelled, cancel_query, identify_query, new_query_id
+from api.coalesce import CHUNK_SIZE, Coalescer, Flight, PinLimit
+from api.formats import FORMATS, Converter
+from api.metrics import LATENCY_BUCKETS, ROW_BUCKETS, registry
+from api.models import SparqlEndpointConfiguration
+from api.pool import pools
+from api.preview import (
+    MAX_PREVIEW_ROWS,
+    OFFSET_ENGINES,
+    first_rows,
+    make_token,
+    read_token,
+    skip_rows,
+    sparql_json,
+    spills,
+)
+from api.results import SparqlJsonScanner
+from api.rowstore import RowWriter, StoredResult, is_stored, open_result
+from api.scheduler import DEFAULT_PRIORITY, PRIORITIES, QueueRejected, scheduler
+from api.sparql import normalize_query, solution_slice, with_slice
+
+SPARQL_JSON = "application/sparql-results+json"
+DEFAULT_ACCEPT = SPARQL_JSON
+# NOTE: status logged for requests whose client disconnected, as in nginx
+CLIENT_CLOSED_REQUEST = 499
+DISCONNECT_POLL_INTERVAL = 0.5
+RESULT_ID = re.compile(r"[0-9a-f]{64}")
+ROW_RANGE = re.compile(r"rows=(?P<first>\d+)-(?P<last>\d*)")
+
+coalescer = Coalescer()
+pins = PinLimit()
+
+
+def parse_sparql_request(request) -> tuple[str | None, list[tuple[str, str]]]:
+    """
+    Extract the query and all remaining parameters of a SPARQL protocol request.
+    """
+    if request.method == "POST" and request.content_type == "application/sparql-query":
+        params = list(request.GET.lists())
+        query = request.body.decode("utf-8")
+    else:
+        params = list(request.GET.lists()) + list(request.POST.lists())
+        query = None
+    rest = []
+    for name, values in params:
+        for value in values:
+            if name == "query" and query is None:
+                query = value
+            elif name != "query":
+                rest.append((name, value))
+    return query, sorted(rest)
+
+
+def fetch_upstream(
+    flight: Flight,
+    backend: SparqlEndpointConfiguration,
+    query: str,
+    accept: str,
+    params: list[tuple[str, str]],
+    headers: dict[str, str] | None = None,
+    store_key: str | None = None,
+):
+    """
+    Send a query to the SPARQL endpoint of a backend and stream the
+    response into `flight`; `headers` are passed on to the clients. Chunks
+    are passed on as soon as they arrive; SPARQL JSON results are scanned
+    on the way for their head and number of bindings, and written to the
+    row store as `store_key` (see `rowstore.py`).
+    """
+    start = time.perf_counter()
+    query_id = new_query_id()
+    id_params, id_headers = identify_query(backend, query_id)
+    body = urllib.parse.urlencode([("query", query), *params, *id_params]).encode()
+    pool = pools.get(backend)
+
+    def on_connection(connection):
+        if flight.abandoned.is_set():
+            raise QueryCancelled()
+        flight.on_abandon(lambda: cancel_query(backend, pool, query_id, connection))
+
+    response = pool.request(
+        "POST",
+        body,
+        {
+            "Accept": accept,
+            "Content-Type": "application/x-www-form-urlencoded;charset=UTF-8",
+            **id_headers,
+        },
+        on_connection=on_connection,
+    )
+    registry.inc(
+        "qlue_sparql_upstream_requests_total",
+        backend=backend.slug,
+        status=response.status,
+    )
+    content_type = response.headers.get("Content-Type", accept)
+    scanner = store = None
+    if response.status == 200 and content_type.startswith(SPARQL_JSON):
+        if store_key is not None and settings.SPARQL_ROWS_DISK_BYTES > 0:
+            store = RowWriter(store_key, backend.slug)
+            headers = {**(headers or {}), "X-Result-Id": store_key}
+        scanner = SparqlJsonScanner(capture_bindings=store is not None)
+    try:
+        with response:
+            flight.start(response.status, content_type, headers)
+            registry.observe(
+                "qlue_sparql_upstream_ttfb_seconds",
+                time.perf_counter() - start,
+                LATENCY_BUCKETS,
+                backend=backend.slug,
+            )
+            while chunk := response.read1(CHUNK_SIZE):
+                flight.write(chunk)
+                if scanner is None:
+                    continue
+                try:
+                    rows = scanner.feed(chunk)
+                except ValueError:
+                    # NOTE: not valid SPARQL JSON, the body is passed on as is
+                    scanner = None
+                    if store is not None:
+                        store.abort()
+                    store = None
+                    flight.unpin()
+                    continue
+                if store is not None:
+                    store.add(rows)
+                    if store.closed:
+                        # NOTE: too large for the row store, a pinned flight
+                        # has no reason to run on without clients
+                        store = None
+                        flight.unpin()
+                if flight.result_head is None:
+                    flight.result_head = scanner.head
+        if flight.abandoned.is_set():
+            # NOTE: the body may have been cut off by closing the connection
+            raise QueryCancelled()
+        if scanner is not None:
+            flight.result_rows = scanner.bindings
+            registry.observe(
+                "qlue_sparql_result_rows",
+                scanner.bindings,
+                ROW_BUCKETS,
+                backend=backend.slug,
+            )
+            if store is not None:
+                store.commit(scanner.head)
+    finally:
+        if store is not None:
+            store.abort()
+
+
+def client_disconnected(request) -> bool:
+    """
+    Whether the client closed the connection, detected by peeking at the
+    socket gunicorn passes in the WSGI environ.
+    """
+    sock = request.META.get("gunicorn.socket")
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b""
+    except ValueError:
+        return False
+    except OSError:
+        return True
+
+
+def client_id(request) -> str:
+    """The address of the client, as forwarded by the reverse proxy."""
+    forwarded = request.headers.get("X-Forwarded-For", "")
+    return forwarded.split(",")[0].strip() or request.META.get("REMOTE_ADDR", "")
+
+
+class FlightReader:
+    """
+    Streams the body of a flight to one client and leaves the flight when
+    the response is closed, even if it was never iterated.
+    """
+
+    def __init__(self, flight: Flight):
+        self.flight = flight
+        self.closed = False
+
+    def __iter__(self):
+        return self.flight.chunks()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.flight.leave()
+
+
+@dataclass
+class Result:
+    """The response of a backend: from cache (`body` is bytes) or streamed."""
+
+    status: int
+    content_type: str
+    body: bytes | Iterable[bytes]
+    headers: dict[str, str]
+
+
+def proxied_backend(slug: str) -> SparqlEndpointConfiguration:
+    backend = get_object_or_404(SparqlEndpointConfiguration, slug=slug)
+    if not backend.proxy_enabled:
+        raise Http404("The SPARQL proxy is not enabled for this backend")
+    return backend
+
+
+def result_key(
+    backend: SparqlEndpointConfiguration,
+    query: str,
+    accept: str,
+    params: list[tuple[str, str]],
+) -> str:
+    """The key of a query in the result cache and the row store."""
+    return cache_key(backend.slug, backend.url, normalize_query(query), accept, params)
+
+
+def execute(
+    request,
+    backend: SparqlEndpointConfiguration,
+    query: str,
+    accept: str,
+    params: list[tuple[str, str]],
+    pin: bool = False,
+    ttl: int | None = None,
+    priority: str | None = None,
+) -> Result | HttpResponse:
+    """
+    Execute a query on a backend, from cache or by joining or starting an
+    upstream request. Returns an error response if that failed. With `pin`,
+    the upstream request runs on for up to SPARQL_PIN_SECONDS after all
+    clients left, unless the client already pinned SPARQL_PINS_PER_CLIENT
+    running requests.
+    Results are cached for `ttl` seconds (by default the result cache TTL
+    of the backend); `priority` defaults to the `X-Query-Priority` header.
+    """
+    if ttl is None:
+        ttl = backend.result_cache_ttl
+    if priority is None:
+        priority = request.headers.get("X-Query-Priority", DEFAULT_PRIORITY)
+    if priority not in PRIORITIES:
+        return JsonResponse(
+            {"error": f"Unknown priority, expected one of {', '.join(PRIORITIES)}"},
+            status=400,
+        )
+
+    key = result_key(backend, query, accept, params)
+    if ttl > 0:
+        entry = result_cache.get(key)
+        try:
+            body = entry.read() if entry is not None else None
+        except OSError:
+            # NOTE: the spill file was evicted concurrently
+            body = None
+        if body is not None:
+            headers = {"X-Cache": "HIT"}
+            if is_stored(key):
+                headers["X-Result-Id"] = key
+            return Result(entry.status, entry.content_type, body, headers)
+
+    client = client_id(request)
+
+    def fetch(flight):
+        ticket = scheduler.acquire(backend, priority, client, flight.abandoned)
+        try:
+            fetch_upstream(
+                flight,
+                backend,
+                query,
+                accept,
+                params,
+                headers={
+                    "X-Queue-Position": str(ticket.position),
+                    "X-Queue-Wait": f"{ticket.wait * 1000:.0f}",
+                },
+                store_key=key,
+            )
+        finally:
+            scheduler.release(backend, ticket)
+
+    def cache_result(flight):
+        if flight.status == 200:
+            result_cache.put_chunks(
+                key,
+                flight.status,
+                flight.content_type,
+                flight.chunks(follow=False),
+                flight.size,
+                ttl,
+            )
+
+    # NOTE: identical queries that are already running upstream are not sent
+    # again; their response is streamed to every waiting client. Waiting for
+    # a slot of the backend is bounded by the queue of the scheduler, the
+    # upstream request by the connect and read timeouts of the connection pool.
+    flight, started = coalescer.join(
+        key, fetch, on_done=cache_result if ttl > 0 else None
+    )
+    if (
+        pin
+        and not flight.pinned
+        and pins.admit(client, flight, settings.SPARQL_PINS_PER_CLIENT)
+    ):
+        flight.pin(settings.SPARQL_PIN_SECONDS)
+    reader = FlightReader(flight)
+    if not started:
+        registry.inc("qlue_sparql_coalesced_total", backend=backend.slug)
+    # NOTE: a client that disconnects while the query is computed leaves the
+    # flight, which cancels the query once no other client waits for it.
+    while not flight.wait_started(timeout=DISCONNECT_POLL_INTERVAL):
+        if isinstance(flight.error, QueueRejected):
+            reader.close()
+            response = JsonResponse(
+                {
+                    "error": f"The backend is busy: {flight.error}",
+                    "position": flight.error.position,
+                },
+                status=503,
+            )
+            response["Retry-After"] = str(flight.error.retry_after)
+            response["X-Queue-Position"] = str(flight.error.position)
+            return response
+        if flight.done:
+            reader.close()
+            return JsonResponse(
+                {"error": f"The SPARQL endpoint is unreachable: {flight.error}"},
+                status=502,
+            )
+        if client_disconnected(request):
+            reader.close()
+            return HttpResponse(status=CLIENT_CLOSED_REQUEST)
+
+    return Result(
+        flight.status,
+        flight.content_type,
+        reader,
+        {**flight.headers, "X-Cache": "MISS" if started else "COALESCED"},
+    )
+
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+def sparql_proxy(request, slug: str):
+    """
+    Execute a SPARQL query on a backend, serving repeated queries from cache.
+    """
+    backend = proxied_backend(slug)
+    query, params = parse_sparql_request(request)
+    if not query:
+        return JsonResponse({"error": "Missing query"}, status=400)
+    accept = request.headers.get("Accept") or DEFAULT_ACCEPT
+    if accept == "*/*":
+        accept = DEFAULT_ACCEPT
+
+    preview = request.headers.get("X-Preview-Rows")
+    if preview is not None and solution_slice(query) is not None:
+        response = preview_query(request, backend, query, accept, params, preview)
+    else:
+        response = to_response(execute(request, backend, query, accept, params))
+    return response
+
+
+def to_response(result: Result | HttpResponse) -> HttpResponse:
+    if isinstance(result, HttpResponse):
+        return result
+    response_class = (
+        HttpResponse if isinstance(result.body, bytes) else StreamingHttpResponse
+    )
+    response = response_class(
+        result.body, status=result.status, content_type=result.content_type
+    )
+    for name, value in result.headers.items():
+        response[name] = value
+    return response
+
+
+def preview_query(
+    request,
+    backend: SparqlEndpointConfiguration,
+    query: str,
+    accept: str,
+    params: list[tuple[str, str]],
+    preview: str,
+) -> HttpResponse:
+    """
+    Answer with the first `preview` rows of a query and, if there are more,
+    a continuation token for the rest; see `preview.py`.
+    """
+    if not preview.isdigit() or not 0 < int(preview) <= MAX_PREVIEW_ROWS:
+        return JsonResponse(
+            {"error": f"X-Preview-Rows must be between 1 and {MAX_PREVIEW_ROWS}"},
+            status=400,
+        )
+    if accept != SPARQL_JSON:
+        return JsonResponse(
+            {"error": f"Previews are only available as {SPARQL_JSON}"}, status=400
+        )
+    current = solution_slice(query)
+    rows = int(preview)
+    if current.limit is not None:
+        rows = min(rows, current.limit)
+    if spills(backend):
+        result = execute(request, backend, query, accept, params, pin=True)
+    else:
+        # NOTE: one more row than shown tells whether there are more
+        limit = rows + 1 if current.limit is None or rows < current.limit else rows
+        sliced = with_slice(query, limit, current.offset)
+        result = execute(request, backend, sliced, accept, params)
+    if isinstance(result, HttpResponse) or result.status != 200:
+        return to_response(result)
+
+    body = [result.body] if isinstance(result.body, bytes) else result.body
+    try:
+        head, bindings, more = first_rows(body, rows)
+    except ValueError as error:
+        return JsonResponse({"error": f"Invalid result: {error}"}, status=502)
+    response = HttpResponse(sparql_json(head, bindings), content_type=SPARQL_JSON)
+    response["X-Cache"] = result.headers["X-Cache"]
+    if spills(backend) and "X-Result-Id" in result.headers:
+        response["X-Result-Id"] = result.headers["X-Result-Id"]
+    if more and (current.limit is None or rows < current.limit):
+        response["X-Continuation-Token"] = make_token(backend, query, params, rows)
+    return response
+
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+def sparql_continue(request, slug: str):
+    """
+    Fetch the rows of a previewed query after the preview, given the
+    `token` parameter from its `X-Continuation-Token`.
+    """
+    backend = proxied_backend(slug)
+    try:
+        token = read_token(request.POST.get("token") or request.GET.get("token", ""))
+    except signing.BadSignature:
+        return JsonResponse(
+            {"error": "Invalid or expired continuation token"}, status=400
+        )
+    if token["backend"] != backend.slug:
+        return JsonResponse(
+            {"error": "The continuation token is for another backend"}, status=400
+        )
+    query, params, sent = token["query"], token["params"], token["rows"]
+
+    stored = open_result(result_key(backend, query, SPARQL_JSON, params))
+    if stored is not None:
+        registry.inc("qlue_sparql_continuations_total", backend=slug, source="store")
+        response = StreamingHttpResponse(
+            stored_chunks(stored, start=sent), content_type=SPARQL_JSON
+        )
+        response["X-Cache"] = "HIT"
+        return response
+    if backend.engine in OFFSET_ENGINES:
+        registry.inc("qlue_sparql_continuations_total", backend=slug, source="offset")
+        current = solution_slice(query)
+        limit = None if current.limit is None else current.limit - sent
+        query = with_slice(query, limit, current.offset + sent)
+        result = execute(request, backend, query, SPARQL_JSON, params)
+        return to_response(result)
+
+    # NOTE: the full result was evicted or never stored, run it again
+    registry.inc("qlue_sparql_continuations_total", backend=slug, source="rerun")
+    result = execute(request, backend, query, SPARQL_JSON, params)
+    if not isinstance(result, HttpResponse) and result.status == 200:
+        body = [result.body] if isinstance(result.body, bytes) else result.body
+        result.body = skip_rows(body, sent)
+    return to_response(result)
+
+
+def stored_chunks(stored: StoredResult, start: int = 0):
+    """The chunks of a stored result; closes it when done or closed."""
+    try:
+        yield from stored.chunks(start=start)
+    finally:
+        stored.close()
+
+
+@require_http_methods(["GET"])
+def sparql_results(request, slug: str, key: str):
+    """
+    Serve a result from the row store by its `X-Result-Id`. A range of rows
+    is requested with `Range: rows=<first>-<last>` (inclusive, zero-based).
+    """
+    proxied_backend(slug)
+    if not RESULT_ID.fullmatch(key):
+        return JsonResponse({"error": "Invalid result id"}, status=400)
+    stored = open_result(key, backend=slug)
+    if stored is None:
+        return JsonResponse({"error": "The result is not stored"}, status=404)
+
+    range_header = request.headers.get("Range")
+    if range_header is None:
+        response = StreamingHttpResponse(
+            stored_chunks(stored), content_type=SPARQL_JSON
+        )
+        response["Accept-Ranges"] = "rows"
+        return response
+    try:
+        match = ROW_RANGE.fullmatch(range_header.strip())
+        if match is None:
+            return JsonResponse({"error": "Invalid Range header"}, status=400)
+        first = int(match["first"])
+        last = min(int(match["last"] or stored.rows - 1), stored.rows - 1)
+        if first > last:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"rows */{stored.rows}"
+            return response
+        response = HttpResponse(
+            stored.page(first, last + 1), status=206, content_type=SPARQL_JSON
+        )
+    finally:
+        stored.close()
+    response["Accept-Ranges"] = "rows"
+    response["Content-Range"] = f"rows {first}-{last}/{stored.rows}"
+    return response
+
+
+@require_http_methods(["GET"])
+def sparql_download(request, slug: str):
+    """
+    Execute a SPARQL query on a backend and download the result converted to
+    the `format` parameter (see `formats.py`) as it arrives.
+    """
+    backend = proxied_backend(slug)
+    query = request.GET.get("query")
+    if not query:
+        return JsonResponse({"error": "Missing query"}, status=400)
+    output = FORMATS.get(request.GET.get("format", "tsv"))
+    if output is None:
+        return JsonResponse(
+            {"error": f"Unknown format, expected one of {', '.join(FORMATS)}"},
+            status=400,
+        )
+
+    # NOTE: a result in the row store is converted without running the query
+    stored = open_result(result_key(backend, query, SPARQL_JSON, []))
+    if stored is not None:
+        result = Result(200, SPARQL_JSON, stored_chunks(stored), {"X-Cache": "HIT"})
+    else:
+        result = execute(request, backend, query, SPARQL_JSON, [])
+        if isinstance(result, HttpResponse):
+            return result
+    body = [result.body] if isinstance(result.body, bytes) else result.body
+    if result.status != 200:
+        return StreamingHttpResponse(
+            body, status=result.status, content_type=result.content_type
+        )
+    converter = Converter(body, result.content_type, output, backend.slug)
+    try:
+        variables = converter.variables()
+    except ValueError as error:
+        converter.close()
+        return JsonResponse({"error": f"Invalid result: {error}"}, status=502)
+    if output.triples and len(variables) != 3:
+        converter.close()
+        return JsonResponse(
+            {"error": "Only results with exactly three variables are triples"},
+            status=400,
+        )
+
+    name = re.sub(r"[^\w.-]", "_", request.GET.get("name", "")) or backend.slug
+    response = StreamingHttpResponse(converter, content_type=output.content_type)
+    response["Content-Disposition"] = (
+        f'attachment; filename="{name}.{output.extension}"'
+    )
+    response["X-Cache"] = result.headers["X-Cache"]
+    return response
@@ -0,0 +1,227 @@
+"""
+Incremental scanning of SPARQL JSON results (application/sparql-results+json),
+and of SPARQL XML results, see `SparqlXmlScanner`.
+
+The scanner is fed the body chunk by chunk as it arrives and never holds
+more than the current chunk, the `head` object and the binding being read.
+Runs of complete bindings (whose values are flat objects, i.e. all but
+RDF-star triple terms) are matched by a single regular expression and parsed
+with one `json.loads` call per chunk; everything else is scanned token by
+token. Without `capture_bindings`, such bindings are only counted by
+matching them one by one, without parsing them.
+"""
+
+import json
+import re
+from collections.abc import Callable, Iterable, Iterator
+from xml.etree.ElementTree import ParseError, XMLPullParser
+
+_STRING = rb'"(?:[^"\\]++|\\.)*+"'
+# NOTE: a lone quote matches only a string that is cut off by the chunk end
+_TOKEN = re.compile(_STRING + rb'|"|[{}\[\]]')
+_FLAT_OBJECT = rb"\{(?:[^\"{}]++|" + _STRING + rb")*+\}"
+_BINDING = rb"\{(?:[^\"{}]++|" + _STRING + rb"|" + _FLAT_OBJECT + rb")*+\}"
+_BINDING_RUN = re.compile(
+    rb"[\s,]*+(" + _BINDING + rb"(?:[\s,]*+" + _BINDING + rb")*+)"
+)
+_BINDING_ITEM = re.compile(rb"[\s,]*+" + _BINDING)
+
+# paths of open containers: (is object, key of the container in its parent)
+_TOP = [(True, None)]
+_BINDINGS = [*_TOP, (True, b'"results"'), (False, b'"bindings"')]
+
+_XML = "{http://www.w3.org/2005/sparql-results#}"
+_XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+
+class SparqlJsonScanner:
+    """
+    Extracts `head` as soon as it is complete and counts the bindings. With
+    `capture_bindings`, `feed` returns the bindings completed in the chunk.
+    """
+
+    def __init__(self, capture_bindings: bool = False):
+        self.capture_bindings = capture_bindings
+        self.head: dict | None = None
+        self.bindings = 0
+        self.size = 0
+        self._stack: list[tuple[bool, bytes | None]] = []
+        self._key: bytes | None = None
+        self._tail = b""
+        self._capture: bytearray | None = None
+        self._capture_depth = 0
+
+    def feed(self, chunk: bytes) -> list[dict]:
+        self.size += len(chunk)
+        data = self._tail + chunk if self._tail else chunk
+        stack = self._stack
+        rows = []
+        capture_start = 0
+        end = len(data)
+        position = 0
+        while True:
+            if stack == _BINDINGS and not self.capture_bindings:
+                for item in _BINDING_ITEM.finditer(data, position):
+                    if item.start() != position:
+                        break
+                    self.bindings += 1
+                    position = item.end()
+            elif stack == _BINDINGS and self._capture is None:
+                run = _BINDING_RUN.match(data, position)
+                if run is not None:
+                    values = json.loads(b"[" + run.group(1) + b"]")
+                    self.bindings += len(values)
+                    rows.extend(values)
+                    position = run.end()
+            match = _TOKEN.search(data, position)
+            if match is None:
+                break
+            position = match.end()
+            token = match.group()
+            first = token[0]
+            if first == 0x22:  # "
+                if len(token) == 1:
+                    end = match.start()
+                    break
+                if stack and stack[-1][0]:
+                    self._key = token
+            elif first in b"{[":
+                parent_is_object = bool(stack) and stack[-1][0]
+                key = self._key if parent_is_object else None
+                self._key = None
+                if self._capture is None and (
+                    (stack == _TOP and key == b'"head"')
+                    or (self.capture_bindings and stack == _BINDINGS)
+                ):
+                    self._capture = bytearray()
+                    self._capture_depth = len(stack) + 1
+                    capture_start = match.start()
+                stack.append((first == 0x7B, key))
+            else:
+                depth = len(stack)
+                stack.pop()
+                self._key = None
+                if stack == _BINDINGS:
+                    self.bindings += 1
+                if self._capture is not None and depth == self._capture_depth:
+                    self._capture += data[capture_start : match.end()]
+                    value = json.loads(self._capture)
+                    if stack == _TOP:
+                        self.head = value
+                    else:
+                        rows.append(value)
+                    self._capture = None
+        if self._capture is not None:
+            self._capture += data[capture_start:end]
+        self._tail = data[end:]
+        return rows
+
+    @property
+    def variables(self) -> list[str]:
+        return (self.head or {}).get("vars", [])
+
+
+class SparqlXmlScanner:
+    """
+    The counterpart of `SparqlJsonScanner` for SPARQL XML results
+    (application/sparql-results+xml); bindings are returned in the structure
+    of SPARQL JSON results.
+    """
+
+    def __init__(self, capture_bindings: bool = False):
+        self.capture_bindings = capture_bindings
+        self.head: dict | None = None
+        self.bindings = 0
+        self.size = 0
+        self._parser = XMLPullParser(events=("start", "end"))
+        self._variables: list[str] = []
+        self._results = None
+
+    def feed(self, chunk: bytes) -> list[dict]:
+        self.size += len(chunk)
+        rows = []
+        try:
+            self._parser.feed(chunk)
+            events = list(self._parser.read_events())
+        except ParseError as error:
+            raise ValueError(str(error)) from error
+        for event, element in events:
+            tag = element.tag
+            if event == "start":
+                if tag == _XML + "results":
+                    self._results = element
+            elif tag == _XML + "variable":
+                self._variables.append(element.get("name"))
+            elif tag == _XML + "head":
+                self.head = {"vars": self._variables}
+            elif tag == _XML + "result":
+                self.bindings += 1
+                if self.capture_bindings:
+                    rows.append(
+                        {
+                            binding.get("name"): _xml_term(binding[0])
+                            for binding in element
+                            if len(binding)
+                        }
+                    )
+                # NOTE: drop parsed results from the tree to bound memory
+                self._results.remove(element)
+        return rows
+
+    @property
+    def variables(self) -> list[str]:
+        return (self.head or {}).get("vars", [])
+
+
+def _xml_term(element) -> dict:
+    kind = element.tag.removeprefix(_XML)
+    if kind == "triple":
+        return {
+            "type": "triple",
+            "value": {
+                part.tag.removeprefix(_XML): _xml_term(part[0]) for part in element
+            },
+        }
+    term = {"type": kind, "value": element.text or ""}
+    if element.get(_XML_LANG):
+        term["xml:lang"] = element.get(_XML_LANG)
+    if element.get("datatype"):
+        term["datatype"] = element.get("datatype")
+    return term
+
+
+class RewrittenResult:
+    """
+    Streams a SPARQL JSON result with its bindings passed through `rows`,
+    chunk by chunk. The head must precede the bindings, as it does for all
+    supported engines. Closing the result closes the body.
+    """
+
+    def __init__(self, body: Iterable[bytes], rows: Callable[[list[dict]], list[dict]]):
+        self.body = body
+        self.rows = rows
+        self.scanner = SparqlJsonScanner(capture_bindings=True)
+
+    def __iter__(self) -> Iterator[bytes]:
+        started = False
+        separator = b""
+        for chunk in self.body:
+            rows = self.scanner.feed(chunk)
+            if not started and self.scanner.head is not None:
+                started = True
+                yield (
+                    b'{"head":'
+                    + json.dumps(self.scanner.head).encode()
+                    + b',"results":{"bindings":['
+                )
+            rows = self.rows(rows)
+            if rows:
+                yield separator + b",".join(json.dumps(row).encode() for row in rows)
+                separator = b","
+        if not started:
+            raise ValueError("The result has no head")
+        yield b"]}}"
+
+    def close(self):
+        if hasattr(self.body, "close"):
+            self.body.close()
@@ -0,0 +1,257 @@
+"""
+On-disk store of complete SPARQL results as rows, shared by all workers.
+
+While the proxy streams a SPARQL JSON result, its bindings are written to
+SPARQL_ROWS_DIR, one compact JSON object per line, together with an index
+of the byte offset of every row. Once the result is complete, any page of
+it can be served by slicing the memory-mapped files, without running the
+query again. Results older than SPARQL_ROWS_MAX_AGE seconds, and the least
+recently used results beyond SPARQL_ROWS_DISK_BYTES, are removed.
+
+Files of a result `<key>`: `<key>.<generation>.rows` (the rows),
+`<key>.<generation>.idx` (offsets as unsigned 64 bit integers) and
+`<key>.json` (head, row count, backend and generation). The metadata is
+replaced last, in one rename, and marks the result as complete; since the
+files of a generation are never rewritten, a reader always pairs the row
+count with the rows and offsets it was written with, even while the result
+is stored again.
+"""
+
+import json
+import mmap
+import os
+import secrets
+import tempfile
+import time
+from array import array
+from collections.abc import Iterator
+from pathlib import Path
+
+from django.conf import settings
+
+DATA_SUFFIXES = (".rows", ".idx")
+# NOTE: rows per chunk when streaming a stored result
+ROWS_PER_CHUNK = 1000
+
+
+def _directory() -> Path:
+    return Path(settings.SPARQL_ROWS_DIR)
+
+
+def _data_path(key: str, generation: str, suffix: str) -> Path:
+    return _directory() / f"{key}.{generation}{suffix}"
+
+
+class RowWriter:
+    """Writes the rows of a result as they arrive; `commit` publishes it."""
+
+    def __init__(self, key: str, backend: str):
+        self.key = key
+        self.backend = backend
+        self.directory = _directory()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._rows = tempfile.NamedTemporaryFile(
+            dir=self.directory, prefix=".", suffix=".rows", delete=False
+        )
+        self._offsets = array("Q")
+        self.size = 0
+        self.closed = False
+
+    def add(self, rows: list[dict]):
+        if self.closed or not rows:
+            return
+        lines = [
+            json.dumps(row, separators=(",", ":"), ensure_ascii=False).encode() + b"\n"
+            for row in rows
+        ]
+        for line in lines:
+            self._offsets.append(self.size)
+            self.size += len(line)
+        if self.size + 8 * len(self._offsets) > settings.SPARQL_ROWS_DISK_BYTES:
+            # NOTE: a result that can never fit is not stored at all
+            self.abort()
+            return
+        self._rows.write(b"".join(lines))
+
+    def commit(self, head: dict):
+        if self.closed:
+            return
+        self._offsets.append(self.size)
+        self._rows.close()
+        generation = secrets.token_hex(8)
+        with tempfile.NamedTemporaryFile(
+            dir=self.directory, prefix=".", suffix=".idx", delete=False
+        ) as index:
+            self._offsets.tofile(index)
+        os.replace(self._rows.name, _data_path(self.key, generation, ".rows"))
+        os.replace(index.name, _data_path(self.key, generation, ".idx"))
+        meta = {
+            "head": head,
+            "rows": len(self._offsets) - 1,
+            "created": time.time(),
+            "backend": self.backend,
+            "generation": generation,
+        }
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.directory, prefix=".", suffix=".json", delete=False
+        ) as file:
+            json.dump(meta, file)
+        os.replace(file.name, self.directory / f"{self.key}.json")
+        self.closed = True
+        # NOTE: readers that still map the previous generation keep their maps
+        for suffix in DATA_SUFFIXES:
+            for path in self.directory.glob(f"{self.key}.*{suffix}"):
+                if path.name != f"{self.key}.{generation}{suffix}":
+                    path.unlink(missing_ok=True)
+        evict()
+
+    def abort(self):
+        if not self.closed:
+            self.closed = True
+            self._rows.close()
+            Path(self._rows.name).unlink(missing_ok=True)
+
+
+class StoredResult:
+    """A complete stored result, memory-mapped for slicing."""
+
+    def __init__(self, key: str):
+        path = _directory() / f"{key}.json"
+        meta = json.loads(path.read_text())
+        self.key = key
+        self.head: dict = meta["head"]
+        self.rows: int = meta["rows"]
+        self.created: float = meta["created"]
+        self.backend: str | None = meta.get("backend")
+        generation = meta["generation"]
+        self._maps = []
+        self._data = self._map(_data_path(key, generation, ".rows"))
+        offsets = self._map(_data_path(key, generation, ".idx"))
+        self._offsets = memoryview(offsets).cast("Q")
+        # NOTE: the modification time tracks the last use for eviction
+        os.utime(path)
+
+    def _map(self, path: Path):
+        with path.open("rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return b""
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return mapped
+
+    def close(self):
+        self._offsets.release()
+        for mapped in self._maps:
+            mapped.close()
+
+    def lines(self, start: int, stop: int) -> bytes:
+        """Rows `start` to `stop` (exclusive) as JSON lines."""
+        start, stop = max(0, start), min(stop, self.rows)
+        if start >= stop:
+            return b""
+        return self._data[self._offsets[start] : self._offsets[stop]]
+
+    def page(self, start: int, stop: int) -> bytes:
+        """Rows `start` to `stop` (exclusive) as SPARQL JSON result."""
+        bindings = self.lines(start, stop).rstrip(b"\n").replace(b"\n", b",")
+        return b"".join(
+            [
+                b'{"head":',
+                json.dumps(self.head).encode(),
+                b',"results":{"bindings":[',
+                bindings,
+                b"]}}",
+            ]
+        )
+
+    def chunks(self, lines: bool = False, start: int = 0) -> Iterator[bytes]:
+        """
+        The result from row `start` on as SPARQL JSON (or JSON lines) in
+        chunks.
+        """
+        if not lines:
+            yield b'{"head":' + json.dumps(self.head).encode()
+            yield b',"results":{"bindings":['
+        for first in range(start, self.rows, ROWS_PER_CHUNK):
+            chunk = self.lines(first, first + ROWS_PER_CHUNK)
+            if lines:
+                yield chunk
+            else:
+                prefix = b"," if first > start else b""
+                yield prefix + chunk.rstrip(b"\n").replace(b"\n", b",")
+        if not lines:
+            yield b"]}}"
+
+
+def open_result(key: str, backend: str | None = None) -> StoredResult | None:
+    """
+    The stored result for `key`, if it is complete and not expired, and was
+    stored for `backend` if given.
+    """
+    try:
+        result = StoredResult(key)
+    except (OSError, ValueError, KeyError):
+        return None
+    if time.time() - result.created > settings.SPARQL_ROWS_MAX_AGE or (
+        backend is not None and result.backend != backend
+    ):
+        result.close()
+        return None
+    return result
+
+
+def is_stored(key: str) -> bool:
+    return (_directory() / f"{key}.json").exists()
+
+
+def _remove(key: str):
+    # NOTE: the metadata goes first, so a result is never seen half removed
+    (_directory() / f"{key}.json").unlink(missing_ok=True)
+    for path in _directory().glob(f"{key}.*"):
+        path.unlink(missing_ok=True)
+
+
+def evict():
+    """Remove expired results, then the least recently used ones over the size limit."""
+    directory = _directory()
+    now = time.time()
+    results = []
+    current = set()
+    for path in directory.glob("*.json"):
+        if path.name.startswith("."):
+            continue
+        try:
+            used = path.stat().st_mtime
+            meta = json.loads(path.read_text())
+            created = meta["created"]
+            data = [
+                _data_path(path.stem, meta["generation"], suffix)
+                for suffix in DATA_SUFFIXES
+            ]
+            size = sum(file.stat().st_size for file in [path, *data])
+        except (OSError, ValueError, KeyError):
+            continue
+        current.update(data)
+        if now - created > settings.SPARQL_ROWS_MAX_AGE:
+            _remove(path.stem)
+        else:
+            results.append((used, size, path.stem))
+    total = sum(size for _, size, _ in results)
+    for _, size, key in sorted(results):
+        if total <= settings.SPARQL_ROWS_DISK_BYTES:
+            break
+        _remove(key)
+        total -= size
+    # NOTE: temporary files and generations of writers that died
+    orphans = [
+        path
+        for suffix in DATA_SUFFIXES
+        for path in directory.glob(f"*{suffix}")
+        if path not in current
+    ]
+    for path in [*directory.glob(".*"), *orphans]:
+        try:
+            if now - path.stat().st_mtime > settings.SPARQL_ROWS_MAX_AGE:
+                path.unlink(missing_ok=True)
+        except OSError:
+            continue
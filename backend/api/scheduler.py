@@ -0,0 +1,226 @@
+"""
+Limits the number of queries the SPARQL proxy runs on a backend at the same
+time (`SparqlEndpointConfiguration.max_concurrent_queries`).
+
+A running query holds one of the backend's slots, a lock file below
+SPARQL_SLOT_DIR, so the limit holds across all worker processes; the lock
+is released by the kernel if a worker dies. Queries waiting for a slot are
+queued per worker: higher priority classes go first, and within a class
+the clients take turns, so one client sending many queries cannot starve
+the others.
+
+A worker queues at most SPARQL_QUEUE_MAX_LENGTH queries per backend, each
+for at most SPARQL_QUEUE_TIMEOUT seconds; further or expired queries are
+rejected with `QueueRejected`, which the proxy answers with 503 and
+`Retry-After`. Queries whose clients all left are removed from the queue.
+"""
+
+import fcntl
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from django.conf import settings
+
+from api.cancel import QueryCancelled
+from api.metrics import LATENCY_BUCKETS, registry
+
+# priority -> class, lower classes go first
+PRIORITIES = {
+    "interactive": 0,
+    "completion": 1,
+    "warmup": 2,
+    "benchmark": 2,
+}
+DEFAULT_PRIORITY = "interactive"
+
+# NOTE: how often the first query in line checks for slots freed by other workers
+SLOT_POLL_INTERVAL = 0.05
+# how often the other queries check their deadline and whether they were cancelled
+QUEUE_POLL_INTERVAL = 0.5
+# seconds after which clients of rejected queries are asked to retry
+RETRY_AFTER = 5
+
+
+class QueueRejected(Exception):
+    """A query was not admitted to, or timed out in, the queue of a backend."""
+
+    def __init__(self, message: str, position: int):
+        super().__init__(message)
+        self.position = position
+        self.retry_after = RETRY_AFTER
+
+
+@dataclass(eq=False)
+class Ticket:
+    priority: str
+    client: str
+    enqueued: float = field(default_factory=time.monotonic)
+    position: int = 0
+    wait: float = 0.0
+    slot: int | None = None
+
+
+def _try_slot(slug: str, limit: int) -> int | None:
+    """Lock a free slot of the backend and return its file descriptor."""
+    directory = Path(settings.SPARQL_SLOT_DIR) / slug
+    directory.mkdir(parents=True, exist_ok=True)
+    for index in range(limit):
+        fd = os.open(directory / str(index), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+        return fd
+    return None
+
+
+class BackendScheduler:
+    def __init__(self, slug: str):
+        self.slug = slug
+        self._cond = threading.Condition()
+        # one queue per priority class: client -> tickets of that client
+        self._queues: list[OrderedDict[str, deque[Ticket]]] = [
+            OrderedDict() for _ in range(max(PRIORITIES.values()) + 1)
+        ]
+
+    def _head(self) -> Ticket | None:
+        for queue in self._queues:
+            if queue:
+                return next(iter(queue.values()))[0]
+        return None
+
+    def queued(self) -> int:
+        with self._cond:
+            return sum(
+                len(tickets) for queue in self._queues for tickets in queue.values()
+            )
+
+    def _position(self, ticket: Ticket) -> int:
+        """Number of queued tickets that run before `ticket`."""
+        level = PRIORITIES[ticket.priority]
+        ahead = sum(
+            len(tickets) for queue in self._queues[:level] for tickets in queue.values()
+        )
+        queue = self._queues[level]
+        index = len(queue[ticket.client]) - 1
+        before = True
+        for client, tickets in queue.items():
+            # NOTE: clients take turns, so every client before this one gets
+            # `index + 1` turns first, every client after it `index` turns
+            if client == ticket.client:
+                ahead += index
+                before = False
+            else:
+                ahead += min(len(tickets), index + 1 if before else index)
+        return ahead
+
+    def _remove(self, ticket: Ticket):
+        queue = self._queues[PRIORITIES[ticket.priority]]
+        tickets = queue.pop(ticket.client)
+        tickets.remove(ticket)
+        if tickets:
+            # NOTE: re-inserting moves the client to the end of the round
+            queue[ticket.client] = tickets
+
+    def acquire(
+        self,
+        priority: str,
+        client: str,
+        limit: int,
+        cancelled: threading.Event | None = None,
+    ) -> Ticket:
+        """
+        Wait until the query may run on the backend. Raises `QueueRejected`
+        if the queue is full or the wait timed out, and `QueryCancelled`
+        once `cancelled` is set.
+        """
+        ticket = Ticket(priority, client)
+        labels = {"backend": self.slug, "priority": priority}
+        max_length = settings.SPARQL_QUEUE_MAX_LENGTH
+        timeout = settings.SPARQL_QUEUE_TIMEOUT
+        with self._cond:
+            queued = sum(
+                len(tickets) for queue in self._queues for tickets in queue.values()
+            )
+            if max_length and queued >= max_length:
+                raise QueueRejected(
+                    f"{queued} queries are waiting for {self.slug}", queued
+                )
+            queue = self._queues[PRIORITIES[priority]]
+            queue.setdefault(client, deque()).append(ticket)
+            ticket.position = self._position(ticket)
+            registry.inc("qlue_sparql_queue_length", **labels)
+            try:
+                while True:
+                    if cancelled is not None and cancelled.is_set():
+                        raise QueryCancelled()
+                    waited = time.monotonic() - ticket.enqueued
+                    if timeout and waited >= timeout:
+                        raise QueueRejected(
+                            f"Waited {waited:.0f}s for a slot of {self.slug}",
+                            self._position(ticket),
+                        )
+                    if self._head() is ticket:
+                        ticket.slot = _try_slot(self.slug, limit)
+                        if ticket.slot is not None:
+                            break
+                        self._cond.wait(SLOT_POLL_INTERVAL)
+                    else:
+                        self._cond.wait(QUEUE_POLL_INTERVAL)
+            finally:
+                self._remove(ticket)
+                registry.inc("qlue_sparql_queue_length", -1, **labels)
+                self._cond.notify_all()
+        ticket.wait = time.monotonic() - ticket.enqueued
+        registry.observe(
+            "qlue_sparql_queue_wait_seconds", ticket.wait, LATENCY_BUCKETS, **labels
+        )
+        return ticket
+
+    def release(self, ticket: Ticket):
+        if ticket.slot is not None:
+            os.close(ticket.slot)
+            ticket.slot = None
+        with self._cond:
+            self._cond.notify_all()
+
+
+class Scheduler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._backends: dict[str, BackendScheduler] = {}
+
+    def acquire(
+        self,
+        backend,
+        priority: str,
+        client: str,
+        cancelled: threading.Event | None = None,
+    ) -> Ticket:
+        """
+        Wait for a slot of `backend`; backends without a limit are not
+        queued. The returned ticket must be released with `release`.
+        """
+        if not backend.max_concurrent_queries:
+            return Ticket(priority, client)
+        with self._lock:
+            scheduler = self._backends.setdefault(
+                backend.slug, BackendScheduler(backend.slug)
+            )
+        return scheduler.acquire(
+            priority, client, backend.max_concurrent_queries, cancelled
+        )
+
+    def release(self, backend, ticket: Ticket):
+        with self._lock:
+            scheduler = self._backends.get(backend.slug)
+        if scheduler is not None:
+            scheduler.release(ticket)
+
+
+scheduler = Scheduler()
@@ -1,32 +1,59 @@
-from django.contrib.admin.utils import lookup_field
-from api.models import QueryExample, SparqlEndpointConfiguration
+from api.capabilities import served_capabilities
+from api.lint import lint_templates
+from api.models import (
+    TEMPLATE_FIELDS,
+    QueryExample,
+    QueryTemplate,
+    SparqlEndpointConfiguration,
+)
+from api.sparql import minify_template, parse_prefixes
 from rest_framework import serializers
 
 
 class SparqlEndpointConfigurationSerializer(serializers.HyperlinkedModelSerializer):
     prefix_map = serializers.SerializerMethodField()
     engine = serializers.CharField(source="get_engine_display")
+    capabilities = serializers.SerializerMethodField()
 
     class Meta:
         model = SparqlEndpointConfiguration
         exclude = ["api_token", "prefixes"]
 
     def get_prefix_map(self, obj):
-        prefixes = obj.prefixes.split("\n")
-        result = {}
-        for prefix in prefixes:
-            line = prefix.strip()
-            if line == "":
-                continue
-            words = line.split()
-            if words[1][-1] != ":":
-                continue
-            elif words[2][0] != "<":
-                continue
-            elif words[2][-1] != ">":
-                continue
-            result[words[1][:-1]] = words[2][1:-1]
-        return result
+        return parse_prefixes(obj.prefixes)
+
+    def get_capabilities(self, obj):
+        return served_capabilities(obj)
+
+    def to_representation(self, instance):
+        """
+        The templates are sent minified, unless the readable sources are
+        requested with `?templates=source`, e.g. by the template editor.
+        With `?templates=hash`, only the digests of the minified templates are
+        sent, whose text is served by `/api/templates/<digest>`; templates
+        without a stored row, e.g. changed by `QuerySet.update()`, are sent
+        minified instead.
+        """
+        data = super().to_representation(instance)
+        request = self.context.get("request")
+        mode = request.query_params.get("templates") if request is not None else None
+        if mode == "source":
+            return data
+        for field in TEMPLATE_FIELDS:
+            data[field] = minify_template(data[field])
+        if mode == "hash":
+            digests = {
+                field: QueryTemplate.digest_of(data[field]) for field in TEMPLATE_FIELDS
+            }
+            stored = set(
+                QueryTemplate.objects.filter(digest__in=digests.values()).values_list(
+                    "digest", flat=True
+                )
+            )
+            for field, digest in digests.items():
+                if digest in stored:
+                    data[field] = digest
+        return data
 
 
 class SparqlEndpointConfigurationListSerializer(serializers.ModelSerializer):
@@ -39,25 +66,64 @@ class SparqlEndpointConfigurationListSerializer(serializers.ModelSerializer):
     api_url = serializers.HyperlinkedIdentityField(
         view_name="backend-detail", lookup_field="slug"
     )
+    capabilities = serializers.SerializerMethodField()
 
     class Meta:
         model = SparqlEndpointConfiguration
-        fields = ["name", "slug", "api_url", "is_default"]
+        fields = ["name", "slug", "api_url", "is_default", "capabilities"]
+
+    def get_capabilities(self, obj):
+        return served_capabilities(obj)
 
 
 class SparqlEndpointTemplatesSerializer(serializers.ModelSerializer):
     class Meta:
         model = SparqlEndpointConfiguration
-        fields = [
-            "subject_completion",
-            "predicate_completion_context_sensitive",
-            "predicate_completion_context_insensitive",
-            "object_completion_context_sensitive",
-            "object_completion_context_insensitive",
-            "values_completion_context_sensitive",
-            "values_completion_context_insensitive",
-            "hover",
-        ]
+        fields = list(TEMPLATE_FIELDS)
+
+    def validate(self, attrs):
+        """
+        Check the changed templates for slow patterns; the warnings do not
+        prevent saving and are included in the response.
+        """
+        engine = self.instance.engine if self.instance is not None else None
+        self.warnings = lint_templates(engine, attrs)
+        return attrs
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data["warnings"] = getattr(self, "warnings", [])
+        return data
+
+
+class TemplatePreviewSerializer(serializers.Serializer):
+    """A draft of a template and the context to render it with."""
+
+    template = serializers.ChoiceField(
+        choices=SparqlEndpointTemplatesSerializer.Meta.fields
+    )
+    source = serializers.CharField(required=False, trim_whitespace=False)
+    context = serializers.DictField(required=False, default=dict)
+
+    def validate_context(self, value):
+        if not all(
+            isinstance(item, (str, int, float, bool)) for item in value.values()
+        ):
+            raise serializers.ValidationError(
+                "The context must be an object of strings and numbers"
+            )
+        return value
+
+
+class TemplateEstimateSerializer(serializers.Serializer):
+    """The templates whose cost to estimate; by default all of them."""
+
+    templates = serializers.ListField(
+        child=serializers.ChoiceField(
+            choices=SparqlEndpointTemplatesSerializer.Meta.fields
+        ),
+        required=False,
+    )
 
 
 class QueryExampleSerializer(serializers.ModelSerializer):
@@ -0,0 +1,194 @@
+"""
+Helpers for working with SPARQL query strings.
+"""
+
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+
+# NOTE: IRIs must not contain whitespace, so comparisons like `?a < ?b`
+# are never mistaken for an IRI.
+_TOKENS = r"""
+    (?P<string>
+        \"\"\"(?:[^"\\]|\\.|"(?!""))*\"\"\"
+      | '''(?:[^'\\]|\\.|'(?!''))*'''
+      | "(?:[^"\\\n]|\\.)*"
+      | '(?:[^'\\\n]|\\.)*'
+    )
+  | (?P<iri><[^<>"{}|^`\\\x00-\x20]*>)
+  | (?P<comment>\#[^\n]*)
+  | (?P<space>\s+)
+  | (?P<other>[^"'<\#\s]+|.)
+    """
+_TOKEN = re.compile(_TOKENS, re.VERBOSE | re.DOTALL)
+# NOTE: the tags of query templates, e.g. `{{ entity }}` or `{% if limit %}`,
+# may contain spaces, quotes and `#`, and are kept as they are
+_TEMPLATE_TOKEN = re.compile(
+    r"(?P<tag>\{\{[^{}]*\}\}|\{%[^{}]*%\}|\{\#[^{}]*\#\})|" + _TOKENS,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def tokenize(query: str, template: bool = False):
+    """
+    Split a query into (kind, text) tokens, where kind is one of
+    "string", "iri", "comment", "space" or "other". With `template`, the
+    tags of a query template are single tokens of kind "tag".
+    """
+    pattern = _TEMPLATE_TOKEN if template else _TOKEN
+    for match in pattern.finditer(query):
+        yield match.lastgroup, match.group()
+
+
+def normalize_query(query: str, template: bool = False) -> str:
+    """
+    Normalize a query for use as cache key: comments are removed and
+    whitespace outside of literals and IRIs is collapsed. With `template`,
+    the tags of a query template are kept as they are.
+    """
+    parts = []
+    for kind, text in tokenize(query, template):
+        if kind in ("comment", "space"):
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        else:
+            parts.append(text)
+    return "".join(parts).strip()
+
+
+@lru_cache(maxsize=256)
+def minify_template(source: str) -> str:
+    """
+    A query template without comments and with collapsed whitespace, as
+    sent to clients and endpoints; computed once per template source.
+    """
+    return normalize_query(source, template=True)
+
+
+_WORD = re.compile(r"[{}()]|[^{}()]+")
+_FORMS = ("SELECT", "CONSTRUCT", "DESCRIBE", "ASK")
+
+
+def words(query: str, template: bool = False) -> list[tuple[str, int, int, int]]:
+    """
+    The significant words of a query as (text, start, end, depth), where
+    depth counts the enclosing braces and parentheses; literals and IRIs
+    are single words. With `template`, so are the tags of a query template.
+    """
+    found = []
+    depth = position = 0
+    for kind, text in tokenize(query, template):
+        start, position = position, position + len(text)
+        if kind in ("string", "iri", "tag"):
+            found.append((text, start, position, depth))
+        elif kind == "other":
+            for match in _WORD.finditer(text):
+                word = match.group()
+                if word in ")}":
+                    depth -= 1
+                found.append((word, start + match.start(), start + match.end(), depth))
+                if word in "({":
+                    depth += 1
+    return found
+
+
+@dataclass
+class SolutionSlice:
+    """The LIMIT and OFFSET of a query and where they are written."""
+
+    limit: int | None
+    offset: int
+    spans: list[tuple[int, int]]
+    insert_at: int
+
+
+def solution_slice(query: str) -> SolutionSlice | None:
+    """
+    The LIMIT and OFFSET of the outermost query of a SELECT, CONSTRUCT or
+    DESCRIBE query; None for ASK queries and queries that are not understood.
+    """
+    top = [word for word in words(query) if word[3] == 0]
+    forms = [i for i, word in enumerate(top) if word[0].upper() in _FORMS]
+    if not forms or top[forms[0]][0].upper() == "ASK":
+        return None
+    form = forms[0]
+    groups = [i for i in range(form, len(top)) if top[i][0] == "{"]
+    # NOTE: the template of CONSTRUCT precedes its WHERE clause
+    if top[form][0].upper() == "CONSTRUCT" and groups and groups[0] == form + 1:
+        groups = groups[1:]
+    if not groups or groups[0] + 1 >= len(top) or top[groups[0] + 1][0] != "}":
+        return None
+    limit, offset, spans = None, 0, []
+    end = groups[0] + 1
+    i = end + 1
+    while i < len(top) and top[i][0].upper() != "VALUES":
+        keyword = top[i][0].upper()
+        if keyword in ("LIMIT", "OFFSET") and i + 1 < len(top):
+            if not top[i + 1][0].isdigit():
+                return None
+            if keyword == "LIMIT":
+                limit = int(top[i + 1][0])
+            else:
+                offset = int(top[i + 1][0])
+            spans.append((top[i][1], top[i + 1][2]))
+        end = i
+        i += 1
+    return SolutionSlice(limit, offset, spans, top[end][2])
+
+
+def with_slice(query: str, limit: int | None, offset: int) -> str:
+    """`query` with the LIMIT and OFFSET of its outermost query replaced."""
+    current = solution_slice(query)
+    if current is None:
+        raise ValueError("The LIMIT of the query cannot be changed")
+    modifiers = (f" LIMIT {limit}" if limit is not None else "") + (
+        f" OFFSET {offset}" if offset else ""
+    )
+    result = query[: current.insert_at] + modifiers + query[current.insert_at :]
+    for start, end in reversed(current.spans):
+        result = result[:start] + result[end:]
+    return result
+
+
+def with_values(query: str, variable: str, values: list[str]) -> str:
+    """
+    The SELECT query `query` for all `values` of `variable` at once: the
+    variable is bound by a VALUES block at the start of the WHERE clause and
+    projected, and the LIMIT and OFFSET of the query are removed.
+    """
+    query = with_slice(query, None, 0)
+    top = [word for word in words(query) if word[3] == 0]
+    form = next(i for i, word in enumerate(top) if word[0].upper() in _FORMS)
+    if top[form][0].upper() != "SELECT":
+        raise ValueError("Only SELECT queries can be run for several values")
+    group = next(i for i in range(form, len(top)) if top[i][0] == "{")
+    block = f" VALUES {variable} {{ {' '.join(values)} }}"
+    query = query[: top[group][2]] + block + query[top[group][2] :]
+    projection = form + 1
+    if top[projection][0].upper() in ("DISTINCT", "REDUCED"):
+        projection += 1
+    projected = {word[0] for word in top[projection:group]}
+    if top[projection][0] != "*" and variable not in projected:
+        start = top[projection][1]
+        query = query[:start] + f"{variable} " + query[start:]
+    return query
+
+
+def parse_prefixes(text: str) -> dict[str, str]:
+    """
+    The prefix map of `PREFIX name: <iri>` lines, as in
+    `SparqlEndpointConfiguration.prefixes`; other lines are skipped.
+    """
+    result = {}
+    for line in text.split("\n"):
+        words = line.strip().split()
+        if len(words) < 3:
+            continue
+        if words[1][-1] != ":":
+            continue
+        elif words[2][0] != "<":
+            continue
+        elif words[2][-1] != ">":
+            continue
+        result[words[1][:-1]] = words[2][1:-1]
+    return result
@@ -0,0 +1,41 @@
+"""
+Rendering of the query templates of a backend on the server.
+
+The completion and hover templates of `SparqlEndpointConfiguration` are
+written for the template engine of the language server (Tera), whose syntax
+for variables, conditions and includes matches the Django template language:
+`{{ limit }}`, `{% if search_term %}` and `{% include "prefix_declarations" %}`,
+which inserts the `prefix_declarations` variable (by default the prefixes of
+the backend). Templates are compiled once per source and kept in an LRU.
+"""
+
+from functools import lru_cache
+
+from django.template import Context, Engine, Template
+
+from api.models import SparqlEndpointConfiguration
+from api.sparql import minify_template
+
+_engine = Engine(
+    autoescape=False,
+    loaders=[
+        (
+            "django.template.loaders.locmem.Loader",
+            {"prefix_declarations": "{{ prefix_declarations }}"},
+        )
+    ],
+)
+
+
+@lru_cache(maxsize=256)
+def compile_template(source: str) -> Template:
+    return _engine.from_string(source)
+
+
+def render_query(
+    backend: SparqlEndpointConfiguration, field: str, context: dict
+) -> str:
+    """Render the template in the field `field` of `backend`."""
+    template = compile_template(minify_template(getattr(backend, field)))
+    context = {"prefix_declarations": backend.prefixes, **context}
+    return template.render(Context(context, autoescape=False))
@@ -1,3 +1,1790 @@
-from django.test import TestCase
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import pstats
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.template import Context
+from django.test import (
+    Client,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+
+import startup
+from api.importtime import (
+    BUDGET_TOLERANCE,
+    LAZY_MODULES,
+    profile_imports,
+    read_budget,
+    total_ms,
+)
+from api.bench import dry_run, run_query
+from api.cache import result_cache
+from api.completion import cache_path
+from api.cancel import QueryCancelled
+from api.coalesce import Flight, FlightError, PinLimit
+from api.lint import lint_template
+from api.metrics import registry, retire_worker
+from api.models import TEMPLATE_FIELDS, QueryTemplate, SparqlEndpointConfiguration
+from api.pool import pools
+from api.profiling import list_profiles, profile_path
+from api.results import SparqlJsonScanner
+from api.scheduler import BackendScheduler, QueueRejected
+from api.rowstore import RowWriter, is_stored, open_result
+from api.sparql import (
+    minify_template,
+    normalize_query,
+    solution_slice,
+    with_slice,
+    with_values,
+)
+from api.templating import compile_template, render_query
+from api.warmup import running_warmup
+
+RESULT = json.dumps(
+    {
+        "head": {"vars": ["s"]},
+        "results": {"bindings": [{"s": {"type": "uri", "value": "http://x.org/a"}}]},
+    }
+).encode()
+
+
+def content(response) -> bytes:
+    if response.streaming:
+        return b"".join(response.streaming_content)
+    return response.content
+
+
+class StandInEndpoint:
+    """
+    A local stand-in for a SPARQL endpoint that records the requests it
+    receives and answers each with `self.status` and `self.body`.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.cancelled = []
+        self.status = 200
+        self.content_type = "application/sparql-results+json"
+        self.body = RESULT
+        self.delay = 0.0
+        # number of body bytes sent before the connection is dropped
+        self.truncate = None
+        # the service description, answered to GET requests without a query
+        self.description = None
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                params = urllib.parse.parse_qs(
+                    self.rfile.read(length).decode(), keep_blank_values=True
+                )
+                if "cancelQuery" in params:
+                    # NOTE: Blazegraph
+                    endpoint.cancelled.append(params["queryId"][0])
+                    self.send_response(200)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                endpoint.requests.append(
+                    {
+                        "headers": dict(self.headers),
+                        "client": self.client_address,
+                        **params,
+                    }
+                )
+                time.sleep(endpoint.delay)
+                try:
+                    self.send_response(endpoint.status)
+                    self.send_header("Content-Type", endpoint.content_type)
+                    self.send_header("Content-Length", str(len(endpoint.body)))
+                    self.end_headers()
+                    if endpoint.truncate is not None:
+                        self.wfile.write(endpoint.body[: endpoint.truncate])
+                        self.wfile.flush()
+                        self.close_connection = True
+                        return
+                    self.wfile.write(endpoint.body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # NOTE: the proxy closed the connection of a cancelled query
+                    self.close_connection = True
+
+            def do_GET(self):
+                if "/watch/" not in self.path:
+                    body = endpoint.description or b""
+                    self.send_response(200 if endpoint.description else 400)
+                    self.send_header("Content-Type", "text/turtle")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                # NOTE: the QLever websocket at /watch/<query id>, reads a
+                # single masked text frame
+                query_id = self.path.rsplit("/watch/", 1)[1]
+                accept = base64.b64encode(
+                    hashlib.sha1(
+                        (
+                            self.headers["Sec-WebSocket-Key"]
+                            + "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+                        ).encode()
+                    ).digest()
+                ).decode()
+                self.send_response(101)
+                self.send_header("Upgrade", "websocket")
+                self.send_header("Connection", "Upgrade")
+                self.send_header("Sec-WebSocket-Accept", accept)
+                self.end_headers()
+                length = self.rfile.read(2)[1] & 0x7F
+                mask = self.rfile.read(4)
+                message = bytes(
+                    byte ^ mask[i % 4] for i, byte in enumerate(self.rfile.read(length))
+                )
+                endpoint.cancelled.append((query_id, message.decode()))
+                self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/sparql"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StartupTest(SimpleTestCase):
+    def setUp(self):
+        self.base_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.base_dir.cleanup)
+        base = Path(self.base_dir.name)
+        (base / "api" / "migrations").mkdir(parents=True)
+        self.migration = base / "api" / "migrations" / "0001_initial.py"
+        self.migration.write_text("operations = []\n")
+        self.database = base / "db.sqlite3"
+        patch = mock.patch.object(startup, "BASE_DIR", base)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def migrate(self) -> bool:
+        """Run `startup.migrate`; returns whether Django's migrate was started."""
+        args = argparse.Namespace(database=self.database, force=False)
+        with (
+            mock.patch.object(startup.subprocess, "run") as run,
+            redirect_stdout(io.StringIO()),
+        ):
+            run.return_value = subprocess.CompletedProcess([], 0)
+            self.assertEqual(startup.migrate(args), 0)
+        return run.called
+
+    def test_skips_migrate_while_the_fingerprint_is_unchanged(self):
+        self.assertTrue(self.migrate())
+        self.assertFalse(self.migrate())
+
+    def test_migrates_after_a_migration_file_changed(self):
+        self.migrate()
+        self.migration.write_text("operations = [1]\n")
+        self.assertTrue(self.migrate())
+        self.assertFalse(self.migrate())
+
+    def test_migrates_after_the_django_version_changed(self):
+        self.migrate()
+        with mock.patch.object(startup.metadata, "version", return_value="0.0"):
+            self.assertTrue(self.migrate())
+
+    def test_migrates_when_the_fingerprint_table_is_missing(self):
+        self.migrate()
+        with sqlite3.connect(self.database) as connection:
+            connection.execute(f"DROP TABLE {startup.FINGERPRINT_TABLE}")
+        connection.close()
+        self.assertTrue(self.migrate())
+
+
+class ImportTimeTest(SimpleTestCase):
+    """
+    Regression test for the modules imported at worker boot.
+    The import time budget depends on the machine, so it may be exceeded by
+    IMPORT_BUDGET_TOLERANCE; re-record the budget with
+    `manage.py importtime --record` after an intended change.
+    """
+
+    def test_worker_boot_within_budget(self):
+        budget = read_budget()["worker"] * BUDGET_TOLERANCE
+        runs = [profile_imports("worker") for _ in range(3)]
+        total = statistics.median(total_ms(records) for records, _ in runs)
+        self.assertLessEqual(
+            total,
+            budget,
+            f"Worker boot imports took {total:.0f}ms "
+            f"(budget {budget:.0f}ms including tolerance)",
+        )
+
+    def test_lazy_modules_not_loaded_at_boot(self):
+        for phase in ["worker", "request"]:
+            _, modules = profile_imports(phase)
+            for module in LAZY_MODULES:
+                with self.subTest(phase=phase, module=module):
+                    self.assertNotIn(module, modules)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.metrics_dir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(
+            METRICS_DIR=self.metrics_dir.name, METRICS_TOKEN="secret"
+        )
+        self.settings.enable()
+        registry._values = {}
+
+    def tearDown(self):
+        self.settings.disable()
+        self.metrics_dir.cleanup()
+
+    def test_requires_token(self):
+        self.assertEqual(self.client.get("/api/metrics").status_code, 403)
+        self.assertEqual(self.client.get("/api/metrics?token=wrong").status_code, 403)
+        with override_settings(METRICS_TOKEN=""):
+            self.assertEqual(self.client.get("/api/metrics?token=").status_code, 403)
+
+    def test_records_requests_and_share_links(self):
+        self.client.get("/api/backends/")
+        self.client.post("/api/share/", "SELECT * WHERE { ?s ?p ?o }", "text/plain")
+        self.client.post("/api/share/", "SELECT * WHERE { ?s ?p ?o }", "text/plain")
+
+        body = self.client.get("/api/metrics?token=secret").content.decode()
+        self.assertIn(
+            'qlue_requests_total{method="GET",status="200",view="backend-list"} 1', body
+        )
+        self.assertIn('qlue_db_queries_count{view="backend-list"} 1', body)
+        self.assertIn(
+            'qlue_request_duration_seconds_bucket{view="backend-list",le="+Inf"} 1',
+            body,
+        )
+        self.assertIn("qlue_share_links_created_total 1\n", body)
+
+    def test_aggregates_worker_files(self):
+        other_worker = [["qlue_share_links_created_total", [], 5]]
+        with open(f"{self.metrics_dir.name}/1.json", "w") as file:
+            json.dump(other_worker, file)
+        registry.inc("qlue_share_links_created_total")
+
+        body = self.client.get("/api/metrics?token=secret").content.decode()
+        self.assertIn("qlue_share_links_created_total 6\n", body)
+
+    def dead_pid(self) -> int:
+        process = subprocess.Popen(["true"])
+        process.wait()
+        return process.pid
+
+    def write_worker(self, pid: int, snapshot: list):
+        with open(f"{self.metrics_dir.name}/{pid}.json", "w") as file:
+            json.dump(snapshot, file)
+
+    def test_retired_workers_keep_their_counters(self):
+        pid = self.dead_pid()
+        labels = [["backend", "example"], ["priority", "0"]]
+        self.write_worker(
+            pid,
+            [
+                ["qlue_share_links_created_total", [], 5],
+                ["qlue_sparql_queue_length", labels, 2],
+            ],
+        )
+        body = self.client.get("/api/metrics?token=secret").content.decode()
+        self.assertIn("qlue_share_links_created_total 5\n", body)
+        self.assertNotIn("qlue_sparql_queue_length{", body)
+
+        retire_worker(pid)
+        self.write_worker(pid, [["qlue_share_links_created_total", [], 1]])
+        retire_worker(pid)
+        self.assertFalse(Path(f"{self.metrics_dir.name}/{pid}.json").exists())
+        body = self.client.get("/api/metrics?token=secret").content.decode()
+        self.assertIn("qlue_share_links_created_total 6\n", body)
+
+    def test_reused_pid_archives_the_previous_snapshot(self):
+        self.write_worker(os.getpid(), [["qlue_share_links_created_total", [], 5]])
+        registry._flushed_pid = None
+        registry.inc("qlue_share_links_created_total")
+
+        body = self.client.get("/api/metrics?token=secret").content.decode()
+        self.assertIn("qlue_share_links_created_total 6\n", body)
+
+
+class RequestTimingTest(TestCase):
+    def test_server_timing_header(self):
+        response = self.client.get("/api/backends/")
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^db;dur=[\d.]+;desc="1 queries", serialize;dur=[\d.]+, total;dur=[\d.]+$',
+        )
+
+    @override_settings(SERVER_TIMING=False)
+    def test_server_timing_disabled(self):
+        self.assertNotIn("Server-Timing", self.client.get("/api/backends/"))
+
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=0)
+    def test_logs_slow_requests_with_sql(self):
+        with self.assertLogs("api.middleware", "WARNING") as logs:
+            self.client.get("/api/backends/example/examples")
+        self.assertIn(
+            "Slow request: GET /api/backends/example/examples", logs.output[0]
+        )
+        self.assertIn('FROM "api_queryexample"', logs.output[0])
+
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=0, METRICS_TOKEN="secret")
+    def test_slow_request_log_omits_the_query_string(self):
+        with self.assertLogs("api.middleware", "WARNING") as logs:
+            self.client.get("/api/metrics?token=secret")
+        self.assertIn("Slow request: GET /api/metrics (", logs.output[0])
+        self.assertNotIn("secret", logs.output[0])
+
+
+class ProfilingTest(TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(
+            PROFILING_DIR=self.profile_dir.name,
+            PROFILING_TOKEN="secret",
+            PROFILING_MAX_FILES=2,
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.profile_dir.cleanup()
+
+    def test_profiles_only_with_valid_token(self):
+        self.client.get("/api/backends/")
+        self.client.get("/api/backends/", headers={"X-Profile": "wrong"})
+        self.assertEqual(list_profiles(), [])
+
+        self.client.get(
+            "/api/backends/", {"token": "hidden"}, headers={"X-Profile": "secret"}
+        )
+        (profile,) = list_profiles()
+        self.assertEqual(profile["view"], "backend-list")
+        self.assertEqual(profile["path"], "/api/backends/")
+        self.assertEqual(profile["status"], 200)
+        pstats.Stats(str(profile_path(profile["file"])))
+
+    def test_rotates_profiles(self):
+        for _ in range(3):
+            self.client.get("/api/backends/", headers={"X-Profile": "secret"})
+        self.assertEqual(len(list_profiles()), 2)
+        self.assertEqual(len(list(Path(self.profile_dir.name).glob("*.prof"))), 2)
+
+    @override_settings(
+        STORAGES={
+            "staticfiles": {
+                "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+            }
+        }
+    )
+    def test_admin_lists_and_downloads_profiles(self):
+        self.client.get("/api/backends/", headers={"X-Profile": "secret"})
+        (profile,) = list_profiles()
+        self.client.force_login(
+            User.objects.create_superuser("admin", "admin@example.com", "admin")
+        )
+
+        response = self.client.get("/admin/profiles/")
+        self.assertContains(response, "backend-list")
+        response = self.client.get(f"/admin/profiles/{profile['file']}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get("/admin/profiles/x.prof").status_code, 404)
+
+
+class NormalizeQueryTest(SimpleTestCase):
+    def test_strips_comments_and_whitespace(self):
+        query = """
+            # all subjects
+            SELECT  ?s WHERE {
+              ?s <http://x.org/p#name>   "a  # b" .   # trailing
+            }
+        """
+        self.assertEqual(
+            normalize_query(query),
+            'SELECT ?s WHERE { ?s <http://x.org/p#name> "a  # b" . }',
+        )
+
+    def test_keeps_comparisons(self):
+        self.assertEqual(
+            normalize_query("FILTER(?a < ?b   &&  ?b > 3)"),
+            "FILTER(?a < ?b && ?b > 3)",
+        )
+
+    def test_minifies_templates(self):
+        template = """
+            {% include "prefix_declarations" %}
+            SELECT ?e WHERE {  # the entities
+              {{ context }}
+              {% if search_term %}FILTER(REGEX(?l, "^{{ search_term }}")){% endif %}
+              {{ x|default:"# no comment" }}
+            }
+        """
+        self.assertEqual(
+            minify_template(template),
+            '{% include "prefix_declarations" %} SELECT ?e WHERE { {{ context }} '
+            '{% if search_term %}FILTER(REGEX(?l, "^{{ search_term }}")){% endif %} '
+            '{{ x|default:"# no comment" }} }',
+        )
+
+    def test_minified_default_templates_render_the_same_queries(self):
+        backend = SparqlEndpointConfiguration(prefixes="PREFIX x: <http://x.org/>")
+        context = {"context": "?s ?p ?o .", "search_term": "ab", "limit": 5}
+        for field in TEMPLATE_FIELDS:
+            source = getattr(backend, field)
+            self.assertLess(len(minify_template(source)), len(source))
+            self.assertEqual(
+                normalize_query(render_query(backend, field, context)),
+                normalize_query(
+                    compile_template(source).render(
+                        Context(
+                            {"prefix_declarations": backend.prefixes, **context},
+                            autoescape=False,
+                        )
+                    )
+                ),
+            )
+
+
+class SolutionSliceTest(SimpleTestCase):
+    def test_replaces_outermost_limit_and_offset(self):
+        query = "SELECT * { { SELECT * {} LIMIT 3 } } ORDER BY ?s LIMIT 10 OFFSET 5"
+        current = solution_slice(query)
+        self.assertEqual((current.limit, current.offset), (10, 5))
+        self.assertEqual(
+            with_slice(query, 20, 15),
+            "SELECT * { { SELECT * {} LIMIT 3 } } ORDER BY ?s   LIMIT 20 OFFSET 15",
+        )
+
+    def test_inserts_before_values_and_comments(self):
+        self.assertEqual(
+            with_slice("CONSTRUCT { ?s ?p ?o } { ?s ?p ?o } # all", 5, 0),
+            "CONSTRUCT { ?s ?p ?o } { ?s ?p ?o } LIMIT 5 # all",
+        )
+        self.assertEqual(
+            with_slice("SELECT * { ?s ?p ?o } VALUES ?s { <a> }", 5, 1),
+            "SELECT * { ?s ?p ?o } LIMIT 5 OFFSET 1 VALUES ?s { <a> }",
+        )
+
+    def test_ask_has_no_slice(self):
+        self.assertIsNone(solution_slice("ASK { ?s ?p ?o }"))
+        self.assertIsNone(solution_slice("DESCRIBE <http://x.org/a>"))
+
+    def test_binds_values_of_a_variable(self):
+        self.assertEqual(
+            with_values(
+                "SELECT DISTINCT ?l WHERE { ?e ?p ?l } LIMIT 1", "?e", ["<a>", "<b>"]
+            ),
+            "SELECT DISTINCT ?e ?l WHERE { VALUES ?e { <a> <b> } ?e ?p ?l } ",
+        )
+        self.assertEqual(
+            with_values("SELECT * { ?e ?p ?l }", "?e", ["<a>"]),
+            "SELECT * { VALUES ?e { <a> } ?e ?p ?l }",
+        )
+        with self.assertRaises(ValueError):
+            with_values("CONSTRUCT { ?e ?p ?l } { ?e ?p ?l }", "?e", ["<a>"])
+
+
+class SparqlJsonScannerTest(SimpleTestCase):
+    rows = [
+        {"s": {"type": "uri", "value": "http://example.org/a"}},
+        {"s": {"type": "literal", "value": 'braces } { and "quotes" \\'}},
+        {
+            "s": {
+                "type": "triple",
+                "value": {
+                    "subject": {"type": "uri", "value": "http://example.org/a"},
+                    "predicate": {"type": "uri", "value": "http://example.org/p"},
+                    "object": {"type": "literal", "value": "]"},
+                },
+            }
+        },
+        {},
+    ]
+    document = json.dumps(
+        {"head": {"vars": ["s"]}, "results": {"bindings": rows}}, indent=2
+    ).encode()
+
+    def scan(self, chunk_size, capture_bindings=False):
+        scanner = SparqlJsonScanner(capture_bindings)
+        rows = []
+        for start in range(0, len(self.document), chunk_size):
+            rows += scanner.feed(self.document[start : start + chunk_size])
+        return scanner, rows
+
+    def test_counts_bindings_in_any_chunking(self):
+        for chunk_size in [1, 7, 64, len(self.document)]:
+            with self.subTest(chunk_size=chunk_size):
+                scanner, rows = self.scan(chunk_size)
+                self.assertEqual(scanner.variables, ["s"])
+                self.assertEqual(scanner.bindings, 4)
+                self.assertEqual(rows, [])
+
+    def test_captures_bindings(self):
+        for chunk_size in [1, 7, 64, len(self.document)]:
+            with self.subTest(chunk_size=chunk_size):
+                _, rows = self.scan(chunk_size, capture_bindings=True)
+                self.assertEqual(rows, self.rows)
+
+    def test_head_is_available_before_the_bindings(self):
+        scanner = SparqlJsonScanner()
+        scanner.feed(self.document[: self.document.index(b"bindings")])
+        self.assertEqual(scanner.head, {"vars": ["s"]})
+
+
+# NOTE: the stand-in endpoints are deliberately slow; keep their requests out
+# of the slow request log
+@override_settings(SLOW_REQUEST_THRESHOLD_MS=float("inf"))
+class SparqlProxyTest(TestCase):
+    def setUp(self):
+        self.endpoint = StandInEndpoint().__enter__()
+        self.backend = SparqlEndpointConfiguration.objects.create(
+            name="Stand-in", slug="stand-in", url=self.endpoint.url, proxy_enabled=True
+        )
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.rows_dir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(
+            SPARQL_CACHE_DIR=self.cache_dir.name,
+            SPARQL_ROWS_DIR=self.rows_dir.name,
+            COMPLETION_CACHE_DIR=Path(self.cache_dir.name) / "completions",
+        )
+        self.settings.enable()
+        result_cache.clear()
+
+    def tearDown(self):
+        result_cache.clear()
+        pools.clear()
+        self.settings.disable()
+        self.cache_dir.cleanup()
+        self.rows_dir.cleanup()
+        self.endpoint.__exit__()
+
+    def query(self, query, **headers):
+        response = self.client.get(
+            "/api/backends/stand-in/sparql", {"query": query}, headers=headers
+        )
+        # NOTE: consume streamed bodies so that results get cached
+        response.body = content(response)
+        return response
+
+    def test_upstream_failure_after_first_chunk_is_not_a_complete_body(self):
+        self.endpoint.truncate = 10
+        response = self.client.get(
+            "/api/backends/stand-in/sparql", {"query": "SELECT * { ?s ?p ?o }"}
+        )
+        self.assertEqual(response.status_code, 200)
+        with self.assertRaises(FlightError):
+            content(response)
+        response.close()
+
+        self.endpoint.truncate = None
+        self.assertEqual(self.query("SELECT * { ?s ?p ?o }").body, RESULT)
+        self.assertEqual(len(self.endpoint.requests), 2)
+
+    def test_sends_minified_templates(self):
+        self.backend.sort_key = "1"
+        self.backend.save()
+        response = self.client.get("/api/backends/stand-in/")
+        self.assertEqual(response.json()["hover"], minify_template(self.backend.hover))
+        self.assertNotIn("#", response.json()["subject_completion"].split("PREFIX")[0])
+        response = self.client.get("/api/backends/stand-in/", {"templates": "source"})
+        self.assertEqual(response.json()["hover"], self.backend.hover)
+
+    def test_sends_template_digests_and_serves_templates_once(self):
+        self.backend.sort_key = "1"
+        self.backend.save()
+        copy = SparqlEndpointConfiguration.objects.create(
+            name="Copy", slug="copy", url=self.endpoint.url, sort_key="2"
+        )
+        distinct = {minify_template(getattr(copy, name)) for name in TEMPLATE_FIELDS}
+        self.assertEqual(QueryTemplate.objects.count(), len(distinct))
+        config = self.client.get(
+            "/api/backends/stand-in/", {"templates": "hash"}
+        ).json()
+        digest = config["hover"]
+        self.assertEqual(
+            digest,
+            self.client.get("/api/backends/copy/", {"templates": "hash"}).json()[
+                "hover"
+            ],
+        )
+        response = self.client.get(f"/api/templates/{digest}")
+        self.assertEqual(response.content.decode(), minify_template(self.backend.hover))
+        self.assertIn("immutable", response["Cache-Control"])
+        response = self.client.get(
+            f"/api/templates/{digest}", headers={"If-None-Match": f'"{digest}"'}
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # NOTE: templates are only stored on save(), never by lookups; until
+        # then, they are sent as text
+        count = QueryTemplate.objects.count()
+        SparqlEndpointConfiguration.objects.filter(pk=copy.pk).update(hover="ASK {}")
+        config = self.client.get("/api/backends/copy/", {"templates": "hash"}).json()
+        self.assertEqual(config["hover"], "ASK {}")
+        self.assertEqual(
+            config["subject_completion"],
+            QueryTemplate.digest_of(copy.subject_completion),
+        )
+        ask = QueryTemplate.digest_of("ASK {}")
+        self.assertEqual(self.client.get(f"/api/templates/{ask}").status_code, 404)
+        self.assertEqual(self.client.get("/api/templates/unknown").status_code, 404)
+        self.assertEqual(QueryTemplate.objects.count(), count)
+        copy.refresh_from_db()
+        copy.save()
+        config = self.client.get("/api/backends/copy/", {"templates": "hash"}).json()
+        self.assertEqual(config["hover"], ask)
+        self.assertEqual(self.client.get(f"/api/templates/{ask}").content, b"ASK {}")
+        self.assertEqual(self.client.get(f"/api/templates/{digest}").status_code, 200)
+
+    def test_exports_the_templates_of_backends_to_the_dist_database(self):
+        self.backend.sort_key = "1"
+        self.backend.save()
+        base = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, base)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name LIKE 'api_%'"
+            )
+            tables = [sql for (sql,) in cursor.fetchall()]
+        with sqlite3.connect(base / "db.sqlite3.dist") as dist:
+            for sql in tables:
+                dist.execute(sql)
+        SparqlEndpointConfiguration.objects.filter(pk=self.backend.pk).update(
+            hover="ASK { ?s ?p ?o }"
+        )
+        with override_settings(BASE_DIR=base / "backend"):
+            call_command(
+                "export_to_dist", "--backends", "--force", stdout=io.StringIO()
+            )
+
+        # NOTE: deployed, the dist database replaces the templates
+        with sqlite3.connect(base / "db.sqlite3.dist") as dist:
+            rows = dist.execute("SELECT digest, text FROM api_querytemplate").fetchall()
+        QueryTemplate.objects.all().delete()
+        QueryTemplate.objects.bulk_create(
+            [QueryTemplate(digest=digest, text=text) for digest, text in rows]
+        )
+        config = self.client.get(
+            "/api/backends/stand-in/", {"templates": "hash"}
+        ).json()
+        self.assertEqual(config["hover"], QueryTemplate.digest_of("ASK { ?s ?p ?o }"))
+        for field in TEMPLATE_FIELDS:
+            response = self.client.get(f"/api/templates/{config[field]}")
+            self.assertEqual(response.status_code, 200, field)
+        self.assertEqual(
+            self.client.get(f"/api/templates/{config['hover']}").content,
+            b"ASK { ?s ?p ?o }",
+        )
+
+    def test_detects_and_serves_capabilities(self):
+        self.backend.sort_key = "1"
+        self.backend.save()
+        self.endpoint.body = json.dumps({"git-hash-server": "abc123"}).encode()
+        self.endpoint.description = (
+            b"@prefix sd: <http://www.w3.org/ns/sparql-service-description#> .\n"
+            b"[] sd:supportedLanguage sd:SPARQL11Query, sd:SPARQL11Update ."
+        )
+        # NOTE: backends are probed when they are first served
+        with mock.patch("api.capabilities.start_detection") as start_detection:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.get("/api/backends/")
+        self.assertIsNone(response.json()[0]["capabilities"])
+        start_detection.assert_called_once()
+        self.assertEqual(start_detection.call_args.args[0].slug, "stand-in")
+        call_command("detect_capabilities", "stand-in", stdout=io.StringIO())
+        capabilities = self.client.get("/api/backends/").json()[0]["capabilities"]
+        self.assertEqual(capabilities["formats"], ["json"])
+        self.assertEqual(
+            {
+                key: capabilities[key]
+                for key in ("stats", "websocket", "cancellation", "update", "server")
+            },
+            {
+                "stats": True,
+                "websocket": True,
+                "cancellation": "websocket",
+                "update": True,
+                "server": "abc123",
+            },
+        )
+        self.assertFalse(any("update" in request for request in self.endpoint.requests))
+        self.assertTrue(capabilities["clear_cache"])
+        self.assertEqual(
+            self.client.get("/api/backends/stand-in/").json()["capabilities"],
+            capabilities,
+        )
+        requests = len(self.endpoint.requests)
+        call_command("detect_capabilities", stdout=io.StringIO())
+        self.assertEqual(len(self.endpoint.requests), requests)
+
+        # NOTE: the capabilities of another engine or URL are outdated
+        self.backend.engine = SparqlEndpointConfiguration.Engine.BLAZEGRAPH
+        self.backend.save()
+        self.endpoint.description = None
+        response = self.client.get("/api/backends/stand-in/")
+        self.assertIsNone(response.json()["capabilities"])
+        call_command("detect_capabilities", stdout=io.StringIO())
+        self.backend.refresh_from_db()
+        self.assertEqual(self.backend.capabilities["cancellation"], "cancelQuery")
+        self.assertIsNone(self.backend.capabilities["update"])
+        self.assertFalse(self.backend.capabilities["clear_cache"])
+        with self.assertRaises(CommandError):
+            call_command("detect_capabilities", "unknown")
+
+    def test_probes_unreachable_backends_again(self):
+        # NOTE: nothing listens on the port of a closed socket
+        with socket.socket() as closed:
+            closed.bind(("127.0.0.1", 0))
+            port = closed.getsockname()[1]
+        self.backend.url = f"http://127.0.0.1:{port}/"
+        self.backend.sort_key = "1"
+        self.backend.save()
+        output = io.StringIO()
+        call_command("detect_capabilities", "stand-in", stdout=output)
+        self.assertIn("stand-in: unreachable", output.getvalue())
+        self.backend.refresh_from_db()
+        self.assertFalse(self.backend.capabilities["reachable"])
+
+        with mock.patch("api.capabilities.start_detection") as start_detection:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.get("/api/backends/stand-in/")
+            self.assertIsNone(response.json()["capabilities"])
+            start_detection.assert_not_called()
+            with override_settings(CAPABILITY_RETRY_SECONDS=0):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client.get("/api/backends/stand-in/")
+            start_detection.assert_called_once()
+
+    def test_disabled_backend(self):
+        self.backend.proxy_enabled = False
+        self.backend.save()
+        self.assertEqual(self.query("SELECT * {}").status_code, 404)
+
+    def test_caches_by_normalized_query(self):
+        response = self.query("SELECT * WHERE { ?s ?p ?o }")
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.body, RESULT)
+
+        response = self.query("# comment\nSELECT *  WHERE {\n  ?s ?p ?o\n}")
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertEqual(response.body, RESULT)
+        self.assertEqual(len(self.endpoint.requests), 1)
+        self.assertEqual(
+            self.endpoint.requests[0]["query"], ["SELECT * WHERE { ?s ?p ?o }"]
+        )
+
+    def test_accept_is_part_of_the_key(self):
+        self.query("SELECT * {}")
+        response = self.query("SELECT * {}", Accept="text/csv")
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(self.endpoint.requests[1]["headers"]["Accept"], "text/csv")
+
+    def test_post_query(self):
+        self.query("SELECT * {}")
+        response = self.client.post(
+            "/api/backends/stand-in/sparql",
+            "SELECT * {}",
+            content_type="application/sparql-query",
+        )
+        self.assertEqual(response["X-Cache"], "HIT")
+
+    def test_ttl_zero_disables_cache(self):
+        self.backend.result_cache_ttl = 0
+        self.backend.save()
+        self.query("SELECT * {}")
+        self.assertEqual(self.query("SELECT * {}")["X-Cache"], "MISS")
+
+    def test_errors_are_not_cached(self):
+        self.endpoint.status = 400
+        self.assertEqual(self.query("SELECT * {").status_code, 400)
+        self.assertEqual(self.query("SELECT * {")["X-Cache"], "MISS")
+
+    def test_unreachable_endpoint(self):
+        self.backend.url = "http://127.0.0.1:1/sparql"
+        self.backend.save()
+        self.assertEqual(self.query("SELECT * {}").status_code, 502)
+
+    def test_unknown_priority(self):
+        response = self.query("SELECT * {}", X_Query_Priority="urgent")
+        self.assertEqual(response.status_code, 400)
+
+    def test_reports_queue_position(self):
+        self.backend.max_concurrent_queries = 1
+        self.backend.save()
+        response = self.query("SELECT * {}", X_Query_Priority="completion")
+        self.assertEqual(response["X-Queue-Position"], "0")
+        self.assertIn("X-Queue-Wait", response)
+
+    @override_settings(SPARQL_QUEUE_TIMEOUT=0.2)
+    def test_rejects_queries_that_wait_too_long_for_a_slot(self):
+        self.backend.max_concurrent_queries = 1
+        self.backend.save()
+        # NOTE: another worker holds the only slot
+        other_worker = BackendScheduler("stand-in")
+        running = other_worker.acquire("interactive", "other", limit=1)
+        try:
+            response = self.query("SELECT * {}")
+        finally:
+            other_worker.release(running)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "5")
+        self.assertEqual(response["X-Queue-Position"], "0")
+        self.assertEqual(self.endpoint.requests, [])
+        self.assertEqual(self.query("SELECT * {}").status_code, 200)
+
+    @override_settings(SPARQL_QUEUE_TIMEOUT=0.2)
+    def test_benchmark_queries_wait_for_a_slot(self):
+        self.backend.max_concurrent_queries = 1
+        self.backend.save()
+        other_worker = BackendScheduler("stand-in")
+        running = other_worker.acquire("interactive", "other", limit=1)
+        try:
+            *_, outcome = run_query(self.backend, "SELECT * {}", 1)
+        finally:
+            other_worker.release(running)
+        self.assertTrue(outcome.startswith("busy"))
+        self.assertEqual(self.endpoint.requests, [])
+        self.assertEqual(run_query(self.backend, "SELECT * {}", 1)[2], "ok")
+
+    def query_and_disconnect(self, query):
+        """Send a query from a client that disconnects while it runs."""
+        client, server = socket.socketpair()
+        client.close()
+        with server:
+            response = self.client.get(
+                "/api/backends/stand-in/sparql",
+                {"query": query},
+                **{"gunicorn.socket": server},
+            )
+        self.assertEqual(response.status_code, 499)
+        deadline = time.monotonic() + 5
+        while not self.endpoint.cancelled and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def test_cancels_qlever_query_on_disconnect(self):
+        self.backend.engine = SparqlEndpointConfiguration.Engine.QLEVER
+        self.backend.save()
+        self.endpoint.delay = 2
+        self.query_and_disconnect("SELECT * {}")
+        query_id = self.endpoint.requests[0]["headers"]["Query-Id"]
+        self.assertEqual(self.endpoint.cancelled, [(query_id, "cancel")])
+
+    def test_cancels_blazegraph_query_on_disconnect(self):
+        self.backend.engine = SparqlEndpointConfiguration.Engine.BLAZEGRAPH
+        self.backend.save()
+        self.endpoint.description = None
+        self.endpoint.delay = 2
+        self.query_and_disconnect("SELECT * {}")
+        query_id = self.endpoint.requests[0]["queryId"][0]
+        self.assertEqual(self.endpoint.cancelled, [query_id])
+        self.assertEqual(self.query("SELECT * {}")["X-Cache"], "MISS")
+
+    def test_streams_large_results_in_bounded_memory(self):
+        row = {"s": {"type": "literal", "value": "x" * 100}}
+        self.endpoint.body = json.dumps(
+            {"head": {"vars": ["s"]}, "results": {"bindings": [row] * 100_000}}
+        ).encode()
+        self.backend.result_cache_ttl = 0
+        self.backend.save()
+        registry._values = {}
+        tracemalloc.start()
+        try:
+            response = self.client.get(
+                "/api/backends/stand-in/sparql", {"query": "SELECT * {}"}
+            )
+            size = sum(len(chunk) for chunk in response.streaming_content)
+            response.close()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(size, len(self.endpoint.body))
+        self.assertLess(peak, len(self.endpoint.body) / 4)
+        rows = [
+            value
+            for (name, labels), value in registry._values.items()
+            if name == "qlue_sparql_result_rows_sum"
+        ]
+        self.assertEqual(rows, [100_000])
+
+    def download(self, format, **params):
+        response = self.client.get(
+            "/api/backends/stand-in/download",
+            {"query": "SELECT * {}", "format": format, **params},
+        )
+        response.body = content(response)
+        return response
+
+    def test_download_formats(self):
+        self.endpoint.body = json.dumps(
+            {
+                "head": {"vars": ["s", "p", "o"]},
+                "results": {
+                    "bindings": [
+                        {
+                            "s": {"type": "uri", "value": "http://x.org/a"},
+                            "p": {"type": "bnode", "value": "b0"},
+                            "o": {
+                                "type": "literal",
+                                "value": 'say "hi",\nbye',
+                                "xml:lang": "en",
+                            },
+                        },
+                        {
+                            "s": {"type": "uri", "value": "http://x.org/b"},
+                            "o": {
+                                "type": "literal",
+                                "value": "1",
+                                "datatype": "http://www.w3.org/2001/XMLSchema#int",
+                            },
+                        },
+                    ]
+                },
+            }
+        ).encode()
+        expected = {
+            "csv": (
+                "s,p,o\r\n"
+                'http://x.org/a,_:b0,"say ""hi"",\nbye"\r\n'
+                "http://x.org/b,,1\r\n"
+            ),
+            "tsv": (
+                "?s\t?p\t?o\n"
+                '<http://x.org/a>\t_:b0\t"say \\"hi\\",\\nbye"@en\n'
+                '<http://x.org/b>\t\t"1"^^<http://www.w3.org/2001/XMLSchema#int>\n'
+            ),
+            "nt": '<http://x.org/a> _:b0 "say \\"hi\\",\\nbye"@en .\n',
+        }
+        for format, body in expected.items():
+            with self.subTest(format=format):
+                response = self.download(format, name="my result")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.body.decode(), body)
+                self.assertEqual(
+                    response["Content-Disposition"],
+                    f'attachment; filename="my_result.{format}"',
+                )
+        response = self.download("jsonl")
+        self.assertEqual(
+            [json.loads(line) for line in response.body.splitlines()],
+            json.loads(self.endpoint.body)["results"]["bindings"],
+        )
+
+    def test_download_ntriples_requires_three_variables(self):
+        self.assertEqual(self.download("nt").status_code, 400)
+
+    def test_download_converts_xml_results(self):
+        self.endpoint.content_type = "application/sparql-results+xml"
+        self.endpoint.body = (
+            b'<?xml version="1.0"?>'
+            b'<sparql xmlns="http://www.w3.org/2005/sparql-results#">'
+            b'<head><variable name="s"/><variable name="o"/></head><results>'
+            b'<result><binding name="s"><uri>http://x.org/a</uri></binding>'
+            b'<binding name="o"><literal xml:lang="de">Hallo</literal></binding>'
+            b"</result></results></sparql>"
+        )
+        response = self.download("tsv")
+        self.assertEqual(
+            response.body.decode(), '?s\t?o\n<http://x.org/a>\t"Hallo"@de\n'
+        )
+
+    def test_download_unknown_format(self):
+        self.assertEqual(self.download("xlsx").status_code, 400)
+
+    def stored_result(self, rows, query="SELECT ?n {}"):
+        self.endpoint.body = json.dumps(
+            {
+                "head": {"vars": ["n"]},
+                "results": {
+                    "bindings": [
+                        {"n": {"type": "literal", "value": str(n)}} for n in range(rows)
+                    ]
+                },
+            }
+        ).encode()
+        return self.query(query)["X-Result-Id"]
+
+    def test_pages_stored_results(self):
+        key = self.stored_result(2500)
+        url = f"/api/backends/stand-in/results/{key}"
+        response = self.client.get(url, headers={"Range": "rows=1000-1002"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "rows 1000-1002/2500")
+        self.assertEqual(
+            [
+                row["n"]["value"]
+                for row in json.loads(response.content)["results"]["bindings"]
+            ],
+            ["1000", "1001", "1002"],
+        )
+        response = self.client.get(url, headers={"Range": "rows=2499-"})
+        self.assertEqual(response["Content-Range"], "rows 2499-2499/2500")
+        response = self.client.get(url, headers={"Range": "rows=2500-2600"})
+        self.assertEqual(response.status_code, 416)
+        response = self.client.get(url)
+        self.assertEqual(json.loads(content(response)), json.loads(self.endpoint.body))
+        self.assertEqual(self.query("SELECT ?n {}")["X-Result-Id"], key)
+        self.assertEqual(len(self.endpoint.requests), 1)
+
+    def test_unknown_stored_result(self):
+        response = self.client.get(f"/api/backends/stand-in/results/{'0' * 64}")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get("/api/backends/stand-in/results/..")
+        self.assertEqual(response.status_code, 400)
+
+    def test_stored_results_belong_to_their_backend(self):
+        key = self.stored_result(3)
+        SparqlEndpointConfiguration.objects.create(
+            name="Other", slug="other", url=self.endpoint.url, proxy_enabled=True
+        )
+        response = self.client.get(f"/api/backends/other/results/{key}")
+        self.assertEqual(response.status_code, 404)
+
+    def test_downloads_stored_results(self):
+        self.backend.result_cache_ttl = 0
+        self.backend.save()
+        self.stored_result(3)
+        response = self.download("csv", query="SELECT ?n {}")
+        self.assertEqual(response.body, b"n\r\n0\r\n1\r\n2\r\n")
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertEqual(len(self.endpoint.requests), 1)
+
+    def test_evicts_stored_results(self):
+        self.backend.result_cache_ttl = 0
+        self.backend.save()
+        with override_settings(SPARQL_ROWS_MAX_AGE=0):
+            key = self.stored_result(3)
+            self.assertEqual(
+                self.client.get(f"/api/backends/stand-in/results/{key}").status_code,
+                404,
+            )
+        first = self.stored_result(3)
+        size = sum(path.stat().st_size for path in Path(self.rows_dir.name).iterdir())
+        with override_settings(SPARQL_ROWS_DISK_BYTES=size + 10):
+            second = self.stored_result(3, "SELECT ?m {}")
+        self.assertFalse(Path(self.rows_dir.name, f"{first}.json").exists())
+        self.assertTrue(Path(self.rows_dir.name, f"{second}.json").exists())
+
+    def test_readers_keep_the_result_they_opened(self):
+        def store(rows):
+            writer = RowWriter("key", "stand-in")
+            writer.add(
+                [{"n": {"type": "literal", "value": str(n)}} for n in range(rows)]
+            )
+            writer.commit({"vars": ["n"]})
+
+        store(2)
+        old = open_result("key")
+        store(5)
+        new = open_result("key")
+        try:
+            self.assertEqual(len(json.loads(old.page(0, 5))["results"]["bindings"]), 2)
+            self.assertEqual(len(json.loads(new.page(0, 5))["results"]["bindings"]), 5)
+        finally:
+            old.close()
+            new.close()
+        # NOTE: only the files of the current generation are kept
+        files = sorted(path.suffix for path in Path(self.rows_dir.name).iterdir())
+        self.assertEqual(files, [".idx", ".json", ".rows"])
+
+    def preview(self, rows, query="SELECT ?n {}"):
+        self.endpoint.body = json.dumps(
+            {
+                "head": {"vars": ["n"]},
+                "results": {
+                    "bindings": [
+                        {"n": {"type": "literal", "value": str(n)}} for n in range(5)
+                    ]
+                },
+            }
+        ).encode()
+        return self.query(query, X_Preview_Rows=str(rows))
+
+    def resume(self, response):
+        response = self.client.get(
+            "/api/backends/stand-in/continue",
+            {"token": response["X-Continuation-Token"]},
+        )
+        response.body = content(response)
+        return response
+
+    def values(self, body):
+        return [row["n"]["value"] for row in json.loads(body)["results"]["bindings"]]
+
+    def test_preview_pages_with_offset(self):
+        response = self.preview(2)
+        self.assertEqual(self.values(response.body), ["0", "1"])
+        self.assertEqual(self.endpoint.requests[0]["query"], ["SELECT ?n {} LIMIT 3"])
+        self.resume(response)
+        self.assertEqual(self.endpoint.requests[1]["query"], ["SELECT ?n {} OFFSET 2"])
+
+    def test_preview_keeps_the_limit_of_the_query(self):
+        response = self.preview(2, "SELECT ?n {} LIMIT 2")
+        self.assertNotIn("X-Continuation-Token", response)
+        self.assertEqual(self.endpoint.requests[0]["query"], ["SELECT ?n {}  LIMIT 2"])
+
+    def test_preview_continues_from_row_store(self):
+        self.backend.engine = SparqlEndpointConfiguration.Engine.JENA
+        self.backend.save()
+        response = self.preview(2)
+        self.assertEqual(self.values(response.body), ["0", "1"])
+        deadline = time.monotonic() + 5
+        while not is_stored(response["X-Result-Id"]) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.values(self.resume(response).body), ["2", "3", "4"])
+        self.assertEqual(len(self.endpoint.requests), 1)
+
+    @override_settings(SPARQL_ROWS_DISK_BYTES=0)
+    def test_preview_continues_by_skipping_rows(self):
+        self.backend.engine = SparqlEndpointConfiguration.Engine.JENA
+        self.backend.save()
+        response = self.preview(2)
+        self.assertEqual(self.values(self.resume(response).body), ["2", "3", "4"])
+        self.assertEqual(self.endpoint.requests[1]["query"], ["SELECT ?n {}"])
+
+    def test_invalid_continuation_token(self):
+        response = self.client.get(
+            "/api/backends/stand-in/continue", {"token": "forged"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def run_template(self, name, context):
+        return self.client.post(
+            f"/api/backends/stand-in/templates/{name}/run",
+            context,
+            content_type="application/json",
+        )
+
+    def test_runs_templates_with_a_shared_cache(self):
+        self.backend.prefixes = "PREFIX x: <http://x.org/>"
+        self.backend.save()
+        registry._values = {}
+        context = {"search_term": "ab", "limit": 10, "offset": 0}
+        name = "predicate_completion_context_insensitive"
+        response = self.run_template(name, context)
+        self.assertEqual(response.content, RESULT)
+        self.assertEqual(response["X-Cache"], "MISS")
+        query = self.endpoint.requests[0]["query"][0]
+        self.assertIn("PREFIX x: <http://x.org/>", query)
+        self.assertIn('REGEX(STR(?searchLabel), "^ab", "i")', query)
+        self.assertIn("LIMIT 10", query)
+        self.assertEqual(self.run_template(name, context)["X-Cache"], "HIT")
+        self.assertEqual(len(self.endpoint.requests), 1)
+        self.assertEqual(
+            sorted(
+                dict(labels)["cache"]
+                for (metric, labels), _ in registry._values.items()
+                if metric == "qlue_completion_duration_seconds_count"
+            ),
+            ["HIT", "MISS"],
+        )
+
+    def test_rejects_unknown_templates_and_contexts(self):
+        self.assertEqual(self.run_template("name", {}).status_code, 404)
+        response = self.run_template("hover", {"entity": ["a"]})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(COMPLETION_WARMUP_PREFIXES=2, COMPLETION_WARMUP_LIMIT=5)
+    def test_warms_up_completions_after_template_changes(self):
+        index_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(index_dir.cleanup)
+        self.backend.api_token = "secret"
+        self.backend.save()
+        url = "/api/backends/stand-in/warmup"
+
+        def finished(job=None):
+            for _ in range(100):
+                report = self.client.get(url, {"token": "secret"}).json()
+                if report.get("status") == "finished" and job in (None, report["job"]):
+                    # NOTE: the job thread must not outlive the overridden settings
+                    running = running_warmup("stand-in")
+                    if running is not None:
+                        running.thread.join(5)
+                    return report
+                time.sleep(0.05)
+            self.fail("The warm-up did not finish")
+
+        with override_settings(COMPLETION_INDEX_DIR=index_dir.name):
+            self.assertEqual(self.client.post(f"{url}?token=wrong").status_code, 403)
+            self.assertEqual(self.client.get(url, {"token": "secret"}).status_code, 404)
+            self.client.force_login(
+                User.objects.create_superuser("admin", "admin@example.com", "admin")
+            )
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.patch(
+                    "/api/backends/stand-in/templates",
+                    {"hover": "SELECT * {}"},
+                    content_type="application/json",
+                )
+            self.assertEqual(response.status_code, 200)
+            report = finished()
+            # NOTE: the empty search term and two prefixes of each length
+            self.assertEqual(report["total"], 4 * 5)
+            self.assertEqual((report["done"], report["failed"]), (20, 0))
+            self.assertEqual(report["templates"]["subject_completion"]["queries"], 5)
+            self.assertEqual(len(self.endpoint.requests), 20)
+            queries = [request["query"][0] for request in self.endpoint.requests]
+            self.assertTrue(any('"^s", "i"' in query for query in queries))
+            self.assertTrue(any('"^co", "i"' in query for query in queries))
+
+            # NOTE: the results are shared with all workers, not kept by the
+            # process that ran the job
+            result_cache.clear()
+            with sqlite3.connect(cache_path("stand-in")) as cache:
+                (count,) = cache.execute("SELECT COUNT(*) FROM results").fetchone()
+            self.assertEqual(count, 20)
+            context = {"search_term": "co", "limit": 5, "offset": 0}
+            response = self.run_template("subject_completion", context)
+            self.assertEqual(response["X-Cache"], "HIT")
+            self.assertEqual(len(self.endpoint.requests), 20)
+
+            # NOTE: a later job refreshes the cached completions
+            response = self.client.post(f"{url}?token=secret")
+            self.assertEqual(response.status_code, 202)
+            job = response.json()["job"]
+            self.assertNotEqual(job, report["job"])
+            self.assertEqual(finished(job)["job"], job)
+            self.assertEqual(len(self.endpoint.requests), 40)
+
+    def test_reports_slow_patterns_when_templates_are_saved(self):
+        self.client.force_login(
+            User.objects.create_superuser("admin", "admin@example.com", "admin")
+        )
+        source = SparqlEndpointConfiguration().object_completion_context_insensitive
+        self.endpoint.body = json.dumps(
+            {
+                "resultsize": 101,
+                "runtimeInformation": {
+                    "query_execution_tree": {"estimated_total_cost": 4200}
+                },
+            }
+        ).encode()
+        response = self.client.patch(
+            "/api/backends/stand-in/templates",
+            {"object_completion_context_insensitive": source},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        warnings = response.json()["warnings"]
+        self.assertEqual(
+            [warning["rule"] for warning in warnings],
+            [
+                "strstarts-caret",
+                "filter-after-group",
+                "regex-prefix",
+                "regex-prefix",
+            ],
+        )
+        self.assertEqual(warnings[1]["line"], 34)
+        self.assertIn("STRSTARTS(LCASE(STR(?qlue_ls_label))", warnings[2]["message"])
+        # NOTE: saving only lints; the cost is estimated on request
+        self.assertEqual(self.endpoint.requests, [])
+
+        response = self.client.post(
+            "/api/backends/stand-in/templates/estimate",
+            {"templates": ["object_completion_context_insensitive"]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        [estimate] = response.json()["estimates"]
+        self.assertEqual(estimate["rule"], "cost")
+        self.assertEqual(estimate["severity"], "info")
+        self.assertIn("101 rows (estimated cost 4200)", estimate["message"])
+        self.assertEqual(len(self.endpoint.requests), 1)
+
+        # NOTE: QLever groups full scans on its sorted permutations
+        query = "SELECT ?s (COUNT(*) AS ?c) { ?s ?p ?o } GROUP BY ?s LIMIT 5"
+        virtuoso = SparqlEndpointConfiguration.Engine.VIRTUOSO
+        self.assertEqual(lint_template(query, self.backend.engine), [])
+        self.assertEqual(
+            [warning["rule"] for warning in lint_template(query, virtuoso)],
+            ["full-scan"],
+        )
+        self.assertEqual(lint_template("SELECT * { ?s ?p ?o } LIMIT 5", virtuoso), [])
+        warning = lint_template('ASK { ?s ?p ?o FILTER(REGEX(?o, "a.c")) }', virtuoso)
+        self.assertEqual(warning[0]["rule"], "regex-unanchored")
+        self.assertIn("bif:contains", warning[0]["message"])
+
+    def test_request_timeouts_do_not_stay_with_pooled_connections(self):
+        dry_run(self.backend, "SELECT * {}", timeout=0.5)
+        (connection,) = pools.get(self.backend)._idle
+        self.assertEqual(connection.read_timeout, settings.SPARQL_PROXY_TIMEOUT)
+        self.assertEqual(connection.sock.gettimeout(), settings.SPARQL_PROXY_TIMEOUT)
+
+    def test_previews_draft_templates_without_saving(self):
+        url = "/api/backends/stand-in/templates/preview"
+        draft = {
+            "template": "subject_completion",
+            "source": "SELECT * { ?s ?p ?o } LIMIT {{ limit }}",
+            "context": {"limit": 7},
+        }
+        self.assertEqual(
+            self.client.post(url, draft, content_type="application/json").status_code,
+            403,
+        )
+        self.client.force_login(
+            User.objects.create_superuser("admin", "admin@example.com", "admin")
+        )
+        response = self.client.post(url, draft, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        preview = response.json()
+        self.assertEqual(preview["query"], "SELECT * { ?s ?p ?o } LIMIT 7")
+        self.assertEqual((preview["status"], preview["rows"]), (200, 1))
+        self.assertGreater(preview["seconds"], 0)
+        self.assertIsNone(preview["runtime"])
+        self.assertEqual(self.endpoint.requests[0]["query"], [preview["query"]])
+        self.backend.refresh_from_db()
+        self.assertNotIn("LIMIT 7", self.backend.subject_completion)
+
+        self.backend.engine = SparqlEndpointConfiguration.Engine.QLEVER
+        self.backend.save()
+        self.endpoint.body = json.dumps(
+            {
+                "resultsize": 42,
+                "time": {"total": "12ms", "computeResult": "10ms"},
+                "runtimeInformation": {"query_execution_tree": {"operation": "SCAN"}},
+            }
+        ).encode()
+        preview = self.client.post(url, draft, content_type="application/json").json()
+        self.assertEqual(preview["rows"], 42)
+        self.assertEqual(preview["runtime"]["time"]["total"], "12ms")
+        self.assertEqual(
+            self.endpoint.requests[1]["headers"]["Accept"],
+            "application/qlever-results+json",
+        )
+
+        draft["source"] = "{% if %}"
+        response = self.client.post(url, draft, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        draft["context"] = {"limit": [1]}
+        response = self.client.post(url, draft, content_type="application/json")
+        self.assertIn("context", response.json())
+
+    @override_settings(LABEL_CACHE_MAX_ENTRIES=3)
+    def test_resolves_labels_in_one_query(self):
+        labels_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(labels_dir.cleanup)
+        self.endpoint.body = json.dumps(
+            {
+                "head": {"vars": ["qlue_ls_entity", "qlue_ls_label"]},
+                "results": {
+                    "bindings": [
+                        {
+                            "qlue_ls_entity": {"type": "uri", "value": iri},
+                            "qlue_ls_label": {"type": "literal", "value": label},
+                        }
+                        for iri, label in [
+                            ("http://x.org/a", "A"),
+                            ("http://x.org/a", "Second"),
+                            ("http://x.org/b", "B"),
+                        ]
+                    ]
+                },
+            }
+        ).encode()
+
+        def resolve(iris):
+            return self.client.post(
+                "/api/backends/stand-in/labels", iris, content_type="application/json"
+            )
+
+        with override_settings(LABEL_CACHE_DIR=labels_dir.name):
+            iris = ["http://x.org/a", "http://x.org/b", "http://x.org/c"]
+            response = resolve(iris)
+            self.assertEqual(
+                response.json(),
+                {
+                    "http://x.org/a": {"label": "A", "alias": None},
+                    "http://x.org/b": {"label": "B", "alias": None},
+                    "http://x.org/c": {"label": None, "alias": None},
+                },
+            )
+            self.assertEqual(response["X-Cache-Misses"], "3")
+            query = self.endpoint.requests[0]["query"][0]
+            self.assertIn(
+                "VALUES ?qlue_ls_entity { <http://x.org/a> <http://x.org/b> "
+                "<http://x.org/c> }",
+                query,
+            )
+            self.assertIn("SELECT ?qlue_ls_entity ?qlue_ls_label", query)
+            self.assertNotIn("LIMIT", query)
+
+            response = resolve(["http://x.org/c", "http://x.org/a"])
+            self.assertEqual(response["X-Cache-Hits"], "2")
+            self.assertEqual(len(self.endpoint.requests), 1)
+            # NOTE: b is the least recently used label
+            resolve(["http://x.org/d"])
+            self.assertEqual(resolve(["http://x.org/b"])["X-Cache-Misses"], "1")
+            self.assertEqual(len(self.endpoint.requests), 3)
+
+            self.backend.hover = (
+                "SELECT ?qlue_ls_label { {{ entity }} ?p ?qlue_ls_label }"
+            )
+            self.backend.save()
+            self.assertEqual(resolve(["http://x.org/a"])["X-Cache-Misses"], "1")
+            self.assertEqual(resolve(["http://x.org/a>"]).status_code, 400)
+
+    def test_reuses_connections(self):
+        self.backend.result_cache_ttl = 0
+        self.backend.save()
+        self.query("SELECT * {}")
+        self.query("SELECT * {}")
+        self.assertEqual(
+            self.endpoint.requests[0]["client"], self.endpoint.requests[1]["client"]
+        )
+
+    def test_rebuilds_pool_when_url_changes(self):
+        self.backend.result_cache_ttl = 0
+        self.backend.save()
+        self.query("SELECT * {}")
+        with StandInEndpoint() as other:
+            self.backend.url = other.url
+            self.backend.save()
+            self.query("SELECT * {}")
+        self.assertEqual(len(self.endpoint.requests), 1)
+        self.assertEqual(len(other.requests), 1)
+
+    @override_settings(SPARQL_CACHE_SPILL_BYTES=10)
+    def test_spills_large_results_to_disk(self):
+        self.query("SELECT * {}")
+        self.assertEqual(len(list(Path(self.cache_dir.name).rglob("*"))), 3)
+        response = self.query("SELECT * {}")
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertEqual(response.body, RESULT)
+
+    def test_evicts_least_recently_used(self):
+        with override_settings(SPARQL_CACHE_MEMORY_BYTES=2 * len(RESULT)):
+            self.query("SELECT ?a {}")
+            self.query("SELECT ?b {}")
+            self.query("SELECT ?a {}")
+            self.query("SELECT ?c {}")
+            self.assertEqual(self.query("SELECT ?a {}")["X-Cache"], "HIT")
+            self.assertEqual(self.query("SELECT ?b {}")["X-Cache"], "MISS")
+
+
+class SchedulerTest(SimpleTestCase):
+    def setUp(self):
+        self.slot_dir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(SPARQL_SLOT_DIR=self.slot_dir.name)
+        self.settings.enable()
+        self.scheduler = BackendScheduler("stand-in")
+        self.order = []
+
+    def tearDown(self):
+        self.settings.disable()
+        self.slot_dir.cleanup()
+
+    def enqueue(self, name, priority, client, scheduler=None):
+        """Queue a query in a thread and wait until it is queued."""
+        scheduler = scheduler or self.scheduler
+        queued = scheduler.queued()
+
+        def run():
+            ticket = scheduler.acquire(priority, client, limit=1)
+            self.order.append((name, ticket.position))
+            scheduler.release(ticket)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        while scheduler.queued() == queued:
+            time.sleep(0.01)
+        return thread
+
+    def run_queued(self, *queries):
+        running = self.scheduler.acquire("interactive", "other", limit=1)
+        threads = [self.enqueue(*query) for query in queries]
+        self.scheduler.release(running)
+        for thread in threads:
+            thread.join()
+
+    def test_priority_classes(self):
+        self.run_queued(
+            ("benchmark", "benchmark", "a"),
+            ("completion", "completion", "a"),
+            ("interactive", "interactive", "a"),
+        )
+        self.assertEqual(
+            self.order, [("interactive", 0), ("completion", 0), ("benchmark", 0)]
+        )
+
+    def test_clients_take_turns(self):
+        self.run_queued(
+            ("a1", "interactive", "a"),
+            ("a2", "interactive", "a"),
+            ("a3", "interactive", "a"),
+            ("b1", "interactive", "b"),
+        )
+        self.assertEqual(self.order, [("a1", 0), ("b1", 1), ("a2", 1), ("a3", 2)])
+
+    @override_settings(SPARQL_QUEUE_MAX_LENGTH=1)
+    def test_rejects_queries_when_the_queue_is_full(self):
+        running = self.scheduler.acquire("interactive", "a", limit=1)
+        thread = self.enqueue("queued", "interactive", "a")
+        with self.assertRaises(QueueRejected) as rejected:
+            self.scheduler.acquire("interactive", "b", limit=1)
+        self.assertEqual(rejected.exception.position, 1)
+        self.scheduler.release(running)
+        thread.join()
+        self.assertEqual(self.order, [("queued", 0)])
+
+    @override_settings(SPARQL_QUEUE_TIMEOUT=0.1)
+    def test_rejects_queries_that_waited_too_long(self):
+        running = self.scheduler.acquire("interactive", "a", limit=1)
+        with self.assertRaises(QueueRejected):
+            self.scheduler.acquire("interactive", "b", limit=1)
+        self.assertEqual(self.scheduler.queued(), 0)
+        self.scheduler.release(running)
+
+    def test_cancelled_queries_leave_the_queue(self):
+        running = self.scheduler.acquire("interactive", "a", limit=1)
+        cancelled = threading.Event()
+        errors = []
+
+        def run():
+            try:
+                self.scheduler.acquire("interactive", "b", 1, cancelled)
+            except QueryCancelled as error:
+                errors.append(error)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        while self.scheduler.queued() == 0:
+            time.sleep(0.01)
+        cancelled.set()
+        thread.join()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(self.scheduler.queued(), 0)
+        self.scheduler.release(running)
+
+    def test_slots_are_shared_between_processes(self):
+        # NOTE: a second scheduler stands in for another worker process
+        running = self.scheduler.acquire("interactive", "a", limit=1)
+        thread = self.enqueue("other", "interactive", "b", BackendScheduler("stand-in"))
+        time.sleep(0.2)
+        self.assertEqual(self.order, [])
+        self.scheduler.release(running)
+        thread.join()
+        self.assertEqual(self.order, [("other", 0)])
+
+
+# NOTE: the stand-in endpoints are deliberately slow; keep their requests out
+# of the slow request log
+@override_settings(SLOW_REQUEST_THRESHOLD_MS=float("inf"))
+class CompletionIndexTest(TestCase):
+    def setUp(self):
+        self.endpoint = StandInEndpoint().__enter__()
+        self.backend = SparqlEndpointConfiguration.objects.create(
+            name="Stand-in",
+            slug="stand-in",
+            url=self.endpoint.url,
+            prefixes="PREFIX x: <http://x.org/>",
+        )
+        self.index_dir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(COMPLETION_INDEX_DIR=self.index_dir.name)
+        self.settings.enable()
+        entities = [
+            ("http://x.org/adams", "Douglas Adams", "writer", 5),
+            ("http://x.org/smith", "Adam Smith", None, 9),
+            ("http://y.org/other", None, None, 1),
+        ]
+        self.endpoint.body = json.dumps(
+            {
+                "head": {"vars": ["qlue_ls_entity", "qlue_ls_label"]},
+                "results": {
+                    "bindings": [
+                        {
+                            "qlue_ls_entity": {"type": "uri", "value": iri},
+                            "qlue_ls_count": {"type": "literal", "value": str(count)},
+                            **(
+                                {"qlue_ls_label": {"type": "literal", "value": label}}
+                                if label
+                                else {}
+                            ),
+                            **(
+                                {"qlue_ls_alias": {"type": "literal", "value": alias}}
+                                if alias
+                                else {}
+                            ),
+                        }
+                        for iri, label, alias, count in entities
+                    ]
+                },
+            }
+        ).encode()
+
+    def tearDown(self):
+        pools.clear()
+        self.settings.disable()
+        self.index_dir.cleanup()
+        self.endpoint.__exit__()
+
+    def complete(self, **params):
+        response = self.client.get("/api/backends/stand-in/complete", params)
+        if response.status_code != 200:
+            return response.status_code
+        return [
+            binding["qlue_ls_entity"]["value"].removeprefix("http://x.org/")
+            for binding in json.loads(response.content)["results"]["bindings"]
+        ]
+
+    def test_completes_from_index(self):
+        self.assertEqual(self.complete(), 404)
+        call_command(
+            "build_completion_index",
+            "stand-in",
+            "--kinds",
+            "subject",
+            stdout=io.StringIO(),
+        )
+        self.assertIn("LIMIT 100000", self.endpoint.requests[0]["query"][0])
+        self.assertEqual(self.complete(), ["smith", "adams", "http://y.org/other"])
+        self.assertEqual(self.complete(q="ada"), ["smith", "adams"])
+        self.assertEqual(self.complete(q="douglas ad"), ["adams"])
+        self.assertEqual(self.complete(q="writ"), ["adams"])
+        self.assertEqual(self.complete(q="x:ad"), ["adams"])
+        self.assertEqual(self.complete(q="ada", kind="predicate"), [])
+        self.assertEqual(self.complete(kind="class"), 400)
+        self.assertEqual(self.complete(limit=-1), ["smith"])
+        self.assertEqual(self.complete(limit=2), ["smith", "adams"])
+        self.assertEqual(self.complete(limit="1.5"), 400)
+
+    def test_benchmarks_templates_with_comparable_inputs(self):
+        call_command("build_completion_index", "stand-in", stdout=io.StringIO())
+        output = Path(self.index_dir.name) / "bench.json"
+        source = Path(self.index_dir.name) / "subject.rq"
+        source.write_text("SELECT * { ?qlue_ls_entity ?p ?o } LIMIT {{ limit }}")
+
+        def bench(*args):
+            self.endpoint.requests = []
+            stdout = io.StringIO()
+            call_command(
+                "bench_templates",
+                "stand-in",
+                "--templates",
+                "subject_completion",
+                "object_completion_context_sensitive",
+                "--samples",
+                "5",
+                *args,
+                stdout=stdout,
+            )
+            return stdout.getvalue()
+
+        bench("--output", str(output))
+        report = json.loads(output.read_text())
+        result = report["templates"]["object_completion_context_sensitive"]
+        self.assertEqual(
+            (result["queries"], result["ok"], result["timeouts"]), (5, 5, 0)
+        )
+        self.assertEqual(result["rows"]["median"], 3)
+        self.assertLessEqual(result["p50"], result["p95"])
+        queries = [request["query"][0] for request in self.endpoint.requests]
+        self.assertEqual(len(queries), 10)
+        self.assertTrue(
+            any("?qlue_ls_subject <http://x.org/" in query for query in queries)
+        )
+
+        stdout = bench(
+            "--source", f"subject_completion={source}", "--compare", str(output)
+        )
+        self.assertEqual(stdout.count("vs. baseline"), 2)
+        self.assertTrue(
+            any(
+                request["query"][0].startswith("SELECT * { ?qlue_ls_entity ?p ?o }")
+                for request in self.endpoint.requests
+            )
+        )
+
+
+# NOTE: the stand-in endpoints are deliberately slow; keep their requests out
+# of the slow request log
+@override_settings(SLOW_REQUEST_THRESHOLD_MS=float("inf"))
+class RequestCoalescingTest(TransactionTestCase):
+    """
+    Load test: concurrent identical queries are sent upstream only once.
+    """
+
+    def setUp(self):
+        self.endpoint = StandInEndpoint().__enter__()
+        self.endpoint.delay = 1.0
+        SparqlEndpointConfiguration.objects.create(
+            name="Stand-in",
+            slug="stand-in",
+            url=self.endpoint.url,
+            proxy_enabled=True,
+            result_cache_ttl=0,
+        )
+
+    def tearDown(self):
+        self.endpoint.__exit__()
+
+    def test_coalesces_concurrent_identical_queries(self):
+        responses = []
+
+        def run():
+            response = Client().get(
+                "/api/backends/stand-in/sparql", {"query": "SELECT * { ?s ?p ?o }"}
+            )
+            responses.append((response["X-Cache"], content(response)))
+
+        threads = [threading.Thread(target=run) for _ in range(100)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.endpoint.requests), 1)
+        self.assertEqual(len(responses), 100)
+        self.assertTrue(all(body == RESULT for _, body in responses))
+        self.assertEqual([cache for cache, _ in responses].count("MISS"), 1)
+
+    def test_pins_expire_and_cancel_unread_flights(self):
+        flight = Flight()
+        cancelled = threading.Event()
+        flight.on_abandon(cancelled.set)
+        flight.pin(timeout=0.1)
+        self.assertTrue(cancelled.wait(5))
+        self.assertFalse(flight.pinned)
+
+    def test_limits_pinned_flights_per_client(self):
+        pins = PinLimit()
+        flights = [Flight() for _ in range(3)]
+        for flight in flights[:2]:
+            self.assertTrue(pins.admit("a", flight, limit=2))
+            flight.pin()
+        self.assertFalse(pins.admit("a", flights[2], limit=2))
+        self.assertTrue(pins.admit("b", flights[2], limit=2))
+        flights[0].finish()
+        self.assertTrue(pins.admit("a", flights[2], limit=2))
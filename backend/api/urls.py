@@ -1,5 +1,5 @@
 from django.urls import path
-from api import views
+from api import completion, labels, proxy, views, warmup
 from rest_framework import routers
 
 urlpatterns = [
@@ -23,6 +23,58 @@ urlpatterns = [
         views.SparqlEndpointTemplatesViewSet.as_view({"patch": "partial_update"}),
         name="backend-templates",
     ),
+    path(
+        "backends/<slug:slug>/templates/preview",
+        views.SparqlEndpointTemplatesViewSet.as_view({"post": "preview"}),
+        name="backend-template-preview",
+    ),
+    path(
+        "backends/<slug:slug>/templates/estimate",
+        views.SparqlEndpointTemplatesViewSet.as_view({"post": "estimate"}),
+        name="backend-template-estimate",
+    ),
+    path(
+        "backends/<slug:slug>/sparql",
+        proxy.sparql_proxy,
+        name="backend-sparql",
+    ),
+    path(
+        "backends/<slug:slug>/download",
+        proxy.sparql_download,
+        name="backend-download",
+    ),
+    path(
+        "backends/<slug:slug>/results/<str:key>",
+        proxy.sparql_results,
+        name="backend-results",
+    ),
+    path(
+        "backends/<slug:slug>/continue",
+        proxy.sparql_continue,
+        name="backend-continue",
+    ),
+    path(
+        "backends/<slug:slug>/complete",
+        completion.complete,
+        name="backend-complete",
+    ),
+    path(
+        "backends/<slug:slug>/templates/<str:name>/run",
+        completion.run_template,
+        name="backend-template-run",
+    ),
+    path(
+        "backends/<slug:slug>/labels",
+        labels.resolve_labels,
+        name="backend-labels",
+    ),
+    path(
+        "backends/<slug:slug>/warmup",
+        warmup.warmup,
+        name="backend-warmup",
+    ),
+    path("templates/<str:digest>", views.get_template, name="template"),
     path("share/", views.get_or_create_share_link),
     path("share/<str:id>/", views.get_saved_query),
+    path("metrics", views.metrics, name="metrics"),
 ]
@@ -1,18 +1,39 @@
+import secrets
+
+from django.conf import settings
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from django.views.decorators.http import require_POST, require_GET
-from django.contrib.admin.views.autocomplete import JsonResponse
-from django.http import HttpResponse
+from django.http import (
+    HttpResponse,
+    HttpResponseForbidden,
+    HttpResponseNotModified,
+)
 from django.views.decorators.csrf import csrf_exempt
+from django.template import TemplateSyntaxError
 from rest_framework import generics, mixins, permissions, viewsets
+from rest_framework.response import Response
 
 from api import serializer
-from api.models import QueryExample, SavedQuery, SparqlEndpointConfiguration
+from api.bench import dry_run, estimate_cost
+from api.metrics import registry
+from api.models import (
+    TEMPLATE_FIELDS,
+    QueryExample,
+    QueryTemplate,
+    SavedQuery,
+    SparqlEndpointConfiguration,
+)
+from api.warmup import start_warmup
 from api.serializer import (
     QueryExampleSerializer,
     SparqlEndpointConfigurationListSerializer,
     SparqlEndpointConfigurationSerializer,
     SparqlEndpointTemplatesSerializer,
+    TemplateEstimateSerializer,
+    TemplatePreviewSerializer,
 )
+from api.templating import render_query
 
 
 class SparqlEndpointConfigurationViewSet(
@@ -74,7 +95,43 @@ class SparqlEndpointTemplatesViewSet(mixins.UpdateModelMixin, viewsets.GenericVi
     serializer_class = SparqlEndpointTemplatesSerializer
     lookup_field = "slug"
     permission_classes = [permissions.IsAuthenticated]
-    http_method_names = ["patch"]
+    http_method_names = ["patch", "post"]
+
+    def perform_update(self, serializer):
+        backend = serializer.save()
+        if backend.proxy_enabled:
+            transaction.on_commit(lambda: start_warmup(backend))
+
+    def preview(self, request, slug=None):
+        """
+        Render a draft of a template with a sample context and run it on the
+        backend, without saving it; returns the rendered query, the number
+        of rows, the time and the runtime information of QLever.
+        """
+        backend = self.get_object()
+        draft = TemplatePreviewSerializer(data=request.data)
+        draft.is_valid(raise_exception=True)
+        name = draft.validated_data["template"]
+        # NOTE: the backend is only changed in memory, never saved
+        if "source" in draft.validated_data:
+            setattr(backend, name, draft.validated_data["source"])
+        try:
+            query = render_query(backend, name, draft.validated_data["context"])
+        except TemplateSyntaxError as error:
+            return Response({"error": f"Invalid template: {error}"}, status=400)
+        return Response({"query": query, **dry_run(backend, query)})
+
+    def estimate(self, request, slug=None):
+        """
+        Run the saved context-insensitive completions for the empty search
+        term and report their cost; see `bench.estimate_cost`. Explicit,
+        since the queries may take up to TEMPLATE_LINT_TIMEOUT each.
+        """
+        backend = self.get_object()
+        selection = TemplateEstimateSerializer(data=request.data)
+        selection.is_valid(raise_exception=True)
+        names = selection.validated_data.get("templates", list(TEMPLATE_FIELDS))
+        return Response({"estimates": estimate_cost(backend, names)})
 
 
 # NOTE: This function is not guarded!
@@ -86,7 +143,9 @@ def get_or_create_share_link(request):
     Get or generate a sharing link for a SPARQL query
     """
     query: str = request.body.decode("utf-8")
-    (saved_query, _created) = SavedQuery.objects.get_or_create(content=query)
+    (saved_query, created) = SavedQuery.objects.get_or_create(content=query)
+    if created:
+        registry.inc("qlue_share_links_created_total")
     return HttpResponse(saved_query.id)
 
 
@@ -97,3 +156,36 @@ def get_saved_query(request, id: str):
     """
     saved_query = get_object_or_404(SavedQuery, id=id)
     return HttpResponse(saved_query.content)
+
+
+@require_GET
+def get_template(request, digest: str):
+    """
+    A minified query template by its digest, as sent in the backend
+    configuration with `?templates=hash`; cached by clients forever, since
+    the text of a digest never changes.
+    """
+    template = get_object_or_404(QueryTemplate, digest=digest)
+    if request.headers.get("If-None-Match") == f'"{digest}"':
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(template.text, content_type="text/plain; charset=utf-8")
+    response["ETag"] = f'"{digest}"'
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+
+@require_GET
+def metrics(request):
+    """
+    Expose backend metrics in the Prometheus text format.
+    Requires the configured METRICS_TOKEN as ?token query parameter.
+    """
+    token = request.GET.get("token", "")
+    if not settings.METRICS_TOKEN or not secrets.compare_digest(
+        token, settings.METRICS_TOKEN
+    ):
+        return HttpResponseForbidden("Invalid or missing token")
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,237 @@
+"""
+Warm-up of the completion cache of a backend.
+
+After the templates or prefixes of a backend are changed, the first users
+would wait for cold completions. A warm-up job runs each context-insensitive
+completion template for the empty search term and the most common one- and
+two-letter prefixes of labels in the background, with
+COMPLETION_WARMUP_WORKERS queries at a time at the lowest priority of the
+scheduler.
+
+The results are written to the completion cache of the backend, which all
+gunicorn workers share (see `completion.py`), whether or not they were
+cached already, so that a job restarts their COMPLETION_CACHE_TTL. Jobs
+started at least that often keep the completions warm.
+
+Jobs are started when templates are saved through the API or the admin, and
+on demand with `POST /api/backends/<slug>/warmup?token=<api_token>`. The
+progress and timing of the latest job of a backend, identified by its
+`job` id, are written to `COMPLETION_INDEX_DIR/<slug>.warmup.json`, which
+`GET` on the same URL returns.
+"""
+
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpRequest, HttpResponseForbidden, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from api.completion import _connect, run_completion
+from api.models import TEMPLATE_FIELDS, SparqlEndpointConfiguration
+from api.proxy import proxied_backend
+
+logger = logging.getLogger(__name__)
+
+# NOTE: context-sensitive completions depend on the query being edited
+WARMUP_TEMPLATES = tuple(
+    name
+    for name in TEMPLATE_FIELDS
+    if name != "hover" and not name.endswith("_context_sensitive")
+)
+# the most frequent initial letters of English words, used without an index
+DEFAULT_PREFIXES = {
+    1: ["s", "c", "p", "a", "m", "b", "t", "d", "r", "f", "h", "g", "e", "l"],
+    2: ["co", "re", "pr", "st", "ma", "ca", "de", "in", "pa", "be", "di", "ch"],
+}
+
+
+def common_prefixes(slug: str, length: int, count: int) -> list[str]:
+    """
+    The `count` most common lowercase prefixes of `length` letters of the
+    labels in the completion index of `slug`, weighted by entity counts.
+    """
+    connection = _connect(slug)
+    rows = []
+    if connection is not None:
+        try:
+            rows = connection.execute(
+                "SELECT lower(substr(label, 1, ?)) AS prefix FROM entries "
+                "WHERE label IS NOT NULL GROUP BY prefix ORDER BY SUM(count) DESC",
+                (length,),
+            ).fetchall()
+        except sqlite3.Error:
+            rows = []
+    prefixes = [
+        prefix for (prefix,) in rows if len(prefix) == length and prefix.isalpha()
+    ]
+    return (prefixes or DEFAULT_PREFIXES[length])[:count]
+
+
+def search_terms(slug: str) -> list[str]:
+    count = settings.COMPLETION_WARMUP_PREFIXES
+    return ["", *common_prefixes(slug, 1, count), *common_prefixes(slug, 2, count)]
+
+
+def report_path(slug: str) -> Path:
+    return Path(settings.COMPLETION_INDEX_DIR) / f"{slug}.warmup.json"
+
+
+def read_report(slug: str) -> dict | None:
+    try:
+        return json.loads(report_path(slug).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+class WarmupJob:
+    """Runs the completion templates of a backend and reports the progress."""
+
+    def __init__(self, backend: SparqlEndpointConfiguration):
+        self.backend = backend
+        self.terms = search_terms(backend.slug)
+        self._lock = threading.Lock()
+        self.thread: threading.Thread | None = None
+        self.report = {
+            "job": uuid.uuid4().hex,
+            "backend": backend.slug,
+            "status": "running",
+            "started": time.time(),
+            "finished": None,
+            "total": len(WARMUP_TEMPLATES) * len(self.terms),
+            "done": 0,
+            "failed": 0,
+            "seconds": 0.0,
+            "templates": {
+                name: {"queries": 0, "seconds": 0.0, "slowest": 0.0}
+                for name in WARMUP_TEMPLATES
+            },
+        }
+        # NOTE: warm-up queries have no client; they are grouped as one
+        self.request = HttpRequest()
+        self.request.META["REMOTE_ADDR"] = "warmup"
+
+    def run(self):
+        start = time.perf_counter()
+        self._write()
+        with ThreadPoolExecutor(
+            max_workers=settings.COMPLETION_WARMUP_WORKERS
+        ) as executor:
+            for name in WARMUP_TEMPLATES:
+                for term in self.terms:
+                    executor.submit(self._complete, name, term)
+        with self._lock:
+            self.report["status"] = "finished"
+            self.report["finished"] = time.time()
+            self.report["seconds"] = round(time.perf_counter() - start, 3)
+        self._write()
+        logger.info(
+            "Warmed up %d completions of %s in %.1fs (%d failed)",
+            self.report["done"],
+            self.backend.slug,
+            self.report["seconds"],
+            self.report["failed"],
+        )
+
+    def _complete(self, name: str, term: str):
+        start = time.perf_counter()
+        context = {
+            "search_term": term,
+            "limit": settings.COMPLETION_WARMUP_LIMIT,
+            "offset": 0,
+        }
+        try:
+            response = run_completion(
+                self.request, self.backend, name, context, "warmup", refresh=True
+            )
+            failed = response.status_code != 200
+        except Exception:
+            logger.exception("Warm-up query %s of %s failed", name, self.backend.slug)
+            failed = True
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self.report["done"] += 1
+            self.report["failed"] += failed
+            timing = self.report["templates"][name]
+            timing["queries"] += 1
+            timing["seconds"] = round(timing["seconds"] + seconds, 3)
+            timing["slowest"] = round(max(timing["slowest"], seconds), 3)
+        self._write()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return json.loads(json.dumps(self.report))
+
+    def _write(self):
+        path = report_path(self.backend.slug)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            report = json.dumps(self.report)
+            # NOTE: written under the lock, so that reports are never outdated
+            handle, temporary = tempfile.mkstemp(dir=path.parent, suffix=".json")
+            with os.fdopen(handle, "w") as file:
+                file.write(report)
+            os.replace(temporary, path)
+
+
+_running: dict[str, WarmupJob] = {}
+_running_lock = threading.Lock()
+
+
+def start_warmup(backend: SparqlEndpointConfiguration) -> WarmupJob:
+    """Start a warm-up job for `backend`, unless one is running already."""
+    with _running_lock:
+        job = _running.get(backend.slug)
+        if job is not None:
+            return job
+        job = _running[backend.slug] = WarmupJob(backend)
+
+    def run():
+        try:
+            job.run()
+        except Exception:
+            logger.exception("Warm-up of %s failed", backend.slug)
+        finally:
+            with _running_lock:
+                del _running[backend.slug]
+            # NOTE: the queries of the job opened a connection in this thread
+            connection.close()
+
+    job.thread = threading.Thread(target=run, daemon=True)
+    job.thread.start()
+    return job
+
+
+def running_warmup(slug: str) -> WarmupJob | None:
+    with _running_lock:
+        return _running.get(slug)
+
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+def warmup(request, slug: str):
+    """
+    Start a warm-up job for a backend (POST), or report the progress of its
+    latest job (GET). Requires the API token of the backend as ?token.
+    """
+    backend = proxied_backend(slug)
+    token = request.GET.get("token", "")
+    if not backend.api_token or not secrets.compare_digest(token, backend.api_token):
+        return HttpResponseForbidden("Invalid or missing token")
+    if request.method == "POST":
+        return JsonResponse(start_warmup(backend).snapshot(), status=202)
+    report = read_report(slug)
+    if report is None:
+        return JsonResponse({"error": "This backend was not warmed up yet"}, status=404)
+    return JsonResponse(report)
@@ -0,0 +1,27 @@
+"""
+Admin URL configuration, imported on the first request below /admin/.
+
+The admin app is registered with `SimpleAdminConfig`, so the `admin.py`
+modules of the installed apps are only discovered here instead of at
+worker startup.
+"""
+
+from django.contrib import admin
+from django.urls import path
+
+admin.autodiscover()
+
+from api.admin import profile_download_view, profile_list_view
+
+urlpatterns = [
+    path(
+        "profiles/",
+        admin.site.admin_view(profile_list_view),
+        name="profiles",
+    ),
+    path(
+        "profiles/<str:name>",
+        admin.site.admin_view(profile_download_view),
+        name="profile-download",
+    ),
+] + admin.site.get_urls()
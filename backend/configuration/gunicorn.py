@@ -0,0 +1,20 @@
+"""
+Gunicorn server hooks, loaded with `--config python:configuration.gunicorn`.
+
+The hooks run in the gunicorn master, which does not set up Django; they
+only use modules that read the settings lazily.
+"""
+
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "configuration.settings")
+
+
+def child_exit(server, worker):
+    """Archive the metrics of an exited worker, see api/metrics.py."""
+    from api.metrics import retire_worker
+
+    try:
+        retire_worker(worker.pid)
+    except OSError:
+        server.log.exception("Could not archive the metrics of worker %s", worker.pid)
@@ -0,0 +1,54 @@
+"""
+Defer the import of optional modules that libraries import eagerly.
+
+DRF imports `markdown` in `rest_framework.compat` whenever it is installed,
+although it only uses it to render view descriptions in the browsable API.
+`lazy_import` registers such a module with importlib's `LazyLoader`: the
+`import` statement binds the module, and its code runs on the first
+attribute access.
+"""
+
+import importlib.util
+import sys
+
+LAZY_IMPORTS = ["markdown"]
+
+# NOTE: the names registered with `lazy_import`, and those whose code has run
+_registered: set[str] = set()
+_loaded: set[str] = set()
+
+
+class _RecordingLoader:
+    """Wraps the loader of a lazy module to record when its code runs."""
+
+    def __init__(self, name: str, loader):
+        self.name = name
+        self.loader = loader
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        # NOTE: the module keeps its own loader once it is loaded
+        module.__spec__.loader = module.__loader__ = self.loader
+        self.loader.exec_module(module)
+        _loaded.add(self.name)
+
+
+def lazy_import(name: str):
+    """Register `name` to be loaded on first use; no-op if not installed."""
+    if name in sys.modules:
+        return
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        return
+    spec.loader = importlib.util.LazyLoader(_RecordingLoader(name, spec.loader))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    _registered.add(name)
+    spec.loader.exec_module(module)
+
+
+def is_loaded(name: str) -> bool:
+    """Whether the code of module `name` has run, i.e. it is not a pending lazy module."""
+    return name in sys.modules and (name not in _registered or name in _loaded)
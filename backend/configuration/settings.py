@@ -11,8 +11,11 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 
+from configuration.lazy_imports import LAZY_IMPORTS, lazy_import
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -30,10 +33,16 @@ ALLOWED_HOSTS = ["*"]
 USE_X_FORWARDED_HOST = not DEBUG or (os.environ.get("IS_PROXIED", "False") == "True")
 SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
 
+# NOTE: must run before DRF is imported, see lazy_imports.py
+for module in LAZY_IMPORTS:
+    lazy_import(module)
+
 # Application definition
 
 INSTALLED_APPS = [
-    "django.contrib.admin",
+    # NOTE: SimpleAdminConfig skips admin.autodiscover() at startup;
+    # the admin is loaded on the first /admin/ request (see urls.py)
+    "django.contrib.admin.apps.SimpleAdminConfig",
     "django.contrib.auth",
     "django.contrib.contenttypes",
     "django.contrib.sessions",
@@ -45,6 +54,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.middleware.RequestTimingMiddleware",
+    "api.profiling.ProfilingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
@@ -120,6 +131,152 @@ REST_FRAMEWORK = {
 }
 
 
+# Metrics
+# The /api/metrics endpoint requires METRICS_TOKEN as ?token query parameter
+# and is disabled while no token is configured. Every worker process writes
+# its metrics to METRICS_DIR, the endpoint aggregates them; the counters of
+# exited workers are kept in METRICS_DIR/archive.json.
+
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+METRICS_DIR = Path(
+    os.environ.get("METRICS_DIR", Path(tempfile.gettempdir()) / "qlue-ui-metrics")
+)
+METRICS_FLUSH_INTERVAL = 1.0
+
+# Request timing
+# Every response carries a Server-Timing header (db, serialize, total) unless
+# SERVER_TIMING is False. Requests slower than SLOW_REQUEST_THRESHOLD_MS are
+# logged together with their SQL queries, without the query string, which may
+# carry tokens.
+
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "True") == "True"
+SLOW_REQUEST_THRESHOLD_MS = float(os.environ.get("SLOW_REQUEST_THRESHOLD_MS", "1000"))
+
+# Profiling
+# Requests with the header `X-Profile: <PROFILING_TOKEN>` (or a random
+# PROFILING_SAMPLE_RATE fraction of all requests) are run under cProfile.
+# The newest PROFILING_MAX_FILES profiles are kept and listed in the admin.
+
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN", "")
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_DIR = Path(
+    os.environ.get("PROFILING_DIR", Path(tempfile.gettempdir()) / "qlue-ui-profiles")
+)
+PROFILING_MAX_FILES = int(os.environ.get("PROFILING_MAX_FILES", "50"))
+
+
+# SPARQL proxy
+# Results of the SPARQL proxy are cached per worker process. Bodies larger
+# than SPARQL_CACHE_SPILL_BYTES are written to SPARQL_CACHE_DIR instead of
+# being kept in memory. Every worker keeps up to SPARQL_POOL_SIZE idle
+# keep-alive connections per backend. The slots limiting concurrent queries
+# per backend are lock files in SPARQL_SLOT_DIR, shared by all workers. Each
+# worker queues up to SPARQL_QUEUE_MAX_LENGTH queries per backend for at most
+# SPARQL_QUEUE_TIMEOUT seconds (0 disables either bound).
+# Complete SPARQL JSON results are stored as rows in SPARQL_ROWS_DIR, shared
+# by all workers, for SPARQL_ROWS_MAX_AGE seconds and up to
+# SPARQL_ROWS_DISK_BYTES in total (0 disables the row store). Previews on
+# engines without cheap OFFSET keep their query running to store the full
+# result for up to SPARQL_PIN_SECONDS after the client left, at most
+# SPARQL_PINS_PER_CLIENT queries per client and worker.
+
+SPARQL_PROXY_TIMEOUT = float(os.environ.get("SPARQL_PROXY_TIMEOUT", "300"))
+SPARQL_CONNECT_TIMEOUT = float(os.environ.get("SPARQL_CONNECT_TIMEOUT", "10"))
+SPARQL_POOL_SIZE = int(os.environ.get("SPARQL_POOL_SIZE", "8"))
+SPARQL_QUEUE_MAX_LENGTH = int(os.environ.get("SPARQL_QUEUE_MAX_LENGTH", "100"))
+SPARQL_QUEUE_TIMEOUT = float(os.environ.get("SPARQL_QUEUE_TIMEOUT", "60"))
+SPARQL_SLOT_DIR = Path(
+    os.environ.get(
+        "SPARQL_SLOT_DIR", Path(tempfile.gettempdir()) / "qlue-ui-sparql-slots"
+    )
+)
+SPARQL_CACHE_DIR = Path(
+    os.environ.get(
+        "SPARQL_CACHE_DIR", Path(tempfile.gettempdir()) / "qlue-ui-sparql-cache"
+    )
+)
+SPARQL_CACHE_MEMORY_BYTES = int(
+    os.environ.get("SPARQL_CACHE_MEMORY_BYTES", 64 * 1024 * 1024)
+)
+SPARQL_CACHE_DISK_BYTES = int(
+    os.environ.get("SPARQL_CACHE_DISK_BYTES", 1024 * 1024 * 1024)
+)
+SPARQL_CACHE_SPILL_BYTES = int(os.environ.get("SPARQL_CACHE_SPILL_BYTES", 1024 * 1024))
+SPARQL_ROWS_DIR = Path(
+    os.environ.get(
+        "SPARQL_ROWS_DIR", Path(tempfile.gettempdir()) / "qlue-ui-sparql-rows"
+    )
+)
+SPARQL_ROWS_DISK_BYTES = int(
+    os.environ.get("SPARQL_ROWS_DISK_BYTES", 2 * 1024 * 1024 * 1024)
+)
+SPARQL_ROWS_MAX_AGE = float(os.environ.get("SPARQL_ROWS_MAX_AGE", "3600"))
+SPARQL_PIN_SECONDS = float(os.environ.get("SPARQL_PIN_SECONDS", "60"))
+SPARQL_PINS_PER_CLIENT = int(os.environ.get("SPARQL_PINS_PER_CLIENT", "2"))
+
+
+# Completions
+# Indexes built by the build_completion_index command, one SQLite database
+# per backend, are kept in COMPLETION_INDEX_DIR. Results of completions run
+# on the server are cached in one SQLite database per backend in
+# COMPLETION_CACHE_DIR, shared by all workers, for COMPLETION_CACHE_TTL
+# seconds; the least recently used results are evicted beyond
+# COMPLETION_CACHE_MAX_ENTRIES per backend. Warm-up jobs refresh the cached
+# context-insensitive completions for the empty search term and the
+# COMPLETION_WARMUP_PREFIXES most common one- and two-letter prefixes each,
+# with COMPLETION_WARMUP_WORKERS queries at a time and the result size limit
+# COMPLETION_WARMUP_LIMIT of the editor. Start them (POST
+# /api/backends/<slug>/warmup) at least every COMPLETION_CACHE_TTL seconds,
+# e.g. from cron, to keep the completions warm.
+
+COMPLETION_INDEX_DIR = Path(
+    os.environ.get("COMPLETION_INDEX_DIR", BASE_DIR / "completion-index")
+)
+COMPLETION_CACHE_DIR = Path(
+    os.environ.get(
+        "COMPLETION_CACHE_DIR", Path(tempfile.gettempdir()) / "qlue-ui-completion-cache"
+    )
+)
+COMPLETION_CACHE_TTL = int(os.environ.get("COMPLETION_CACHE_TTL", "86400"))
+COMPLETION_CACHE_MAX_ENTRIES = int(
+    os.environ.get("COMPLETION_CACHE_MAX_ENTRIES", "100000")
+)
+COMPLETION_WARMUP_PREFIXES = int(os.environ.get("COMPLETION_WARMUP_PREFIXES", "10"))
+COMPLETION_WARMUP_WORKERS = int(os.environ.get("COMPLETION_WARMUP_WORKERS", "4"))
+COMPLETION_WARMUP_LIMIT = int(os.environ.get("COMPLETION_WARMUP_LIMIT", "101"))
+
+# Template linting
+# Saved templates are checked for slow patterns, see api/lint.py. For QLever,
+# the cost of the context-insensitive completions can be estimated on request
+# (POST /api/backends/<slug>/templates/estimate or the admin action), by
+# running them once for the empty search term with a timeout of
+# TEMPLATE_LINT_TIMEOUT seconds (0 disables this); runs slower than
+# TEMPLATE_LINT_SLOW_SECONDS are reported as warnings.
+
+TEMPLATE_LINT_TIMEOUT = float(os.environ.get("TEMPLATE_LINT_TIMEOUT", "10"))
+TEMPLATE_LINT_SLOW_SECONDS = float(os.environ.get("TEMPLATE_LINT_SLOW_SECONDS", "1"))
+
+# Capabilities
+# The features of SPARQL endpoints are probed when their URL or engine is
+# changed in the admin, when a backend without current capabilities is first
+# served, and by `manage.py detect_capabilities`; each probe request times
+# out after CAPABILITY_PROBE_TIMEOUT seconds. Endpoints that no probe reached
+# are probed again when served, at most every CAPABILITY_RETRY_SECONDS.
+
+CAPABILITY_PROBE_TIMEOUT = float(os.environ.get("CAPABILITY_PROBE_TIMEOUT", "10"))
+CAPABILITY_RETRY_SECONDS = float(os.environ.get("CAPABILITY_RETRY_SECONDS", "300"))
+
+# Labels
+# Labels resolved by /api/backends/<slug>/labels are cached in one SQLite
+# database per backend in LABEL_CACHE_DIR, shared by all workers, for
+# LABEL_CACHE_TTL seconds; the least recently used labels are evicted beyond
+# LABEL_CACHE_MAX_ENTRIES per backend.
+
+LABEL_CACHE_DIR = Path(os.environ.get("LABEL_CACHE_DIR", BASE_DIR / "label-cache"))
+LABEL_CACHE_TTL = int(os.environ.get("LABEL_CACHE_TTL", "86400"))
+LABEL_CACHE_MAX_ENTRIES = int(os.environ.get("LABEL_CACHE_MAX_ENTRIES", "100000"))
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
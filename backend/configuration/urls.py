@@ -15,10 +15,11 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
-from django.contrib import admin
 from django.urls import include, path
 
 urlpatterns = [
-    path("admin/", admin.site.urls),
+    # NOTE: passing the admin URLconf as a dotted path (instead of
+    # `admin.site.urls`) defers importing it until the first /admin/ request
+    path("admin/", ("configuration.admin_urls", "admin", "admin")),
     path("api/", include("api.urls")),
 ]
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""
+Fast container startup helpers.
+
+Running `manage.py migrate` imports Django, every installed app and all
+migration modules, even when the database schema is already up to date.
+This script only uses the standard library: it fingerprints the shipped
+migrations and compares the result with the fingerprint recorded in the
+database after the last successful migration. Django is only started when
+the two differ.
+
+USAGE:
+    python startup.py migrate [options]
+    python startup.py wait-ready <url> [options]
+
+COMMANDS:
+    migrate         Run `manage.py migrate --noinput` unless the recorded
+                    migration fingerprint matches the shipped migrations
+    wait-ready      Poll <url> until the API serves its first request and
+                    report the cold-start time
+
+OPTIONS:
+    --database      Path to the SQLite database (default: db.sqlite3 next to this file)
+    --force         (migrate) Run migrations even if the fingerprint matches
+    --since         (wait-ready) UNIX timestamp the cold start is measured from
+    --timeout       (wait-ready) Give up after this many seconds (default: 120)
+
+EXAMPLES:
+    # Used by entrypoint.sh on every container start
+    python startup.py migrate
+
+    # Report the time from container start to the first served request
+    python startup.py wait-ready http://127.0.0.1:8000/api/backends/ --since "$(date +%s.%N)"
+"""
+
+import argparse
+import hashlib
+import sqlite3
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+from importlib import metadata
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# Packages whose bundled migrations are part of the schema (django.contrib.*)
+MIGRATION_PACKAGES = ["django"]
+
+FINGERPRINT_TABLE = "startup_migration_state"
+
+
+def migration_fingerprint(base_dir: Path | None = None) -> str:
+    """
+    Hash the migration files of the project apps together with the versions
+    of the packages that ship their own migrations.
+    """
+    base_dir = base_dir or BASE_DIR
+    digest = hashlib.sha256()
+    for package in MIGRATION_PACKAGES:
+        try:
+            version = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            version = "missing"
+        digest.update(f"{package}=={version}\n".encode())
+    for path in sorted(base_dir.glob("*/migrations/*.py")):
+        digest.update(str(path.relative_to(base_dir)).encode() + b"\n")
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def recorded_fingerprint(database: Path) -> str | None:
+    """Return the fingerprint stored in the database, if any."""
+    if not database.exists():
+        return None
+    conn = sqlite3.connect(database)
+    try:
+        row = conn.execute(
+            f"SELECT fingerprint FROM {FINGERPRINT_TABLE} WHERE id = 1"
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # NOTE: the table is missing in fresh copies of db.sqlite3.dist
+        return None
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
+def record_fingerprint(database: Path, fingerprint: str):
+    conn = sqlite3.connect(database)
+    try:
+        with conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {FINGERPRINT_TABLE} ("
+                "id INTEGER PRIMARY KEY CHECK (id = 1), "
+                "fingerprint TEXT NOT NULL, "
+                "recorded_at TEXT NOT NULL)"
+            )
+            conn.execute(
+                f"INSERT OR REPLACE INTO {FINGERPRINT_TABLE} (id, fingerprint, recorded_at) "
+                "VALUES (1, ?, ?)",
+                (fingerprint, datetime.now(timezone.utc).isoformat()),
+            )
+    finally:
+        conn.close()
+
+
+def migrate(args) -> int:
+    start = time.perf_counter()
+    fingerprint = migration_fingerprint()
+
+    if not args.force and recorded_fingerprint(args.database) == fingerprint:
+        elapsed = time.perf_counter() - start
+        print(
+            f"Schema is current ({fingerprint[:12]}), skipping migrate [{elapsed:.3f}s]"
+        )
+        return 0
+
+    print(f"Schema fingerprint changed ({fingerprint[:12]}), running migrate...")
+    result = subprocess.run(
+        [sys.executable, str(BASE_DIR / "manage.py"), "migrate", "--noinput"]
+    )
+    if result.returncode != 0:
+        return result.returncode
+
+    record_fingerprint(args.database, fingerprint)
+    elapsed = time.perf_counter() - start
+    print(f"Migrations applied and fingerprint recorded [{elapsed:.3f}s]")
+    return 0
+
+
+def wait_ready(args) -> int:
+    since = args.since if args.since is not None else time.time()
+    deadline = time.time() + args.timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(args.url, timeout=1) as response:
+                status = response.status
+        except urllib.error.HTTPError as error:
+            status = error.code
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.05)
+            continue
+        if status < 500:
+            print(
+                f"Cold start: first request served after {time.time() - since:.3f}s "
+                f"(status {status})"
+            )
+            return 0
+        time.sleep(0.05)
+    print(f"Cold start: {args.url} did not answer within {args.timeout}s")
+    return 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fast container startup helpers")
+    parser.add_argument(
+        "--database",
+        type=Path,
+        default=BASE_DIR / "db.sqlite3",
+        help="Path to the SQLite database",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="Run migrations unless the schema is already current"
+    )
+    migrate_parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Run migrations even if the fingerprint matches",
+    )
+    migrate_parser.set_defaults(func=migrate)
+
+    ready_parser = subparsers.add_parser(
+        "wait-ready", help="Report the time until the first served request"
+    )
+    ready_parser.add_argument("url", help="URL to poll")
+    ready_parser.add_argument(
+        "--since",
+        type=float,
+        default=None,
+        help="UNIX timestamp the cold start is measured from",
+    )
+    ready_parser.add_argument(
+        "--timeout",
+        type=float,
+        default=120,
+        help="Give up after this many seconds",
+    )
+    ready_parser.set_defaults(func=wait_ready)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,17 @@
 
 set -e
 
+START_TIME=$(date +%s.%N)
+
 echo "Running database migrations..."
-python ./api/manage.py migrate --noinput
+# NOTE: skips importing Django entirely when the schema is already current
+python ./api/startup.py migrate
 
 echo "Syncing configuration"
 
 echo "Starting internal API server"
-cd ./api && gunicorn --bind 0.0.0.0:8000 --workers 3 configuration.wsgi:application &
+cd ./api && gunicorn --config python:configuration.gunicorn --bind 0.0.0.0:8000 --workers 3 --threads 8 configuration.wsgi:application &
+python ./api/startup.py wait-ready http://127.0.0.1:8000/api/backends/ --since "$START_TIME" &
 
 echo "Starting Caddy application..."
 exec "$@"
@@ -17,6 +17,8 @@ interface ServiceDescription {
 }
 
 const serviceConfigPromisses: Record<string, Promise<Response>> = {};
+// NOTE: templates are fetched once per digest; the browser caches them across sessions.
+const templatePromises: Record<string, Promise<string>> = {};
 
 const serviceDescriptionPromises: Promise<ServiceDescription[]> = fetch(
   `${import.meta.env.VITE_API_URL}/api/backends/`
@@ -31,7 +33,7 @@ const serviceDescriptionPromises: Promise<ServiceDescription[]> = fetch(
   })
   .then((serviceDescriptions) => {
     for (const service of serviceDescriptions) {
-      serviceConfigPromisses[service.slug] = fetch(service.api_url);
+      serviceConfigPromisses[service.slug] = fetch(`${service.api_url}?templates=hash`);
     }
     return serviceDescriptions;
   })
@@ -123,6 +125,26 @@ export async function configureBackends(editor: Editor) {
   });
 }
 
+/**
+ * Fetches the text of a query template by the digest sent in the backend configuration.
+ * Templates that the API has not stored are sent as text instead.
+ */
+function fetchTemplate(digest: string): Promise<string> {
+  if (!/^[0-9a-f]{64}$/.test(digest)) {
+    return Promise.resolve(digest);
+  }
+  templatePromises[digest] ??= fetch(
+    `${import.meta.env.VITE_API_URL}/api/templates/${digest}`
+  ).then((response) => {
+    if (!response.ok) {
+      delete templatePromises[digest];
+      throw new Error(`Error while fetching template ${digest}: status ${response.status}`);
+    }
+    return response.text();
+  });
+  return templatePromises[digest];
+}
+
 async function addService(
   languageClient: MonacoLanguageClient,
   serviceDescription: ServiceDescription,
@@ -141,28 +163,43 @@ async function addService(
       console.error('Error while fetching SPARQL endpoint configuration:', err);
     })) as UiServiceConfig;
 
+  const templates = await Promise.all(
+    [
+      sparqlEndpointconfig.subject_completion,
+      sparqlEndpointconfig.predicate_completion_context_sensitive,
+      sparqlEndpointconfig.predicate_completion_context_insensitive,
+      sparqlEndpointconfig.object_completion_context_sensitive,
+      sparqlEndpointconfig.object_completion_context_insensitive,
+      sparqlEndpointconfig.values_completion_context_sensitive,
+      sparqlEndpointconfig.values_completion_context_insensitive,
+      sparqlEndpointconfig.hover,
+    ].map((digest) =>
+      fetchTemplate(digest).catch((err) => {
+        console.error(err);
+        return '';
+      })
+    )
+  );
+
   const serviceConfig: QlueLsServiceConfig = {
     name: sparqlEndpointconfig.slug,
     url: sparqlEndpointconfig.url,
     engine: sparqlEndpointconfig.engine,
     prefixMap: sparqlEndpointconfig.prefix_map,
     queries: {
-      subjectCompletion: sparqlEndpointconfig['subject_completion'],
-      predicateCompletionContextSensitive:
-        sparqlEndpointconfig['predicate_completion_context_sensitive'],
-      predicateCompletionContextInsensitive:
-        sparqlEndpointconfig['predicate_completion_context_insensitive'],
-      objectCompletionContextSensitive: sparqlEndpointconfig['object_completion_context_sensitive'],
-      objectCompletionContextInsensitive:
-        sparqlEndpointconfig['object_completion_context_insensitive'],
-      valuesCompletionContextSensitive: sparqlEndpointconfig['values_completion_context_sensitive'],
-      valuesCompletionContextInsensitive:
-        sparqlEndpointconfig['values_completion_context_insensitive'],
-      hover: sparqlEndpointconfig['hover'],
+      subjectCompletion: templates[0],
+      predicateCompletionContextSensitive: templates[1],
+      predicateCompletionContextInsensitive: templates[2],
+      objectCompletionContextSensitive: templates[3],
+      objectCompletionContextInsensitive: templates[4],
+      valuesCompletionContextSensitive: templates[5],
+      valuesCompletionContextInsensitive: templates[6],
+      hover: templates[7],
     },
     default: is_default,
     additionalData: {
       mapViewUrl: sparqlEndpointconfig['map_view_url'],
+      capabilities: sparqlEndpointconfig.capabilities,
     },
   };
 
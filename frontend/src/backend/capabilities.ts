@@ -0,0 +1,16 @@
+import type { Capabilities, QlueLsServiceConfig } from '../types/backend';
+import { SparqlEngine } from '../types/lsp_messages';
+
+type Feature = 'stats' | 'websocket' | 'clear_cache';
+
+/**
+ * Whether the SPARQL endpoint of a backend supports a feature, as detected by the API.
+ * Until the endpoint was probed, QLever endpoints are assumed to support all of them.
+ */
+export function supports(service: QlueLsServiceConfig, feature: Feature): boolean {
+  const capabilities: Capabilities | null | undefined = service.additionalData?.capabilities;
+  if (!capabilities) {
+    return service.engine == SparqlEngine.QLever;
+  }
+  return capabilities[feature];
+}
@@ -1,5 +1,6 @@
 import type { Editor } from '../editor/init';
 import type { QlueLsServiceConfig } from '../types/backend';
+import { supports } from '../backend/capabilities';
 
 export async function setupClearCache(editor: Editor) {
   const clearCacheButton = document.getElementById('clearCacheButton')!;
@@ -23,6 +24,16 @@ export async function clearCache(editor: Editor) {
         },
       })
     );
+  } else if (!supports(backend, 'clear_cache')) {
+    document.dispatchEvent(
+      new CustomEvent('toast', {
+        detail: {
+          type: 'warning',
+          message: 'Clearing the cache is not supported by this backend.',
+          duration: 2000,
+        },
+      })
+    );
   } else {
     fetch(backend.url, {
       method: 'POST',
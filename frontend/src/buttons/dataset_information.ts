@@ -1,6 +1,6 @@
 import type { Editor } from '../editor/init';
 import type { QlueLsServiceConfig } from '../types/backend';
-import { SparqlEngine } from '../types/lsp_messages';
+import { supports } from '../backend/capabilities';
 
 export async function setupDatasetInformation(editor: Editor) {
   const datasetInformationModal = document.getElementById('datasetInformationModal')!;
@@ -45,8 +45,8 @@ async function loadDatasetInformation(editor: Editor): Promise<void> {
     throw new Error('No backend was configured.');
   }
 
-  if (service.engine != SparqlEngine.QLever) {
-    throw new Error('Dataset information is only availiable for QLever-based Backends.');
+  if (!supports(service, 'stats')) {
+    throw new Error('Dataset information is not availiable for this backend.');
   }
   fetch(`${service.url}?cmd=stats`)
     .then((response) => {
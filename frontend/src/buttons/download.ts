@@ -50,11 +50,17 @@ export function setupDownload(editor: Editor) {
       });
 
     // NOTE: Fetch and download data if the engine is QLever.
-    if (sparqlService.engine === SparqlEngine.QLever) {
-      const dataUrl = `${sparqlService.url}?query=${encodeURIComponent(query)}&action=tsv_export`;
+    // Other engines are converted to TSV by the SPARQL proxy of the API, if it is
+    // enabled for the backend.
+    const isQLever = sparqlService.engine === SparqlEngine.QLever;
+    if (isQLever || (await proxyEnabled(sparqlService.name))) {
+      const fileName = `${sparqlService.name}-${await getShareLinkId(query)}`;
+      const dataUrl = isQLever
+        ? `${sparqlService.url}?query=${encodeURIComponent(query)}&action=tsv_export`
+        : `${import.meta.env.VITE_API_URL}/api/backends/${sparqlService.name}/download?query=${encodeURIComponent(query)}&format=tsv&name=${encodeURIComponent(fileName)}`;
       const a = document.createElement('a');
       a.href = dataUrl;
-      a.setAttribute('download', `${sparqlService.name}-${await getShareLinkId(query)}.tsv`);
+      a.setAttribute('download', `${fileName}.tsv`);
       document.body.appendChild(a);
       a.click();
       document.body.removeChild(a);
@@ -63,7 +69,8 @@ export function setupDownload(editor: Editor) {
         new CustomEvent('toast', {
           detail: {
             type: 'error',
-            message: 'Download is currently only supported<br>for QLever-SPARQL-endpoints',
+            message:
+              'Download is currently only supported<br>for QLever-SPARQL-endpoints<br>and backends with the SPARQL proxy enabled',
             duration: 2000,
           },
         })
@@ -71,3 +78,10 @@ export function setupDownload(editor: Editor) {
     }
   });
 }
+
+async function proxyEnabled(slug: string): Promise<boolean> {
+  return fetch(`${import.meta.env.VITE_API_URL}/api/backends/${slug}/`)
+    .then((response) => (response.ok ? response.json() : {}))
+    .then((backend) => backend.proxy_enabled === true)
+    .catch(() => false);
+}
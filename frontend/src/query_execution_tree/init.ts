@@ -8,7 +8,7 @@ import type { QueryExecutionTree } from '../types/query_execution_tree';
 import * as d3 from 'd3';
 import { setupWebSocket } from './utils';
 import type { ExecuteQueryEventDetails } from '../results/init';
-import { SparqlEngine } from '../types/lsp_messages';
+import { supports } from '../backend/capabilities';
 import { animateGradients } from './gradients';
 import { clearQueryExecutionTree, renderQueryExecutionTree, setupAutozoom } from './tree';
 import { clearCache } from '../buttons/clear_cache';
@@ -105,13 +105,13 @@ export function setupQueryExecutionTree(editor: Editor) {
       'qlueLs/getBackend',
       {}
     )) as QlueLsServiceConfig;
-    // NOTE: Only connect to websocket if service-engine is QLever
-    if (service.engine != SparqlEngine.QLever) {
+    // NOTE: Only connect to websocket if the endpoint supports it
+    if (!supports(service, 'websocket')) {
       document.dispatchEvent(
         new CustomEvent('toast', {
           detail: {
             type: 'info',
-            message: 'Query Analysis in only availiable for the QLever engine.',
+            message: 'Query Analysis is not availiable for this backend.',
             duration: 2000,
           },
         })
@@ -141,8 +141,8 @@ export function setupQueryExecutionTree(editor: Editor) {
       'qlueLs/getBackend',
       {}
     )) as QlueLsServiceConfig;
-    // NOTE: Only connect to websocket if service-engine is QLever
-    if (service.engine != SparqlEngine.QLever) {
+    // NOTE: Only connect to websocket if the endpoint supports it
+    if (!supports(service, 'websocket')) {
       return;
     }
 
@@ -200,7 +200,7 @@ function closeModal() {
 
 /**
  * Opens the query execution tree modal.
- * Only available for the QLever engine.
+ * Only available for endpoints with the QLever websocket.
  */
 export async function openQueryExecutionTree(_editor: Editor) {
   const analysisButton = document.getElementById('analysisButton')!;
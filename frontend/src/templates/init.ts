@@ -63,6 +63,10 @@ export function setupTemplatesEditor(editor: Editor) {
     saveTemplates();
   });
 
+  document.getElementById('templatePanelPreview')!.addEventListener('click', () => {
+    previewTemplate();
+  });
+
   document.addEventListener('backend-selected', () => {
     if (templateEditor) {
       closeTemplatesEditor();
@@ -97,6 +101,7 @@ export async function openTemplatesEditor(editor: Editor) {
     return;
   }
 
+  await loadTemplateSources(config);
   currentConfig = config;
 
   // NOTE: Widen the parent container to make room for the template panel.
@@ -129,6 +134,25 @@ export async function openTemplatesEditor(editor: Editor) {
   selectTemplate(TEMPLATE_GROUPS[0].keys[0].key, editor);
 }
 
+// NOTE: The backend config sends minified templates (without comments); the editor shows and
+// saves the readable sources instead. The minified templates are kept if they can not be fetched.
+async function loadTemplateSources(config: QlueLsServiceConfig) {
+  try {
+    const response = await fetch(
+      `${import.meta.env.VITE_API_URL}/api/backends/${config.name}/?templates=source`
+    );
+    if (!response.ok) return;
+    const sources = await response.json();
+    for (const [camel, snake] of Object.entries(CAMEL_TO_SNAKE)) {
+      if (typeof sources[snake] === 'string') {
+        config.queries[camel] = sources[snake];
+      }
+    }
+  } catch (err) {
+    console.error('Error while fetching the template sources:', err);
+  }
+}
+
 function buildSelector(editor: Editor) {
   const container = document.getElementById('templateSelector')!;
   container.innerHTML = '';
@@ -265,6 +289,75 @@ function saveTemplates() {
     });
 }
 
+// NOTE: Sample context of previews; context-sensitive templates are run without context.
+const PREVIEW_CONTEXT = { limit: 10, offset: 0 };
+
+interface TemplatePreview {
+  query: string;
+  status: number | null;
+  rows: number | null;
+  seconds: number | null;
+  runtime: { time?: { total?: string; computeResult?: string } } | null;
+  error?: string;
+}
+
+/** Renders the draft of the active template on the server and runs it, without saving it. */
+async function previewTemplate() {
+  if (!currentConfig || !templateEditor || !activeKey) return;
+
+  const output = document.getElementById('templatePreview')!;
+  output.classList.remove('hidden');
+  output.textContent = 'Running preview...';
+
+  const csrftoken = getCookie('csrftoken');
+  try {
+    const response = await fetch(
+      `${import.meta.env.VITE_API_URL}/api/backends/${currentConfig.name}/templates/preview`,
+      {
+        method: 'POST',
+        credentials: 'include',
+        headers: {
+          'Content-Type': 'application/json',
+          ...(csrftoken ? { 'X-CSRFToken': csrftoken } : {}),
+        },
+        body: JSON.stringify({
+          template: CAMEL_TO_SNAKE[activeKey],
+          source: templateEditor.getValue(),
+          context: PREVIEW_CONTEXT,
+        }),
+      }
+    );
+    if (response.status === 403) {
+      output.textContent = 'Missing permissions! Log into the API to preview templates.';
+      return;
+    }
+    const preview = await response.json();
+    if (!response.ok) {
+      output.textContent = `Preview failed: ${preview.error ?? JSON.stringify(preview)}`;
+      return;
+    }
+    output.textContent = describePreview(preview as TemplatePreview);
+  } catch (err) {
+    output.textContent = `Preview failed: ${err}`;
+  }
+}
+
+function describePreview(preview: TemplatePreview): string {
+  const lines: string[] = [];
+  const ms = preview.seconds === null ? '-' : `${Math.round(preview.seconds * 1000)} ms`;
+  if (preview.error !== undefined) {
+    lines.push(`Failed after ${ms} (status ${preview.status ?? '-'}): ${preview.error}`);
+  } else {
+    lines.push(`${preview.rows} rows in ${ms}`);
+  }
+  const time = preview.runtime?.time;
+  if (time) {
+    lines.push(`QLever: ${time.total ?? '-'} total, ${time.computeResult ?? '-'} compute`);
+  }
+  lines.push('', preview.query);
+  return lines.join('\n');
+}
+
 function closeTemplatesEditor() {
   // NOTE: Stop listening for content changes.
   clearTimeout(debounceTimer);
@@ -281,8 +374,11 @@ function closeTemplatesEditor() {
   panel.classList.add('hidden');
   panel.classList.remove('flex');
 
-  // NOTE: Clear the editor container.
+  // NOTE: Clear the editor container and the preview.
   document.getElementById('templateEditorContainer')!.innerHTML = '';
+  const preview = document.getElementById('templatePreview')!;
+  preview.textContent = '';
+  preview.classList.add('hidden');
 
   // NOTE: Restore the container width (respects wide mode).
   toggleWideMode();
@@ -17,11 +17,24 @@ export interface QlueLsServiceConfig {
   additionalData: any;
 }
 
+// NOTE: detected by the API once per URL and engine of a backend; null if not detected yet.
+export interface Capabilities {
+  formats: string[];
+  stats: boolean;
+  websocket: boolean;
+  cancellation: 'websocket' | 'cancelQuery' | 'disconnect';
+  // NOTE: from the service description of the endpoint; null if it has none
+  update: boolean | null;
+  clear_cache: boolean;
+  server: string | null;
+}
+
 export interface UiServiceConfig {
   slug: string;
   url: string;
   engine: string;
   prefix_map: PrefixMap;
+  // NOTE: the digests of the minified templates (or their text), see `fetchTemplate`
   subject_completion: string;
   predicate_completion_context_sensitive: string;
   predicate_completion_context_insensitive: string;
@@ -31,4 +44,5 @@ export interface UiServiceConfig {
   values_completion_context_insensitive: string;
   hover: string;
   map_view_url?: string;
+  capabilities: Capabilities | null;
 }